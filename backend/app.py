@@ -8,13 +8,25 @@ from urllib.parse import urlencode
 from dotenv import load_dotenv
 from converter import ShopifyToEtsyConverter
 from gemini_enhancer import GeminiEnhancer
-from shopify_client import ShopifyClient, load_shopify_settings, save_shopify_settings
+from shopify_client import get_shopify_client, load_shopify_settings, save_shopify_settings
 from image_generator import ImageGenerator
+from single_flight import gemini_flight
+from content_store import ListingContentStore
+from prompt_store import ScenePromptStore
+from catalog_scheduler import CatalogImageScheduler
+from catalog_mirror import CatalogMirror
+from listing_schema import listing_parse_stats
+from image_ingest import image_ingest
+from image_workers import image_workers
+from reference_uploader import reference_cache
+from rate_limiter import gemini_image_limiter, shopify_limiter_stats
+from upload_pipeline import ProductImageUploader
+from image_gallery import ImageGallery
+from config import CATALOG_MIRROR_CONFIG, IMAGE_GENERATION_CONFIG, SHOPIFY_UPLOAD_CONFIG
 import json
+import threading
 import pandas as pd
 
-load_dotenv()
-
 app = Flask(__name__)
 CORS(app)
 
@@ -25,6 +37,49 @@ SETTINGS_FILE = os.path.abspath('settings.json')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+class LocalStores:
+    """
+    Stores locaux du backend, ouverts au premier usage et non à l'import:
+    les process spawn du pool d'images ré-importent ce module (sous le nom __mp_main__)
+    et ne doivent ni ouvrir les bases SQLite ni migrer leurs schémas.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._stores = {}
+
+    def _get(self, name, factory):
+        with self._lock:
+            if name not in self._stores:
+                self._stores[name] = factory()
+            return self._stores[name]
+
+    @property
+    def listings(self):
+        # Contenus Etsy déjà générés (réutilisés par /api/enhance tant que l'image source ne change pas)
+        return self._get('listings', lambda: ListingContentStore(os.path.join(self.folder, 'listing_content.db')))
+
+    @property
+    def prompts(self):
+        # Prompts de mise en scène déjà générés (régénérer les images sans relancer l'analyse)
+        return self._get('prompts', lambda: ScenePromptStore(
+            os.path.join(self.folder, 'scene_prompts.db'),
+            max_entries=IMAGE_GENERATION_CONFIG['prompt_cache_entries']
+        ))
+
+    @property
+    def catalog(self):
+        # Copie locale du catalogue Shopify (page produits servie sans tout re-télécharger)
+        return self._get('catalog', lambda: CatalogMirror(os.path.join(self.folder, 'catalog.db')))
+
+    @property
+    def gallery(self):
+        # Images générées conservées sur disque (ré-upload sans régénérer)
+        return self._get('gallery', lambda: ImageGallery(os.path.join(self.folder, 'gallery')))
+
+
+stores = LocalStores(OUTPUT_FOLDER)
+
 def load_settings():
     if os.path.exists(SETTINGS_FILE):
         try:
@@ -52,6 +107,18 @@ def save_settings(settings):
         print(f"Erreur lors de la sauvegarde des paramètres: {e}")
         raise e
 
+def stream_until_disconnect(generator, cancel_event):
+    """
+    Relaie un générateur SSE et signale la déconnexion du client.
+    Werkzeug ferme le générateur (GeneratorExit) quand l'écriture vers le navigateur
+    échoue: cancel_event prévient alors les workers qui tournent encore en arrière-plan.
+    """
+    try:
+        yield from generator
+    finally:
+        cancel_event.set()
+        generator.close()
+
 @app.route('/api/convert', methods=['POST'])
 def convert():
     try:
@@ -92,6 +159,10 @@ def enhance():
     try:
         data = request.json
         temp_file = data.get('temp_file')
+        # Reprendre depuis le journal au lieu de tout régénérer
+        resume = bool(data.get('resume', False))
+        # Ignorer les contenus déjà stockés et tout régénérer avec Gemini
+        regenerate = bool(data.get('regenerate', False))
         
         if not temp_file:
             return jsonify({'error': 'Fichier temporaire manquant'}), 400
@@ -108,7 +179,7 @@ def enhance():
         
         # Tester l'initialisation de Gemini
         try:
-            enhancer = GeminiEnhancer(api_key)
+            enhancer = GeminiEnhancer(api_key, content_store=stores.listings)
         except Exception as init_error:
             error_msg = str(init_error)
             print(f"❌ ERREUR initialisation Gemini: {error_msg}")
@@ -119,9 +190,13 @@ def enhance():
             else:
                 return jsonify({'error': f'Erreur initialisation Gemini: {error_msg}'}), 500
         
+        # Activé si le navigateur se déconnecte: annule les téléchargements et appels Gemini restants
+        cancel_event = threading.Event()
+        
         def generate():
             try:
-                for progress in enhancer.enhance_generator(temp_path, output_path):
+                for progress in enhancer.enhance_generator(temp_path, output_path, resume=resume,
+                                                           regenerate=regenerate, cancel_event=cancel_event):
                     yield f"data: {json.dumps(progress)}\n\n"
             except Exception as gen_error:
                 error_msg = str(gen_error)
@@ -133,7 +208,7 @@ def enhance():
                 else:
                     yield f"data: {json.dumps({'status': 'error', 'message': f'Erreur: {error_msg}'})}\n\n"
                 
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        return Response(stream_with_context(stream_until_disconnect(generate(), cancel_event)), mimetype='text/event-stream')
     
     except Exception as e:
         error_msg = str(e)
@@ -145,6 +220,23 @@ def enhance():
         else:
             return jsonify({'error': f'Erreur serveur: {error_msg}'}), 500
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Compteurs de performance (appels Gemini coalescés, téléchargements d'images, etc.)"""
+    return jsonify({
+        'gemini_single_flight': gemini_flight.stats(),
+        'listing_store': stores.listings.stats(),
+        'scene_prompts': stores.prompts.stats(),
+        'catalog_mirror': stores.catalog.stats(),
+        'listing_parse': listing_parse_stats.snapshot(),
+        'image_ingest': image_ingest.stats(),
+        'image_cache': image_ingest.cache.stats() if image_ingest.cache else None,
+        'image_workers': image_workers.stats(),
+        'image_references': reference_cache.stats(),
+        'gemini_image_limiter': gemini_image_limiter.stats(),
+        'shopify_limits': shopify_limiter_stats()
+    })
+
 @app.route('/api/preview/<filename>', methods=['GET'])
 def preview_csv(filename):
     try:
@@ -458,7 +550,7 @@ def shopify_oauth_callback():
         print(f"✅ Access token obtenu pour: {store_url}")
         
         # Tester la connexion avec le nouveau token
-        client = ShopifyClient(store_url, access_token=access_token)
+        client = get_shopify_client(store_url, access_token=access_token)
         result = client.test_connection()
         
         if result['success']:
@@ -523,10 +615,10 @@ def shopify_connect():
         # Tester la connexion avec le mode approprié
         if has_api_credentials:
             print(f"🔗 Test connexion Shopify (API Key + Secret): {store_url}")
-            client = ShopifyClient(store_url, api_key=api_key, api_secret=api_secret)
+            client = get_shopify_client(store_url, api_key=api_key, api_secret=api_secret)
         else:
             print(f"🔗 Test connexion Shopify (Access Token): {store_url}")
-            client = ShopifyClient(store_url, access_token=access_token)
+            client = get_shopify_client(store_url, access_token=access_token)
         
         result = client.test_connection()
         
@@ -582,15 +674,26 @@ def shopify_disconnect():
 
 @app.route('/api/shopify/products', methods=['GET'])
 def shopify_get_products():
-    """Récupère la liste des produits Shopify"""
+    """
+    Récupère la liste des produits Shopify (depuis la copie locale du catalogue)
+    Shopify n'est interrogé que pour les produits modifiés depuis la dernière synchro, en
+    arrière-plan: la copie locale est servie tout de suite ('syncing': synchro en cours).
+    
+    Paramètres (query string), tous optionnels:
+    - sync=full: lance une synchro complète (produits supprimés compris)
+    - limit + after: pagination par curseur (after = next_cursor de la page précédente);
+      sans limit, tout le catalogue est renvoyé
+    - fields: champs renvoyés, ex: id,title,handle,images,variants
+    - q: recherche dans le titre, le handle, les tags et les SKU
+    - format=ndjson: un produit JSON par ligne, envoyé au fil de la lecture (n'attend jamais
+      la synchro: au tout premier chargement, les produits suivent l'export dans l'ordre d'arrivée)
+    """
     try:
         settings = load_settings()
         store_url = settings.get('shopify_store_url')
         access_token = settings.get('shopify_access_token')
         
         print(f"📦 GET /api/shopify/products")
-        print(f"   Store URL: {store_url}")
-        print(f"   Access Token: {access_token[:20] if access_token else 'NONE'}...")
         
         if not store_url:
             return jsonify({'error': 'Shopify non connecté'}), 400
@@ -598,29 +701,77 @@ def shopify_get_products():
         if not access_token:
             return jsonify({'error': 'Access Token manquant - Reconnectez Shopify'}), 400
         
-        # Créer le client avec l'Access Token
-        client = ShopifyClient(store_url, access_token=access_token)
-        
-        # D'abord tester la connexion
-        test_result = client.test_connection()
-        print(f"   Test connexion: {test_result}")
+        limit = request.args.get('limit', type=int)
+        after_id = request.args.get('after', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, CATALOG_MIRROR_CONFIG['max_page_size']))
+        fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()] or None
+        search = request.args.get('q', '').strip() or None
+        
+        client = get_shopify_client(store_url, access_token=access_token)
+        
+        # Synchro: complète la première fois (rien à servir avant), ensuite en arrière-plan:
+        # changements au plus toutes les N secondes, synchro complète toutes les N heures
+        full_sync = request.args.get('sync') == 'full'
+        ndjson = request.args.get('format') == 'ndjson'
+        first_sync = stores.catalog.sync_state(client.store_url) is None
+        if first_sync and not ndjson:
+            try:
+                stores.catalog.sync(client, full=True)
+            except Exception as e:
+                # Même réponse qu'avant (message de test_connection)
+                test_result = client.test_connection()
+                return jsonify({
+                    'success': False,
+                    'error': test_result['error'] or str(e),
+                    'products': [],
+                    'count': 0
+                })
+        else:
+            stores.catalog.sync_in_background(client, full=full_sync)
+        sync_error = stores.catalog.sync_error(client.store_url)
+        syncing = stores.catalog.is_syncing(client.store_url)
         
-        if not test_result['success']:
-            return jsonify({
-                'success': False,
-                'error': test_result['error'],
-                'products': [],
-                'count': 0
-            })
+        if ndjson:
+            store = client.store_url
+            page_size = limit or CATALOG_MIRROR_CONFIG['max_page_size']
+            
+            def generate():
+                if first_sync:
+                    # Copie vide: produits lus au fil de la synchro lancée ci-dessus
+                    for count, product in enumerate(stores.catalog.follow_sync(store, search, fields, page_size), 1):
+                        yield json.dumps(product, ensure_ascii=False) + '\n'
+                        if count == limit:
+                            break
+                    return
+                # Lecture par pages: la première ligne part sans attendre la fin du catalogue
+                cursor = after_id
+                while True:
+                    page = stores.catalog.query_products(store, search, cursor, page_size, fields)
+                    for product in page['products']:
+                        yield json.dumps(product, ensure_ascii=False) + '\n'
+                    cursor = page['next_cursor']
+                    if cursor is None or limit is not None:
+                        break
+            
+            response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            response.headers['X-Catalog-Syncing'] = 'true' if syncing else 'false'
+            if sync_error:
+                response.headers['X-Catalog-Sync-Error'] = sync_error[:200]
+            return response
         
-        # Récupérer les produits
-        products = client.get_products(limit=250)
-        print(f"   ✅ {len(products)} produits récupérés")
+        page = stores.catalog.query_products(client.store_url, search, after_id, limit, fields)
+        products = page['products']
+        print(f"   ✅ {len(products)} produits (copie locale)")
         
         return jsonify({
             'success': True,
             'products': products,
-            'count': len(products)
+            'count': len(products),
+            'total': stores.catalog.count_products(client.store_url, search) if limit is not None else len(products),
+            'next_cursor': page['next_cursor'],
+            'syncing': syncing,
+            'sync_error': sync_error
         })
     except Exception as e:
         print(f"❌ Erreur shopify_get_products: {e}")
@@ -641,6 +792,7 @@ def generate_images():
         data = request.json
         temp_file = data.get('temp_file')
         num_images = int(data.get('num_images', 10))
+        regenerate_prompts = bool(data.get('regenerate_prompts', False))
         
         if not temp_file:
             return jsonify({'error': 'Fichier temporaire manquant'}), 400
@@ -662,8 +814,9 @@ def generate_images():
             return jsonify({'error': 'Fichier CSV temporaire non trouvé'}), 404
         
         # Initialiser les clients
-        shopify_client = ShopifyClient(store_url, access_token)
-        image_generator = ImageGenerator(gemini_api_key)
+        shopify_client = get_shopify_client(store_url, access_token)
+        image_generator = ImageGenerator(gemini_api_key, prompt_store=stores.prompts)
+        cancel_event = threading.Event()
         
         def generate():
             try:
@@ -679,46 +832,43 @@ def generate_images():
                 
                 yield f"data: {json.dumps({'status': 'starting', 'message': f'🚀 Démarrage génération pour {total_products} produits', 'total': total_products})}\n\n"
                 
-                processed = 0
-                for idx, row in products_with_images.iterrows():
-                    processed += 1
-                    source_url = row['Photo 1']
-                    sku = row.get('SKU', f'Produit-{processed}')
-                    
-                    yield f"data: {json.dumps({'status': 'processing', 'message': f'🖼️ Traitement {sku} ({processed}/{total_products})', 'progress': int((processed-1)/total_products*100)})}\n\n"
-                    
-                    # Générer les variations
-                    generated_urls = []
-                    for progress in image_generator.generate_product_variations(source_url, num_images):
-                        if progress['status'] == 'generated' and 'image_data' in progress:
-                            # Pour l'instant, on stocke les images localement
-                            # TODO: Upload vers Shopify quand on aura le product_id
-                            pass
-                        
-                        if progress['status'] in ['generating', 'generated', 'warning']:
-                            yield f"data: {json.dumps({'status': 'generating', 'message': progress['message'], 'progress': int((processed-1)/total_products*100 + progress.get('progress', 0)/total_products)})}\n\n"
-                        
-                        if progress['status'] == 'complete':
-                            generated_urls = progress.get('new_urls', [])
-                            
-                            # Mettre à jour le CSV avec les nouvelles URLs
-                            if generated_urls:
-                                for i, url in enumerate(generated_urls[:10]):
-                                    col_name = f'Photo {i+1}'
-                                    if col_name in df.columns:
-                                        df.loc[idx, col_name] = url
-                            
-                            yield f"data: {json.dumps({'status': 'product_done', 'message': f'✅ {sku}: {len(generated_urls)} images générées', 'progress': int(processed/total_products*100)})}\n\n"
-                        
-                        if progress['status'] == 'error':
-                            error_msg = progress.get('message', 'Erreur inconnue')
-                            yield f"data: {json.dumps({'status': 'warning', 'message': f'⚠️ {sku}: {error_msg}'})}\\n\\n"
-                            break
+                # Une seule file pour toutes les variations de tous les produits (quota Gemini partagé)
+                scheduler = CatalogImageScheduler(
+                    image_generator, shopify_client, num_images, cancel_event=cancel_event,
+                    regenerate_prompts=regenerate_prompts, gallery=stores.gallery,
+                    catalog_mirror=stores.catalog
+                )
+                jobs = [
+                    {'key': idx, 'label': str(row['SKU']) if pd.notna(row.get('SKU')) else f'Produit-{n}',
+                     'source_url': row['Photo 1'], 'sku': str(row['SKU']) if pd.notna(row.get('SKU')) else None}
+                    for n, (idx, row) in enumerate(products_with_images.iterrows(), start=1)
+                ]
+                photo_columns = [f'Photo {i}' for i in range(1, 11) if f'Photo {i}' in df.columns]
+                for col in photo_columns:
+                    df[col] = df[col].astype(object)
                 
-                # Sauvegarder le CSV mis à jour
-                df.to_csv(temp_path, index=False)
+                done_products = 0
+                try:
+                    for event in scheduler.run(jobs):
+                        if event['status'] == 'product_done':
+                            # Nouvelles URLs dans les colonnes Photo (les anciennes images sont supprimées)
+                            for col in photo_columns:
+                                position = int(col.split(' ')[1])
+                                df.loc[event['key'], col] = event['new_urls'][position - 1] if position <= len(event['new_urls']) else ''
+                            done_products += 1
+                            yield f"data: {json.dumps({'status': 'product_done', 'message': event['message'], 'progress': event['progress']})}\n\n"
+                        elif event['status'] in ('skipped', 'failed', 'product_failed'):
+                            yield f"data: {json.dumps({'status': 'warning', 'message': event['message']})}\n\n"
+                        elif event['status'] in ('indexing', 'product_started'):
+                            yield f"data: {json.dumps({'status': 'processing', 'message': event['message'], 'progress': event['progress']})}\n\n"
+                        else:
+                            yield f"data: {json.dumps({'status': 'generating', 'message': event['message'], 'progress': event['progress']})}\n\n"
+                finally:
+                    # Sauvegarder le CSV mis à jour (même si le client se déconnecte en cours de route)
+                    if done_products:
+                        df.to_csv(temp_path, index=False)
                 
-                yield f"data: {json.dumps({'status': 'complete', 'message': f'✅ Génération terminée pour {total_products} produits', 'progress': 100})}\n\n"
+                yield f"data: {json.dumps({'status': 'complete', 'message': f'✅ Génération terminée: {done_products}/{total_products} produits mis à jour', 'progress': 100})}\n\n"
                 
             except Exception as e:
                 print(f"❌ Erreur génération images: {e}")
@@ -726,7 +876,7 @@ def generate_images():
                 traceback.print_exc()
                 yield f"data: {json.dumps({'status': 'error', 'message': f'Erreur: {str(e)}'})}\n\n"
         
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        return Response(stream_with_context(stream_until_disconnect(generate(), cancel_event)), mimetype='text/event-stream')
         
     except Exception as e:
         print(f"❌ Erreur generate_images: {e}")
@@ -744,6 +894,7 @@ def generate_images_for_product():
         product_id = data.get('product_id')
         source_image_url = data.get('source_image_url')
         num_variations = int(data.get('num_variations', 10))
+        regenerate_prompts = bool(data.get('regenerate_prompts', False))
         
         if not product_id:
             return jsonify({'error': 'ID produit manquant'}), 400
@@ -766,52 +917,71 @@ def generate_images_for_product():
         
         # Initialiser le client Shopify avec le bon mode d'auth
         if api_key and api_secret and access_token:
-            shopify_client = ShopifyClient(store_url, access_token=access_token)
+            shopify_client = get_shopify_client(store_url, access_token=access_token)
         elif access_token:
-            shopify_client = ShopifyClient(store_url, access_token=access_token)
+            shopify_client = get_shopify_client(store_url, access_token=access_token)
         else:
             return jsonify({'error': '🛒 Credentials Shopify manquants!'}), 400
         
         # Initialiser le générateur d'images
-        image_generator = ImageGenerator(gemini_api_key)
+        image_generator = ImageGenerator(gemini_api_key, prompt_store=stores.prompts)
         
         print(f"🖼️ Génération de {num_variations} images pour produit {product_id}")
         print(f"   Source: {source_image_url[:80]}...")
         
-        # Générer les images et les uploader sur Shopify
+        # Générer les images et les uploader sur Shopify (au fil de la génération si pipeliné)
+        uploader = ProductImageUploader(
+            shopify_client, product_id, expected_images=num_variations
+        ) if SHOPIFY_UPLOAD_CONFIG['pipelined'] else None
         generated_images = []
-        generated_urls = []
+        generated_count = 0
+        stores.gallery.start_run(product_id, source_image_url, replace=True)
         
-        for progress in image_generator.generate_product_variations(source_image_url, num_variations):
-            if progress['status'] == 'generated' and 'image_data' in progress:
-                generated_images.append(progress['image_data'])
-                print(f"   ✅ Variation {progress['variation']} générée")
+        try:
+            for progress in image_generator.generate_product_variations(source_image_url, num_variations, keep_images=uploader is None,
+                                                                        regenerate_prompts=regenerate_prompts):
+                if progress['status'] == 'generated' and 'image_data' in progress:
+                    generated_count += 1
+                    stores.gallery.add_image(product_id, progress['variation'], progress['image_data'])
+                    if uploader is not None:
+                        uploader.submit(progress['variation'], progress['image_data'])
+                    print(f"   ✅ Variation {progress['variation']} générée")
+                
+                if progress['status'] == 'error':
+                    return jsonify({
+                        'success': False,
+                        'error': progress.get('message', 'Erreur génération')
+                    }), 400
+                
+                if progress['status'] == 'complete':
+                    # Images dans l'ordre des prompts (les variations finissent dans le désordre)
+                    generated_images = progress['images']
+                    print(f"   📊 {progress['total_generated']} images générées au total")
             
-            if progress['status'] == 'error':
+            if not generated_count:
                 return jsonify({
                     'success': False,
-                    'error': progress.get('message', 'Erreur génération')
+                    'error': 'Aucune image générée'
                 }), 400
             
-            if progress['status'] == 'complete':
-                print(f"   📊 {len(generated_images)} images générées au total")
-        
-        if not generated_images:
-            return jsonify({
-                'success': False,
-                'error': 'Aucune image générée'
-            }), 400
-        
-        # Uploader les images sur Shopify
-        print(f"📤 Upload de {len(generated_images)} images vers Shopify...")
-        
-        upload_result = shopify_client.replace_product_images(product_id, generated_images)
-        
+            if uploader is not None:
+                print("📤 Finalisation des uploads Shopify...")
+                upload_result = uploader.finish()
+            else:
+                # Uploader les images sur Shopify
+                print(f"📤 Upload de {len(generated_images)} images vers Shopify...")
+                upload_result = shopify_client.replace_product_images(product_id, generated_images)
+        finally:
+            # Erreur avant finish(): uploads déjà faits retirés du produit
+            if uploader is not None:
+                uploader.abort()
+        
+        record_upload_result(product_id, upload_result)
         if upload_result['success']:
             print(f"✅ {upload_result['uploaded_count']} images uploadées sur Shopify")
             return jsonify({
                 'success': True,
-                'total_generated': len(generated_images),
+                'total_generated': generated_count,
                 'uploaded_count': upload_result['uploaded_count'],
                 'new_urls': upload_result['new_urls']
             })
@@ -820,7 +990,8 @@ def generate_images_for_product():
             return jsonify({
                 'success': False,
                 'error': f"Erreur upload Shopify: {upload_result['error']}",
-                'total_generated': len(generated_images)
+                'total_generated': generated_count,
+                'resumable': True
             }), 400
         
     except Exception as e:
@@ -839,6 +1010,15 @@ def sse_log(log_type, emoji, message, color='white', progress=None, **extra):
     return 'data: ' + json.dumps(data) + '\n\n'
 
 
+def format_encoding_savings(original_bytes, encoded_bytes):
+    """Ex: '312 KB au lieu de 1843 KB en PNG, -83%'"""
+    text = str(round(encoded_bytes / 1024)) + ' KB'
+    if original_bytes and encoded_bytes < original_bytes:
+        saved = round((1 - encoded_bytes / original_bytes) * 100)
+        text += ' au lieu de ' + str(round(original_bytes / 1024)) + ' KB en PNG, -' + str(saved) + '%'
+    return text
+
+
 @app.route('/api/generate-images-stream', methods=['POST'])
 def generate_images_stream():
     """
@@ -850,6 +1030,8 @@ def generate_images_stream():
     product_title = data.get('product_title', 'Produit')
     source_image_url = data.get('source_image_url')
     num_variations = int(data.get('num_variations', 10))
+    # Relancer l'analyse même si des prompts sont stockés pour cette image
+    regenerate_prompts = bool(data.get('regenerate_prompts', False))
     
     if not product_id:
         return jsonify({'error': 'ID produit manquant'}), 400
@@ -867,8 +1049,10 @@ def generate_images_stream():
     if not store_url or not access_token:
         return jsonify({'error': 'Shopify non connecté'}), 400
     
+    # Activé si le navigateur se déconnecte: plus aucune génération n'est lancée
+    cancel_event = threading.Event()
+    
     def generate_with_logs():
-        import time as time_module
         from PIL import Image as PILImage
         from io import BytesIO
         
@@ -881,7 +1065,7 @@ def generate_images_stream():
         yield sse_log('step', '🔑', 'Initialisation Gemini 2.5 Flash Image (Nano Banana)...', 'yellow')
         
         try:
-            image_generator = ImageGenerator(gemini_api_key)
+            image_generator = ImageGenerator(gemini_api_key, prompt_store=stores.prompts)
             yield sse_log('success', '✅', 'Gemini initialisé avec succès', 'green')
         except Exception as e:
             yield sse_log('error', '❌', 'Erreur init Gemini: ' + str(e), 'red')
@@ -892,7 +1076,7 @@ def generate_images_stream():
         yield sse_log('step', '🛒', 'Connexion à Shopify: ' + store_url, 'yellow')
         
         try:
-            shopify_client = ShopifyClient(store_url, access_token=access_token)
+            shopify_client = get_shopify_client(store_url, access_token=access_token)
             yield sse_log('success', '✅', 'Shopify connecté', 'green')
         except Exception as e:
             yield sse_log('error', '❌', 'Erreur Shopify: ' + str(e), 'red')
@@ -919,10 +1103,13 @@ def generate_images_stream():
         source_pil = PILImage.open(BytesIO(source_bytes))
         yield sse_log('success', '✅', 'Image convertie: ' + str(source_pil.size[0]) + 'x' + str(source_pil.size[1]) + ' pixels', 'green')
         
-        # 🔍 ÉTAPE 1: ANALYSE IA ET GÉNÉRATION DES PROMPTS
-        yield sse_log('step', '🔍', 'Étape 1/2: Gemini analyse le produit et crée les prompts personnalisés...', 'magenta')
-        
-        custom_prompts = image_generator.analyze_and_generate_prompts(source_bytes, num_variations)
+        # 🔍 ÉTAPE 1: ANALYSE IA ET GÉNÉRATION DES PROMPTS (sauf si déjà faite pour cette image)
+        custom_prompts = None if regenerate_prompts else image_generator.cached_prompts(source_bytes, num_variations)
+        if custom_prompts:
+            yield sse_log('step', '♻️', 'Étape 1/2: prompts déjà générés pour cette image, analyse ignorée', 'magenta')
+        else:
+            yield sse_log('step', '🔍', 'Étape 1/2: Gemini analyse le produit et crée les prompts personnalisés...', 'magenta')
+            custom_prompts = image_generator.analyze_and_generate_prompts(source_bytes, num_variations, regenerate=True)
         
         if not custom_prompts:
             yield sse_log('error', '❌', 'Échec de la génération des prompts par Gemini', 'red')
@@ -939,63 +1126,94 @@ def generate_images_stream():
         # 🎨 ÉTAPE 2: GÉNÉRATION DES IMAGES
         yield sse_log('step', '🎨', 'Étape 2/2: Génération de ' + str(len(custom_prompts)) + ' images avec les prompts IA...', 'magenta')
         
-        generated_images = []
+        # Chaque image générée est gardée sur disque (ré-upload possible sans régénérer)
+        stores.gallery.start_run(product_id, source_image_url, replace=True)
+        
+        # Upload pipeliné: chaque image part vers Shopify dès qu'elle est générée
+        uploader = None
+        if SHOPIFY_UPLOAD_CONFIG['pipelined']:
+            uploader = ProductImageUploader(shopify_client, product_id, replace=True, cancel_event=cancel_event,
+                                            expected_images=len(custom_prompts))
+            yield sse_log('info', '📤', 'Upload Shopify au fil de la génération (' + str(SHOPIFY_UPLOAD_CONFIG['upload_workers']) + ' en parallèle)', 'gray')
+        
+        # Variations en parallèle (limiteur de débit partagé): logs dans l'ordre de fin
+        images_by_variation = {}
+        generated_count = 0
+        max_retries = 2
+        done = 0
+        original_total = 0
+        encoded_total = 0
+        total = str(len(custom_prompts))
         
-        for idx, prompt in enumerate(custom_prompts):
-            variation_num = idx + 1
-            progress_pct = int((idx / len(custom_prompts)) * 100)
+        try:
+            for event in image_generator.generate_variations(source_bytes, custom_prompts, max_retries=max_retries, cancel_event=cancel_event):
+                variation_num = event['variation']
+                label = '[' + str(variation_num) + '/' + total + ']'
+                if event['status'] == 'generating':
+                    yield sse_log('generating', '🔄', label + ' Envoi à Gemini 2.5 Flash Image...', 'cyan', progress=int((done / len(custom_prompts)) * 100))
+                elif event['status'] == 'retry':
+                    yield sse_log('warning', '🔄', label + ' Retry ' + str(event['attempt']) + '/' + str(max_retries) + '...', 'orange')
+                else:
+                    done += 1
+                    progress_done = int((done / len(custom_prompts)) * 100)
+                    if event['status'] == 'generated':
+                        generated_count += 1
+                        stores.gallery.add_image(product_id, variation_num, event['image_data'])
+                        if uploader is not None:
+                            uploader.submit(variation_num, event['image_data'])
+                        else:
+                            images_by_variation[variation_num] = event['image_data']
+                        original_total += event['original_bytes']
+                        encoded_total += len(event['image_data'])
+                        yield sse_log('success', '✅', label + ' Image générée (' + format_encoding_savings(event['original_bytes'], len(event['image_data'])) + ')', 'green', progress=progress_done)
+                    else:
+                        yield sse_log('warning', '⚠️', label + ' Image échouée après ' + str(max_retries) + ' retries', 'orange', progress=progress_done)
+                
+                if uploader is not None:
+                    for uploaded_variation, result in uploader.completed():
+                        if result['success']:
+                            yield sse_log('info', '⬆️', '[' + str(uploaded_variation) + '/' + total + '] Image uploadée sur Shopify', 'gray')
             
-            yield sse_log('generating', '🔄', '[' + str(variation_num) + '/' + str(len(custom_prompts)) + '] Génération image...', 'cyan', progress=progress_pct)
-            yield sse_log('info', '🤖', 'Envoi à Gemini 2.5 Flash Image...', 'gray')
+            yield sse_log('step', '📊', 'Génération terminée: ' + str(generated_count) + '/' + str(len(custom_prompts)) + ' images créées', 'cyan')
+            if generated_count:
+                yield sse_log('info', '🗜️', 'Poids à uploader: ' + format_encoding_savings(original_total, encoded_total), 'gray')
             
-            # Générer l'image avec retry automatique
-            image_data = None
-            max_retries = 2
-            for attempt in range(max_retries + 1):
-                image_data = image_generator.generate_product_variation(source_bytes, prompt, variation_num)
-                if image_data:
-                    break
-                if attempt < max_retries:
-                    yield sse_log('warning', '🔄', 'Retry ' + str(attempt + 1) + '/' + str(max_retries) + '...', 'orange')
-                    time_module.sleep(1)
+            if not generated_count:
+                yield sse_log('error', '❌', 'Aucune image générée', 'red')
+                yield sse_log('done', '🛑', 'Arrêt', success=False, error='No images generated')
+                return
             
-            if image_data:
-                generated_images.append(image_data)
-                img_size_kb = len(image_data) / 1024
-                progress_done = int(((idx + 1) / len(custom_prompts)) * 100)
-                yield sse_log('success', '✅', '[' + str(variation_num) + '/' + str(len(custom_prompts)) + '] Image générée (' + str(round(img_size_kb, 1)) + ' KB)', 'green', progress=progress_done)
+            if uploader is not None:
+                # 📤 FIN DES UPLOADS: suppression des anciennes images et positions finales
+                yield sse_log('step', '📤', 'Finalisation des uploads Shopify (anciennes images, positions)...', 'yellow')
+                upload_result = uploader.finish()
             else:
-                yield sse_log('warning', '⚠️', '[' + str(variation_num) + '/' + str(len(custom_prompts)) + '] Image échouée après ' + str(max_retries) + ' retries', 'orange')
-            
-            # Pause entre les requêtes
-            if idx < len(custom_prompts) - 1:
-                yield sse_log('info', '⏳', 'Pause 1s...', 'gray')
-                time_module.sleep(1)
-        
-        yield sse_log('step', '📊', 'Génération terminée: ' + str(len(generated_images)) + '/' + str(len(custom_prompts)) + ' images créées', 'cyan')
-        
-        if not generated_images:
-            yield sse_log('error', '❌', 'Aucune image générée', 'red')
-            yield sse_log('done', '🛑', 'Arrêt', success=False, error='No images generated')
-            return
-        
-        # 📤 UPLOAD VERS SHOPIFY
-        yield sse_log('step', '📤', 'Upload de ' + str(len(generated_images)) + ' images vers Shopify CDN...', 'yellow')
-        
-        for i in range(len(generated_images)):
-            yield sse_log('info', '⬆️', 'Upload image ' + str(i+1) + '/' + str(len(generated_images)) + '...', 'gray')
-        
-        upload_result = shopify_client.replace_product_images(product_id, generated_images)
+                # Ordre final stable: celui des prompts
+                generated_images = [images_by_variation[n] for n in sorted(images_by_variation)]
+                
+                # 📤 UPLOAD VERS SHOPIFY
+                yield sse_log('step', '📤', 'Upload de ' + str(len(generated_images)) + ' images vers Shopify CDN...', 'yellow')
+                
+                for i in range(len(generated_images)):
+                    yield sse_log('info', '⬆️', 'Upload image ' + str(i+1) + '/' + str(len(generated_images)) + '...', 'gray')
+                
+                upload_result = shopify_client.replace_product_images(product_id, generated_images)
+        finally:
+            # Déconnexion ou erreur avant finish(): uploads déjà faits retirés du produit
+            if uploader is not None:
+                uploader.abort()
         
+        record_upload_result(product_id, upload_result)
         if upload_result['success']:
             yield sse_log('success', '✅', str(upload_result['uploaded_count']) + ' images uploadées sur Shopify', 'green')
             yield sse_log('success', '🎉', 'GÉNÉRATION TERMINÉE AVEC SUCCÈS!', 'green')
-            yield sse_log('done', '🏁', 'Terminé', success=True, total_generated=len(generated_images), uploaded_count=upload_result['uploaded_count'], new_urls=upload_result.get('new_urls', []))
+            yield sse_log('done', '🏁', 'Terminé', success=True, total_generated=generated_count, uploaded_count=upload_result['uploaded_count'], new_urls=upload_result.get('new_urls', []))
         else:
             yield sse_log('error', '❌', 'Erreur upload: ' + str(upload_result.get('error', 'Unknown')), 'red')
-            yield sse_log('done', '🛑', 'Arrêt', success=False, error=upload_result.get('error', 'Upload failed'), total_generated=len(generated_images))
+            yield sse_log('info', '💾', 'Images conservées: relancez l\'upload sans régénérer (/api/generate-images-upload)', 'gray')
+            yield sse_log('done', '🛑', 'Arrêt', success=False, error=upload_result.get('error', 'Upload failed'), total_generated=generated_count, resumable=True)
     
-    return Response(stream_with_context(generate_with_logs()), mimetype='text/event-stream')
+    return Response(stream_with_context(stream_until_disconnect(generate_with_logs(), cancel_event)), mimetype='text/event-stream')
 
 
 @app.route('/api/generate-images-add', methods=['POST'])
@@ -1025,15 +1243,17 @@ def generate_images_add():
     if not store_url or not access_token:
         return jsonify({'error': 'Shopify non connecté'}), 400
 
+    # Activé si le navigateur se déconnecte: plus aucune génération n'est lancée
+    cancel_event = threading.Event()
+    
     def generate_with_logs():
-        import time as time_module
         from PIL import Image as PILImage
         from io import BytesIO
 
         yield sse_log('info', '➕', 'Ajout de ' + str(num_variations) + ' images pour: ' + product_title, 'cyan')
 
         try:
-            image_generator = ImageGenerator(gemini_api_key)
+            image_generator = ImageGenerator(gemini_api_key, prompt_store=stores.prompts)
             yield sse_log('success', '✅', 'Gemini initialisé', 'green')
         except Exception as e:
             yield sse_log('error', '❌', 'Erreur Gemini: ' + str(e), 'red')
@@ -1041,7 +1261,7 @@ def generate_images_add():
             return
 
         try:
-            shopify_client = ShopifyClient(store_url, access_token=access_token)
+            shopify_client = get_shopify_client(store_url, access_token=access_token)
             yield sse_log('success', '✅', 'Shopify connecté', 'green')
         except Exception as e:
             yield sse_log('error', '❌', 'Erreur Shopify: ' + str(e), 'red')
@@ -1066,57 +1286,148 @@ def generate_images_add():
             ('Vue angle', 'different angle view'),
         ]
 
-        generated_images = []
+        prompts = []
         for idx in range(num_variations):
-            variation_name, variation_desc = variation_types[idx % len(variation_types)]
-            progress_pct = int((idx / num_variations) * 100)
-
-            yield sse_log('generating', '🔄', '[' + str(idx+1) + '/' + str(num_variations) + '] ' + variation_name + '...', 'cyan', progress=progress_pct)
-
-            prompt = 'Create a realistic product photo of this exact same product ' + variation_desc + '. Keep the product IDENTICAL. Pinterest style, aesthetic, inspiring. No text, no logos, no fantasy.'
-
-            image_data = None
-            for attempt in range(3):
-                image_data = image_generator.generate_product_variation(source_bytes, prompt, idx + 1)
-                if image_data:
-                    break
-                if attempt < 2:
-                    yield sse_log('warning', '🔄', 'Retry...', 'orange')
-                    time_module.sleep(1)
-
-            if image_data:
-                generated_images.append(image_data)
-                progress_done = int(((idx + 1) / num_variations) * 100)
-                yield sse_log('success', '✅', '[' + str(idx+1) + '/' + str(num_variations) + '] ' + variation_name + ' générée', 'green', progress=progress_done)
-            else:
-                yield sse_log('warning', '⚠️', variation_name + ' échouée', 'orange')
+            variation_desc = variation_types[idx % len(variation_types)][1]
+            prompts.append('Create a realistic product photo of this exact same product ' + variation_desc + '. Keep the product IDENTICAL. Pinterest style, aesthetic, inspiring. No text, no logos, no fantasy.')
+
+        # AJOUTER les images sans supprimer les existantes: upload dès qu'une image est prête
+        uploader = ProductImageUploader(shopify_client, product_id, replace=False, filename_prefix='ai_extra',
+                                        cancel_event=cancel_event, expected_images=num_variations)
+        stores.gallery.start_run(product_id, source_image_url, replace=False)
+
+        # Variations en parallèle (limiteur de débit partagé)
+        generated_count = 0
+        done = 0
+        original_total = 0
+        encoded_total = 0
+        try:
+            for event in image_generator.generate_variations(source_bytes, prompts, max_retries=2, cancel_event=cancel_event):
+                variation_num = event['variation']
+                variation_name = variation_types[(variation_num - 1) % len(variation_types)][0]
+                label = '[' + str(variation_num) + '/' + str(num_variations) + '] ' + variation_name
+                if event['status'] == 'generating':
+                    yield sse_log('generating', '🔄', label + '...', 'cyan', progress=int((done / num_variations) * 100))
+                elif event['status'] == 'retry':
+                    yield sse_log('warning', '🔄', label + ': retry...', 'orange')
+                elif event['status'] == 'generated':
+                    done += 1
+                    generated_count += 1
+                    stores.gallery.add_image(product_id, variation_num, event['image_data'])
+                    uploader.submit(variation_num, event['image_data'])
+                    original_total += event['original_bytes']
+                    encoded_total += len(event['image_data'])
+                    yield sse_log('success', '✅', label + ' générée (' + format_encoding_savings(event['original_bytes'], len(event['image_data'])) + ')', 'green', progress=int((done / num_variations) * 100))
+                else:
+                    done += 1
+                    yield sse_log('warning', '⚠️', variation_name + ' échouée', 'orange')
 
-            if idx < num_variations - 1:
-                time_module.sleep(1)
+                for uploaded_variation, result in uploader.completed():
+                    if result['success']:
+                        yield sse_log('info', '⬆️', 'Image ' + str(uploaded_variation) + ' uploadée', 'gray')
 
-        if not generated_images:
-            yield sse_log('error', '❌', 'Aucune image générée', 'red')
-            yield sse_log('done', '🛑', 'Arrêt', success=False, error='No images')
-            return
+            if not generated_count:
+                yield sse_log('error', '❌', 'Aucune image générée', 'red')
+                yield sse_log('done', '🛑', 'Arrêt', success=False, error='No images')
+                return
 
-        yield sse_log('step', '📤', 'Upload de ' + str(len(generated_images)) + ' images...', 'yellow')
+            yield sse_log('info', '🗜️', 'Poids à uploader: ' + format_encoding_savings(original_total, encoded_total), 'gray')
+            yield sse_log('step', '📤', 'Finalisation de l\'upload de ' + str(generated_count) + ' images...', 'yellow')
+            upload_result = uploader.finish()
+        finally:
+            # Déconnexion ou erreur avant finish(): uploads déjà faits retirés du produit
+            uploader.abort()
 
-        # AJOUTER les images sans supprimer les existantes
-        uploaded_count = 0
-        for i, img_data in enumerate(generated_images):
-            result = shopify_client.upload_image_to_product(product_id, img_data, filename='ai_extra_' + str(i+1) + '.png')
-            if result['success']:
-                uploaded_count += 1
-                yield sse_log('info', '⬆️', 'Image ' + str(i+1) + ' uploadée', 'gray')
+        record_upload_result(product_id, upload_result)
+        uploaded_count = upload_result['uploaded_count']
 
         if uploaded_count > 0:
             yield sse_log('success', '✅', str(uploaded_count) + ' images ajoutées!', 'green')
             yield sse_log('done', '🏁', 'Terminé', success=True, uploaded_count=uploaded_count)
         else:
             yield sse_log('error', '❌', 'Erreur upload', 'red')
-            yield sse_log('done', '🛑', 'Arrêt', success=False, error='Upload failed')
+            yield sse_log('done', '🛑', 'Arrêt', success=False, error='Upload failed', resumable=True)
+
+    return Response(stream_with_context(stream_until_disconnect(generate_with_logs(), cancel_event)), mimetype='text/event-stream')
 
-    return Response(stream_with_context(generate_with_logs()), mimetype='text/event-stream')
+
+def record_upload_result(product_id, upload_result):
+    """Reporte le résultat d'un upload dans le manifeste de la galerie"""
+    if upload_result['success']:
+        stores.gallery.set_status(product_id, 'uploaded', new_urls=upload_result.get('new_urls', []))
+    else:
+        stores.gallery.set_status(product_id, 'upload_failed', error=upload_result.get('error'))
+
+
+@app.route('/api/generate-images-manifest/<product_id>', methods=['GET'])
+def get_generated_images_manifest(product_id):
+    """Images générées conservées pour un produit et état de leur upload"""
+    manifest = stores.gallery.manifest(product_id)
+    if manifest is None:
+        return jsonify({'error': 'Aucune image générée pour ce produit'}), 404
+    return jsonify(manifest)
+
+
+@app.route('/api/generate-images-upload', methods=['POST'])
+def upload_generated_images():
+    """
+    Relance l'upload des images déjà générées (depuis la galerie locale)
+    Aucun appel Gemini: utile après un échec d'upload, ou pour changer l'ordre.
+    """
+    try:
+        data = request.json
+        product_id = data.get('product_id')
+        # Ordre optionnel: liste de numéros de variation
+        order = data.get('order')
+
+        if not product_id:
+            return jsonify({'error': 'ID produit manquant'}), 400
+
+        manifest = stores.gallery.manifest(product_id)
+        if manifest is None:
+            return jsonify({'error': 'Aucune image générée pour ce produit'}), 404
+
+        images = stores.gallery.images(product_id, order=order)
+        if not images:
+            return jsonify({'error': 'Images générées introuvables sur le disque'}), 404
+
+        settings = load_settings()
+        store_url = settings.get('shopify_store_url')
+        access_token = settings.get('shopify_access_token')
+        if not store_url or not access_token:
+            return jsonify({'error': 'Shopify non connecté'}), 400
+
+        shopify_client = get_shopify_client(store_url, access_token=access_token)
+        print(f"📤 Ré-upload de {len(images)} images générées pour produit {product_id}")
+
+        uploader = ProductImageUploader(
+            shopify_client, product_id, replace=manifest.get('replace', True),
+            filename_prefix='ai_generated' if manifest.get('replace', True) else 'ai_extra',
+            expected_images=len(images)
+        )
+        # Positions = ordre de soumission (order ou ordre des variations)
+        for position, (_, image_bytes) in enumerate(images, start=1):
+            uploader.submit(position, image_bytes)
+        upload_result = uploader.finish()
+        record_upload_result(product_id, upload_result)
+
+        if upload_result['success']:
+            return jsonify({
+                'success': True,
+                'uploaded_count': upload_result['uploaded_count'],
+                'new_urls': upload_result['new_urls']
+            })
+        return jsonify({
+            'success': False,
+            'error': f"Erreur upload Shopify: {upload_result['error']}",
+            'resumable': True
+        }), 400
+
+    except Exception as e:
+        print(f"❌ Erreur upload_generated_images: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/shopify/reorder-images', methods=['POST'])
@@ -1139,7 +1450,7 @@ def reorder_images():
         if not store_url or not access_token:
             return jsonify({'error': 'Shopify non connecté'}), 400
 
-        client = ShopifyClient(store_url, access_token=access_token)
+        client = get_shopify_client(store_url, access_token=access_token)
 
         # Convertir product_id en int si c'est un string
         if isinstance(product_id, str):
@@ -1155,22 +1466,13 @@ def reorder_images():
                 if isinstance(image_id, str):
                     image_id = int(image_id.replace('gid://shopify/ProductImage/', '').replace('gid://shopify/MediaImage/', ''))
                 
-                url = f"{client.base_url}/products/{product_id}/images/{image_id}.json"
-                print(f"  📍 PUT {url} -> position {position}")
-                
-                response = requests.put(
-                    url,
-                    headers=client.headers,
-                    json={'image': {'id': image_id, 'position': position}},
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
+                # Cadencé par le seau de la boutique (429 / Retry-After gérés par le client)
+                if client.set_image_position(product_id, image_id, position):
                     success_count += 1
                     print(f"  ✅ Image {image_id} -> position {position}")
                 else:
-                    print(f"  ❌ Image {image_id}: {response.status_code} - {response.text}")
-                    errors.append(f"Image {image_id}: {response.status_code}")
+                    print(f"  ❌ Image {image_id}: position non mise à jour")
+                    errors.append(f"Image {image_id}: position non mise à jour")
                     
             except Exception as e:
                 print(f"  ❌ Erreur image {image_id}: {e}")
@@ -1191,4 +1493,5 @@ def reorder_images():
 
 
 if __name__ == '__main__':
+    load_dotenv()
     app.run(debug=True, port=5000)
@@ -0,0 +1,510 @@
+"""
+Copie locale (SQLite) du catalogue Shopify: produits, variantes, images
+La page produits lit la base locale au lieu de télécharger tout le catalogue à chaque
+chargement: pagination par clé primaire, recherche dans un index plein texte FTS5
+(trigrammes: sous-chaînes du titre, du handle, des tags et des SKU). Shopify n'est interrogé que pour les changements:
+- synchro complète (export bulk) la première fois, sur demande ou quand la dernière date de
+  plus de full_sync_interval heures: supprime aussi les produits qui n'existent plus
+  (updated_at_min ne renvoie pas les produits supprimés)
+- synchro incrémentale ensuite: produits modifiés depuis le dernier updated_at vu
+Une fois la copie créée, les synchros tournent en arrière-plan (sync_in_background): la
+page est servie tout de suite depuis la base locale.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from config import CATALOG_MIRROR_CONFIG
+from image_ingest import image_key
+from single_flight import SingleFlight
+from sqlite_db import open_sqlite
+
+PRODUCT_FIELDS = ('id', 'title', 'handle', 'status', 'vendor', 'product_type', 'tags',
+                  'body_html', 'created_at', 'updated_at')
+IMAGE_FIELDS = ('id', 'product_id', 'position', 'src', 'alt', 'width', 'height')
+VARIANT_FIELDS = ('id', 'product_id', 'position', 'title', 'sku', 'price', 'inventory_quantity')
+
+# Texte indexé d'un produit (une ligne par champ: pas de correspondance à cheval sur deux champs)
+SEARCH_TEXT_SQL = (
+    "SELECT p.rowid, coalesce(p.title, '') || char(10) || coalesce(p.handle, '') || char(10) "
+    "|| coalesce(p.tags, '') || char(10) || coalesce((SELECT group_concat(v.sku, char(10)) "
+    "FROM product_variants v WHERE v.store = p.store AND v.product_id = p.id), '') FROM products p"
+)
+# Le tokenizer trigram ne trouve rien sous 3 caractères: recherche LIKE (parcours) en dessous
+FTS_MIN_QUERY = 3
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+class CatalogMirror:
+    # Produits écrits par transaction pendant une synchro
+    BATCH_SIZE = 500
+
+    def __init__(self, db_path):
+        """
+        Ouvre (ou crée) la base SQLite
+
+        Args:
+            db_path: Chemin du fichier .db
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                store TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                title TEXT,
+                handle TEXT,
+                status TEXT,
+                vendor TEXT,
+                product_type TEXT,
+                tags TEXT,
+                body_html TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (store, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_products_title ON products (store, title);
+            CREATE TABLE IF NOT EXISTS product_images (
+                store TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                position INTEGER,
+                src TEXT,
+                alt TEXT,
+                width INTEGER,
+                height INTEGER,
+                PRIMARY KEY (store, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_images_product ON product_images (store, product_id, position);
+            CREATE INDEX IF NOT EXISTS idx_images_src ON product_images (store, src);
+            CREATE TABLE IF NOT EXISTS product_variants (
+                store TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                position INTEGER,
+                title TEXT,
+                sku TEXT,
+                price TEXT,
+                inventory_quantity INTEGER,
+                PRIMARY KEY (store, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_variants_product ON product_variants (store, product_id, position);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                store TEXT PRIMARY KEY,
+                updated_at_cursor TEXT,
+                last_full_sync REAL,
+                last_sync REAL
+            );
+        """)
+        self._conn.commit()
+        self._fts = self._create_search_index()
+        # Deux chargements simultanés de la page → une seule synchro
+        self._syncs = SingleFlight()
+        # Synchros en arrière-plan: {boutique: thread} et dernière erreur par boutique
+        self._background = {}
+        self._background_lock = threading.Lock()
+        self._sync_errors = {}
+
+    def _create_search_index(self):
+        """
+        Index plein texte des produits (lignes liées à products par rowid)
+        Reconstruit depuis les tables si la base existait avant l'index.
+
+        Returns:
+            bool: False si SQLite n'a pas FTS5/trigram (recherche LIKE)
+        """
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_search'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE products_search USING fts5(text, tokenize='trigram')")
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Recherche plein texte indisponible (SQLite {sqlite3.sqlite_version}): {e}")
+            return False
+        self._conn.execute(f"INSERT INTO products_search (rowid, text) {SEARCH_TEXT_SQL}")
+        self._conn.commit()
+        return True
+
+    def _write_products(self, store, products):
+        """
+        Remplace les produits (et leurs images/variantes) dans une transaction
+
+        Returns:
+            str: updated_at le plus récent du lot
+        """
+        latest = None
+        with self._lock:
+            for product in products:
+                if self._fts:
+                    # INSERT OR REPLACE change le rowid: l'ancienne ligne d'index part avant
+                    self._conn.execute(
+                        "DELETE FROM products_search WHERE rowid IN "
+                        "(SELECT rowid FROM products WHERE store = ? AND id = ?)", (store, product['id'])
+                    )
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO products (store, {', '.join(PRODUCT_FIELDS)}) "
+                    f"VALUES (?, {', '.join('?' for _ in PRODUCT_FIELDS)})",
+                    [store, *(product.get(field) for field in PRODUCT_FIELDS)]
+                )
+                self._conn.execute("DELETE FROM product_images WHERE store = ? AND product_id = ?", (store, product['id']))
+                self._conn.execute("DELETE FROM product_variants WHERE store = ? AND product_id = ?", (store, product['id']))
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO product_images (store, {', '.join(IMAGE_FIELDS)}) "
+                    f"VALUES (?, {', '.join('?' for _ in IMAGE_FIELDS)})",
+                    [[store, *({**image, 'product_id': product['id']}.get(field) for field in IMAGE_FIELDS)]
+                     for image in product.get('images') or []]
+                )
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO product_variants (store, {', '.join(VARIANT_FIELDS)}) "
+                    f"VALUES (?, {', '.join('?' for _ in VARIANT_FIELDS)})",
+                    [[store, *({**variant, 'product_id': product['id']}.get(field) for field in VARIANT_FIELDS)]
+                     for variant in product.get('variants') or []]
+                )
+                if self._fts:
+                    self._conn.execute(
+                        f"INSERT INTO products_search (rowid, text) {SEARCH_TEXT_SQL} WHERE p.store = ? AND p.id = ?",
+                        (store, product['id'])
+                    )
+                updated_at = _parse_timestamp(product.get('updated_at'))
+                if updated_at is not None and (latest is None or updated_at > _parse_timestamp(latest)):
+                    latest = product['updated_at']
+            self._conn.commit()
+        return latest
+
+    def _save_state(self, store, cursor, full):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at_cursor, last_full_sync FROM sync_state WHERE store = ?", (store,)
+            ).fetchone()
+            previous_cursor, last_full_sync = row if row else (None, None)
+            if cursor is None or (previous_cursor and _parse_timestamp(previous_cursor) > _parse_timestamp(cursor)):
+                cursor = previous_cursor
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (store, updated_at_cursor, last_full_sync, last_sync) "
+                "VALUES (?, ?, ?, ?)",
+                (store, cursor, now if full else last_full_sync, now)
+            )
+            self._conn.commit()
+
+    def sync_state(self, store):
+        """
+        Returns:
+            dict: {'updated_at_cursor', 'last_full_sync', 'last_sync'} ou None si jamais synchronisé
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at_cursor, last_full_sync, last_sync FROM sync_state WHERE store = ?", (store,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('updated_at_cursor', 'last_full_sync', 'last_sync'), row))
+
+    def sync_due(self, store, full=False):
+        """
+        Synchro à lancer pour que la copie locale soit à jour
+
+        Args:
+            store: Domaine de la boutique
+            full: Synchro complète demandée
+
+        Returns:
+            str: 'full', 'incremental' ou None (copie assez récente)
+        """
+        state = self.sync_state(store)
+        now = time.time()
+        if full or state is None or not state['last_full_sync']:
+            return 'full'
+        if now - state['last_full_sync'] >= CATALOG_MIRROR_CONFIG['full_sync_interval'] * 3600:
+            return 'full'
+        if now - state['last_sync'] >= CATALOG_MIRROR_CONFIG['min_sync_interval']:
+            return 'incremental'
+        return None
+
+    def sync(self, shopify_client, full=False):
+        """
+        Met la copie locale à jour (une seule synchro à la fois par boutique)
+        Complète si demandée, si la copie n'existe pas encore ou si la dernière synchro
+        complète est trop ancienne (voir sync_due).
+
+        Args:
+            shopify_client: Instance de ShopifyClient
+            full: Tout re-télécharger (supprime aussi les produits disparus)
+
+        Returns:
+            dict: {'mode': 'full' | 'incremental', 'synced': int, 'deleted': int, 'seconds': float}
+        """
+        store = shopify_client.store_url
+        full = self.sync_due(store, full) == 'full'
+        return self._syncs.do((store, full), self._sync, shopify_client, full)
+
+    def sync_in_background(self, shopify_client, full=False):
+        """
+        Lance la synchro due dans un thread (une seule à la fois par boutique)
+        La copie locale est servie sans attendre: les changements apparaissent au
+        chargement suivant.
+
+        Args:
+            shopify_client: Instance de ShopifyClient
+            full: Synchro complète demandée
+
+        Returns:
+            str: Synchro lancée ('full' | 'incremental') ou None (copie à jour ou synchro déjà en cours)
+        """
+        store = shopify_client.store_url
+        mode = self.sync_due(store, full)
+        if mode is None:
+            return None
+        with self._background_lock:
+            running = self._background.get(store)
+            if running is not None and running.is_alive():
+                return None
+            thread = threading.Thread(target=self._background_sync, args=(shopify_client, mode == 'full'), daemon=True)
+            self._background[store] = thread
+            thread.start()
+        return mode
+
+    def _background_sync(self, shopify_client, full):
+        store = shopify_client.store_url
+        try:
+            self.sync(shopify_client, full=full)
+            self._sync_errors.pop(store, None)
+        except Exception as e:
+            print(f"⚠️ Synchro catalogue {store} impossible, copie locale servie: {e}")
+            self._sync_errors[store] = str(e)
+
+    def is_syncing(self, store):
+        """
+        Returns:
+            bool: True si une synchro en arrière-plan est en cours pour la boutique
+        """
+        with self._background_lock:
+            running = self._background.get(store)
+            return running is not None and running.is_alive()
+
+    def sync_error(self, store):
+        """
+        Returns:
+            str: Erreur de la dernière synchro en arrière-plan (None si elle a réussi)
+        """
+        return self._sync_errors.get(store)
+
+    def _sync(self, shopify_client, full):
+        store = shopify_client.store_url
+        started = time.time()
+        if full:
+            products = shopify_client.iter_products()
+        else:
+            products = shopify_client.iter_products_rest(updated_at_min=self.sync_state(store)['updated_at_cursor'])
+
+        synced = 0
+        seen = set()
+        cursor = None
+        batch = []
+        for product in products:
+            batch.append(product)
+            seen.add(product['id'])
+            if len(batch) >= self.BATCH_SIZE:
+                cursor = self._latest(cursor, self._write_products(store, batch))
+                synced += len(batch)
+                batch = []
+        if batch:
+            cursor = self._latest(cursor, self._write_products(store, batch))
+            synced += len(batch)
+
+        deleted = self._delete_missing(store, seen) if full else 0
+        self._save_state(store, cursor, full)
+        result = {
+            'mode': 'full' if full else 'incremental',
+            'synced': synced,
+            'deleted': deleted,
+            'seconds': round(time.time() - started, 2),
+        }
+        print(f"🗄️ Catalogue {store}: {result}")
+        return result
+
+    @staticmethod
+    def _latest(current, candidate):
+        if candidate is None:
+            return current
+        if current is None or _parse_timestamp(candidate) > _parse_timestamp(current):
+            return candidate
+        return current
+
+    def _delete_missing(self, store, seen):
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute("SELECT id FROM products WHERE store = ?", (store,))]
+            missing = [(store, product_id) for product_id in ids if product_id not in seen]
+            if self._fts:
+                self._conn.executemany(
+                    "DELETE FROM products_search WHERE rowid IN "
+                    "(SELECT rowid FROM products WHERE store = ? AND id = ?)", missing
+                )
+            for table, column in (('products', 'id'), ('product_images', 'product_id'), ('product_variants', 'product_id')):
+                self._conn.executemany(f"DELETE FROM {table} WHERE store = ? AND {column} = ?", missing)
+            self._conn.commit()
+        return len(missing)
+
+    def product_id_for_image(self, store, url):
+        """
+        Produit de la copie locale qui porte cette image (URL comparée sans paramètres)
+
+        Args:
+            store: Domaine de la boutique
+            url: URL de l'image (ex: Photo 1 d'un export CSV)
+
+        Returns:
+            int: ID du produit ou None
+        """
+        key = image_key(url)
+        # Plage sur l'index (store, src): src = clé exacte ou clé suivie de '?…' ('?' précède '@')
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT src, product_id FROM product_images WHERE store = ? AND src >= ? AND src < ?",
+                (store, key, key + '@')
+            ).fetchall()
+        for src, product_id in rows:
+            if image_key(src) == key:
+                return product_id
+        return None
+
+    def _where(self, store, search=None, after_id=None, key='id'):
+        clauses = ["store = ?"]
+        params = [store]
+        if after_id is not None:
+            clauses.append(f"{key} > ?")
+            params.append(int(after_id))
+        if search and self._fts and len(search) >= FTS_MIN_QUERY:
+            # Phrase FTS5: la recherche est prise telle quelle (guillemets doublés)
+            clauses.append("rowid IN (SELECT rowid FROM products_search WHERE products_search MATCH ?)")
+            params.append('"' + search.replace('"', '""') + '"')
+        elif search:
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append(
+                "(title LIKE ? ESCAPE '\\' OR handle LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\' OR EXISTS ("
+                "SELECT 1 FROM product_variants v WHERE v.store = products.store "
+                "AND v.product_id = products.id AND v.sku LIKE ? ESCAPE '\\'))"
+            )
+            params.extend([pattern] * 4)
+        return ' AND '.join(clauses), params
+
+    def _children(self, table, columns, store, product_ids):
+        """
+        Images ou variantes des produits demandés, groupées par produit (ordre de position)
+        """
+        grouped = {product_id: [] for product_id in product_ids}
+        ids = list(grouped)
+        # Par paquets: limite du nombre de paramètres SQLite
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} "
+                f"WHERE store = ? AND product_id IN ({', '.join('?' for _ in chunk)}) ORDER BY product_id, position",
+                [store, *chunk]
+            ).fetchall()
+            for row in rows:
+                child = dict(zip(columns, row))
+                grouped[child['product_id']].append(child)
+        return grouped
+
+    def query_products(self, store, search=None, after_id=None, limit=None, fields=None, key='id'):
+        """
+        Produits de la copie locale au format de /products.json, triés par ID
+        Pagination par curseur (keyset sur l'ID): une page coûte le même prix au début
+        et à la fin du catalogue.
+
+        Args:
+            store: Domaine de la boutique
+            search: Texte cherché dans le titre, le handle, les tags et les SKU
+            after_id: Curseur: produits d'ID strictement supérieur
+            limit: Produits max (None = tous)
+            fields: Champs renvoyés (None = tous), ex: ['id', 'title', 'images']
+                    'id' est toujours inclus; 'images', 'image' et 'variants' ne sont lus que si demandés
+            key: 'id', ou 'rowid' (ordre d'écriture, voir follow_sync)
+
+        Returns:
+            dict: {'products': list, 'next_cursor': clé du dernier produit ou None si dernière page,
+                   'last_key': clé du dernier produit de la page}
+        """
+        wanted = set(fields) if fields else None
+        columns = [field for field in PRODUCT_FIELDS if wanted is None or field == 'id' or field in wanted]
+        with_images = wanted is None or 'images' in wanted or 'image' in wanted
+        with_variants = wanted is None or 'variants' in wanted
+
+        where, params = self._where(store, search, after_id, key)
+        sql = f"SELECT {key}, {', '.join(columns)} FROM products WHERE {where} ORDER BY {key}"
+        if limit is not None:
+            # Une ligne de plus: savoir s'il reste une page sans requête COUNT
+            sql += " LIMIT ?"
+            params.append(int(limit) + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            has_more = limit is not None and len(rows) > limit
+            rows = rows[:limit] if limit is not None else rows
+            keys = [row[0] for row in rows]
+            rows = [row[1:] for row in rows]
+            ids = [row[0] for row in rows]
+            images = self._children('product_images', IMAGE_FIELDS, store, ids) if with_images else None
+            variants = self._children('product_variants', VARIANT_FIELDS, store, ids) if with_variants else None
+
+        products = []
+        for row in rows:
+            product = dict(zip(columns, row))
+            if with_images:
+                product_images = images[product['id']]
+                if wanted is None or 'images' in wanted:
+                    product['images'] = product_images
+                if wanted is None or 'image' in wanted:
+                    product['image'] = product_images[0] if product_images else None
+            if with_variants:
+                product['variants'] = variants[product['id']]
+            products.append(product)
+        return {'products': products, 'next_cursor': keys[-1] if has_more else None,
+                'last_key': keys[-1] if keys else None}
+
+    def count_products(self, store, search=None):
+        """
+        Returns:
+            int: Nombre de produits de la boutique (correspondant à la recherche)
+        """
+        where, params = self._where(store, search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM products WHERE {where}", params).fetchone()[0]
+
+    def follow_sync(self, store, search=None, fields=None, page_size=500, poll_interval=0.2):
+        """
+        Produits au fil de la synchro en arrière-plan (première synchro: copie encore vide)
+        Lecture dans l'ordre d'écriture (rowid) jusqu'à la fin de la synchro: les premiers
+        produits partent sans attendre le reste de l'export.
+
+        Yields:
+            dict: Produit (mêmes champs que query_products)
+        """
+        cursor = 0
+        while True:
+            # État lu avant la page: tout ce qui est écrit avant la fin est lu au dernier tour
+            finished = not self.is_syncing(store)
+            page = self.query_products(store, search, cursor, page_size, fields, key='rowid')
+            if page['products']:
+                yield from page['products']
+                cursor = page['last_key']
+                continue
+            if finished:
+                return
+            time.sleep(poll_interval)
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            stores = self._conn.execute("SELECT COUNT(*) FROM sync_state").fetchone()[0]
+        return {'products': count, 'stores': stores}
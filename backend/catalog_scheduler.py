@@ -0,0 +1,242 @@
+"""
+Génération d'images à l'échelle du catalogue (export CSV → images générées sur Shopify)
+Toutes les variations de tous les produits passent par une seule file de travail:
+le débit dépend du quota Gemini (pool global + limiteur partagé), plus du nombre de produits.
+
+- produit Shopify de chaque image retrouvé dans la copie locale du catalogue, sinon par
+  une recherche ciblée sur le SKU (jamais d'export complet du catalogue avant de commencer)
+- préparation par produit (image source, prompts) dans un petit pool séparé
+- nombre de produits en cours borné (mémoire, résultats livrés produit par produit)
+- chaque image part vers le produit Shopify correspondant dès qu'elle est prête
+- un produit est finalisé (anciennes images, URLs CDN) dès sa dernière variation
+- annulation: les produits pas encore finalisés gardent leurs images d'origine
+"""
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import IMAGE_GENERATION_CONFIG
+from image_ingest import image_key
+from upload_pipeline import ProductImageUploader
+
+
+class _ProductJob:
+    def __init__(self, key, label, source_url, product_id):
+        self.key = key
+        self.label = label
+        self.source_url = source_url
+        self.product_id = product_id
+        self.uploader = None
+        self.remaining = 0
+        self.generated = 0
+        self.lock = threading.Lock()
+
+
+class CatalogImageScheduler:
+    def __init__(self, image_generator, shopify_client, num_images=10, max_workers=None,
+                 products_in_flight=None, cancel_event=None, regenerate_prompts=False,
+                 gallery=None, max_retries=2, catalog_mirror=None):
+        """
+        Args:
+            image_generator: Instance de ImageGenerator
+            shopify_client: Instance de ShopifyClient
+            num_images: Variations par produit
+            max_workers: Variations simultanées, tous produits confondus (défaut: IMAGE_GENERATION_CONFIG)
+            products_in_flight: Produits préparés/en cours en même temps (défaut: IMAGE_GENERATION_CONFIG)
+            cancel_event: threading.Event activé si le client se déconnecte
+            regenerate_prompts: relancer l'analyse même si des prompts sont stockés
+            gallery: ImageGallery où conserver les images générées (optionnel)
+            max_retries: Nouvelles tentatives par variation
+            catalog_mirror: CatalogMirror où retrouver les produits (sinon recherche par SKU)
+        """
+        self.generator = image_generator
+        self.client = shopify_client
+        self.num_images = num_images
+        self.max_workers = max_workers or IMAGE_GENERATION_CONFIG['batch_concurrent_variations']
+        self.products_in_flight = products_in_flight or IMAGE_GENERATION_CONFIG['batch_products_in_flight']
+        self.cancel_event = cancel_event or threading.Event()
+        self.regenerate_prompts = regenerate_prompts
+        self.gallery = gallery
+        self.max_retries = max_retries
+        self.catalog_mirror = catalog_mirror
+
+        self._stop = threading.Event()
+        self._events = queue.Queue()
+        self._progress_lock = threading.Lock()
+        self._total_units = 0
+        self._done_units = 0
+
+    def resolve_product(self, job):
+        """
+        Produit Shopify dont l'image source est job['source_url'] (URL comparée sans paramètres)
+        Copie locale du catalogue d'abord; sinon recherche ciblée par SKU, retenue seulement
+        si le produit trouvé porte bien cette image.
+
+        Returns:
+            int: ID du produit ou None
+        """
+        if self.catalog_mirror is not None:
+            product_id = self.catalog_mirror.product_id_for_image(self.client.store_url, job['source_url'])
+            if product_id is not None:
+                return product_id
+        if not job.get('sku'):
+            return None
+        key = image_key(job['source_url'])
+        for product in self.client.find_products_by_sku(job['sku'], cancel_event=self.cancel_event):
+            if any(image.get('src') and image_key(image['src']) == key for image in product['images']):
+                return product['id']
+        return None
+
+    def run(self, jobs):
+        """
+        Génère et uploade les images de tous les produits
+
+        Args:
+            jobs: [{'key': identifiant (ex: index de ligne CSV), 'label': str, 'source_url': str,
+                    'sku': str ou None}, ...]
+
+        Yields:
+            dict: {'status': 'indexing' | 'skipped' | 'product_started' | 'generated' | 'failed'
+                   | 'product_done' | 'product_failed', 'key', 'label', 'message', 'progress': int}
+                  'product_done' contient aussi 'new_urls', 'uploaded_count' et 'generated'.
+        """
+        yield {'status': 'indexing', 'key': None, 'label': '', 'progress': 0,
+               'message': f"🔎 Recherche des produits Shopify de {len(jobs)} images"}
+        waiting = deque()
+        products = []
+        for job in jobs:
+            if self.cancel_event.is_set():
+                print("🛑 Génération catalogue annulée")
+                return
+            try:
+                product_id = self.resolve_product(job)
+            except Exception as e:
+                if self.cancel_event.is_set():
+                    continue
+                print(f"❌ Recherche du produit {job['label']} impossible: {e}")
+                product_id = None
+            if product_id is None:
+                # Pas de produit Shopify à mettre à jour: aucun quota dépensé
+                yield {'status': 'skipped', 'key': job['key'], 'label': job['label'], 'progress': 0,
+                       'message': f"⚠️ {job['label']}: produit Shopify introuvable pour cette image"}
+                continue
+            waiting.append(_ProductJob(job['key'], job['label'], job['source_url'], product_id))
+            products.append(waiting[-1])
+        if not waiting:
+            return
+        self._total_units = len(waiting) * self.num_images
+
+        prepare_pool = ThreadPoolExecutor(max_workers=self.products_in_flight)
+        self._generate_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._prepare_pool = prepare_pool
+        in_flight = 0
+        try:
+            while waiting or in_flight:
+                # Vérifié à chaque tour: les événements peuvent arriver sans interruption
+                if self.cancel_event.is_set():
+                    print("🛑 Génération catalogue annulée")
+                    return
+                # Admission: un nouveau produit dès qu'un autre est terminé
+                while waiting and in_flight < self.products_in_flight:
+                    prepare_pool.submit(self._prepare, waiting.popleft())
+                    in_flight += 1
+                try:
+                    event = self._events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if event['status'] in ('product_done', 'product_failed'):
+                    in_flight -= 1
+                yield event
+        finally:
+            # Plus aucun nouvel appel; les appels en cours se terminent
+            self._stop.set()
+            self._generate_pool.shutdown(wait=False, cancel_futures=True)
+            prepare_pool.shutdown(wait=False, cancel_futures=True)
+            # Produits interrompus avant finalisation: uploads déjà faits retirés (sans effet sinon)
+            for product in products:
+                if product.uploader is not None:
+                    product.uploader.abort()
+
+    def _advance(self, units):
+        with self._progress_lock:
+            self._done_units += units
+            return int(self._done_units / max(1, self._total_units) * 100)
+
+    def _emit(self, job, status, message, units=0, **extra):
+        event = {'status': status, 'key': job.key, 'label': job.label, 'message': message,
+                 'progress': self._advance(units)}
+        event.update(extra)
+        self._events.put(event)
+
+    def _prepare(self, job):
+        if self._stop.is_set():
+            return
+        try:
+            source_bytes = self.generator.download_image_from_url(job.source_url)
+            if not source_bytes:
+                self._emit(job, 'product_failed', f"⚠️ {job.label}: image source introuvable", self.num_images)
+                return
+            prompts = self.generator.analyze_and_generate_prompts(
+                source_bytes, self.num_images, regenerate=self.regenerate_prompts
+            )
+            if not prompts:
+                self._emit(job, 'product_failed', f"⚠️ {job.label}: échec de la génération des prompts", self.num_images)
+                return
+
+            job.uploader = ProductImageUploader(self.client, job.product_id, replace=True, cancel_event=self._stop,
+                                                expected_images=len(prompts))
+            if self.gallery is not None:
+                self.gallery.start_run(job.product_id, job.source_url, replace=True)
+            job.remaining = len(prompts)
+            self._emit(job, 'product_started', f"🖼️ {job.label}: {len(prompts)} images en file",
+                       self.num_images - len(prompts))
+            for variation_num, prompt in enumerate(prompts, start=1):
+                self._generate_pool.submit(self._generate, job, source_bytes, variation_num, prompt)
+        except Exception as e:
+            print(f"❌ Erreur préparation {job.label}: {e}")
+            self._emit(job, 'product_failed', f"⚠️ {job.label}: {e}", self.num_images)
+
+    def _generate(self, job, source_bytes, variation_num, prompt):
+        def on_event(event):
+            if event['status'] == 'generated':
+                if self.gallery is not None:
+                    self.gallery.add_image(job.product_id, variation_num, event['image_data'])
+                job.uploader.submit(variation_num, event['image_data'])
+                with job.lock:
+                    job.generated += 1
+                self._emit(job, 'generated', f"✅ {job.label}: image {variation_num} générée", 1,
+                           variation=variation_num)
+            elif event['status'] == 'failed':
+                self._emit(job, 'failed', f"⚠️ {job.label}: image {variation_num} échouée", 1,
+                           variation=variation_num)
+
+        try:
+            self.generator.generate_variation(source_bytes, prompt, variation_num, on_event,
+                                              self.max_retries, self._stop)
+        finally:
+            with job.lock:
+                job.remaining -= 1
+                last = job.remaining == 0
+            if last:
+                # Finalisation hors du pool de génération (attente des uploads et des URLs CDN)
+                self._prepare_pool.submit(self._finalize, job)
+
+    def _finalize(self, job):
+        try:
+            upload_result = job.uploader.finish()
+        except Exception as e:
+            print(f"❌ Erreur finalisation {job.label}: {e}")
+            upload_result = {'success': False, 'new_urls': [], 'uploaded_count': 0, 'error': str(e)}
+        if self.gallery is not None:
+            if upload_result['success']:
+                self.gallery.set_status(job.product_id, 'uploaded', new_urls=upload_result['new_urls'])
+            else:
+                self.gallery.set_status(job.product_id, 'upload_failed', error=upload_result['error'])
+        if upload_result['success']:
+            self._emit(job, 'product_done',
+                       f"✅ {job.label}: {upload_result['uploaded_count']} images uploadées sur Shopify",
+                       new_urls=upload_result['new_urls'], uploaded_count=upload_result['uploaded_count'],
+                       generated=job.generated)
+        else:
+            self._emit(job, 'product_failed', f"⚠️ {job.label}: {upload_result['error']}")
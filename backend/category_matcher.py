@@ -6,6 +6,7 @@ import json
 import os
 import google.generativeai as genai
 from typing import List, Dict, Optional
+from single_flight import gemini_flight, call_key
 
 class CategoryMatcher:
     def __init__(self, api_key: str):
@@ -14,7 +15,8 @@ class CategoryMatcher:
         genai.configure(api_key=api_key)
         
         # Utiliser Gemini 2.5 Flash pour la catégorisation
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model_name = 'gemini-2.5-flash'
+        self.model = genai.GenerativeModel(self.model_name)
         
         self.categories = self._load_categories()
         self.leaf_categories = self._filter_leaf_categories()
@@ -175,8 +177,11 @@ INSTRUCTIONS:
 Réponds UNIQUEMENT avec le JSON, rien d'autre."""
 
             # 3. Appeler Gemini
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
+            # Même produit catégorisé en parallèle → une seule requête Gemini
+            response_text = gemini_flight.do(
+                call_key(self.model_name, prompt),
+                lambda: self.model.generate_content(prompt).text
+            ).strip()
             
             # Nettoyer la réponse (enlever les markdown code blocks si présents)
             if response_text.startswith('```'):
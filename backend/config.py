@@ -54,3 +54,87 @@ GEMINI_CONFIG = {
     'image_quality': 85,
     'rate_limit_delay': 2,  # Secondes entre chaque requête
 }
+
+# Configuration du pipeline d'optimisation (téléchargement → Gemini)
+ENHANCE_CONFIG = {
+    'download_workers': 16,      # Téléchargements CDN simultanés
+    'inference_workers': 10,     # Appels Gemini simultanés
+    'prefetch_queue_size': 32,   # Images prêtes en attente d'un worker Gemini
+    'dedup': True,               # Une seule génération pour les photos quasi identiques
+    'dedup_max_distance': 4,     # Distance de Hamming max (sur 64 bits) entre deux doublons
+    'output_mode': 'json',       # 'json' (schéma + validation locale) ou 'text' (ancien parsing)
+}
+
+# Téléchargement/préparation des images (session HTTP partagée, un profil par consommateur)
+IMAGE_INGEST_CONFIG = {
+    'pool_size': 32,             # Connexions keep-alive max vers le CDN
+    'timeout': 15,               # Secondes par téléchargement
+    'process_workers': None,     # Process de prétraitement (None = nb de cœurs, 0 = dans le thread)
+    'profiles': {
+        'enhance': {'width': 600, 'format': 'JPEG', 'quality': 75},    # Analyse Gemini (titre/tags)
+        'generate': {'width': 1024, 'format': 'JPEG', 'quality': 90},  # Image source Nano Banana
+    },
+    'raw_width': 1024,           # Largeur CDN commune des images sources (cache partagé, profils dérivés)
+}
+
+# Cache disque des images sources brutes (partagé par l'optimisation et la génération d'images)
+IMAGE_CACHE_CONFIG = {
+    'enabled': True,
+    'cache_dir': 'image_cache',          # Relatif au dossier de lancement du backend
+    'max_bytes': 512 * 1024 * 1024,      # Budget disque (éviction LRU au-delà)
+}
+
+# Génération d'images (Nano Banana)
+IMAGE_GENERATION_CONFIG = {
+    'reference_mode': 'files',           # 'files' (upload unique, API Files) ou 'inline' (image dans chaque appel)
+    'reference_ttl_seconds': 46 * 3600,  # Réutilisation max d'une image uploadée (expire à 48h chez Google)
+    'max_concurrent_variations': 5,      # Variations générées en parallèle pour un produit
+    'requests_per_second': 1.0,          # Débit max d'appels Nano Banana (tous produits confondus)
+    'burst': 5,                          # Appels pouvant partir d'un coup
+    'batch_concurrent_variations': 8,    # Génération catalogue: variations simultanées, tous produits confondus
+    'batch_products_in_flight': 4,       # Génération catalogue: produits préparés/en cours en même temps
+    'prompt_cache_entries': 2000,        # Jeux de prompts d'analyse gardés (les moins utilisés sont supprimés)
+}
+
+# Encodage des images générées avant stockage et upload (Gemini renvoie du PNG sans perte)
+IMAGE_OUTPUT_CONFIG = {
+    'format': 'JPEG',            # 'JPEG', 'WEBP' ou None (image Gemini inchangée)
+    'max_size': 2048,            # Côté max en pixels (recommandation Shopify)
+    'quality': 88,               # Qualité visée
+    'min_quality': 70,           # En dessous: l'image est réduite plutôt que dégradée
+    'max_bytes': 1024 * 1024,    # Budget par image
+}
+
+# Upload des images générées vers Shopify
+SHOPIFY_UPLOAD_CONFIG = {
+    'pipelined': True,           # Upload de chaque image dès qu'elle est générée
+    'upload_workers': 4,         # Uploads simultanés par produit
+    'method': 'staged',          # 'staged' (bytes bruts + productCreateMedia) ou 'rest' (base64 JSON)
+    'media_ready_timeout': 60,   # Secondes max d'attente du traitement des médias (URLs CDN)
+}
+
+# Limites de l'Admin API Shopify (plan standard: seau de 40 requêtes, vidé à 2/s)
+SHOPIFY_API_CONFIG = {
+    'requests_per_second': 2,
+    'burst': 40,
+    'safety_margin': 2,          # Requêtes laissées libres dans le seau (autres apps de la boutique)
+    'graphql_bucket': 1000,      # Points de coût GraphQL (recalé sur throttleStatus)
+    'graphql_restore_rate': 50,  # Points restitués par seconde
+    'graphql_default_cost': 10,  # Coût estimé d'une requête avant la réponse
+    'max_retries': 5,            # Nouvelles tentatives sur 429 / THROTTLED / 5xx
+    'pool_size': 10,             # Connexions keep-alive max par hôte (par client)
+    'timeout': 30,               # Secondes par appel si la méthode n'en précise pas
+    'max_clients': 8,            # Clients (sessions) gardés dans le registre par identifiants
+    'admin_base_url': None,      # Remplace https://<store>/admin/api/<version> (ex: serveur local de test)
+    'catalog_fetch': 'bulk',     # Catalogue complet: 'bulk' (export GraphQL JSONL) ou 'rest' (pages de 250)
+    'bulk_poll_interval': 2,     # Secondes entre deux vérifications de l'export bulk
+    'bulk_timeout': 1800,        # Attente max de l'export bulk (secondes)
+    'bulk_group_window': 50,     # Produits gardés ouverts en lisant l'export (enfants arrivés en décalé)
+}
+
+# Copie locale du catalogue Shopify (SQLite)
+CATALOG_MIRROR_CONFIG = {
+    'min_sync_interval': 30,     # Secondes entre deux synchros incrémentales (chargements rapprochés)
+    'full_sync_interval': 24,    # Heures entre deux synchros complètes (seules à voir les produits supprimés)
+    'max_page_size': 1000,       # Plafond du paramètre limit (et taille des lectures en NDJSON)
+}
@@ -0,0 +1,133 @@
+"""
+Stockage persistant des contenus Etsy générés (titre, description, tags, catégorie)
+Clé: identité du produit + hash de l'image source + version du prompt.
+Un ré-export d'un catalogue inchangé (ex: nouveau multiplicateur de prix) réutilise
+les contenus déjà payés au lieu de rappeler Gemini.
+
+La version CDN de la photo (?v=) est aussi enregistrée: une photo dont la version n'a
+pas changé est retrouvée sans télécharger l'image ni la hasher (voir get_for_version).
+"""
+import json
+import threading
+import time
+
+from image_ingest import image_key
+from sqlite_db import open_sqlite
+
+
+class ListingContentStore:
+    FIELDS = ('title', 'description', 'tags', 'category', 'category_confidence')
+    # Marqueurs de doublon visuel conservés avec le contenu (voir GeminiEnhancer.fan_out_duplicate)
+    FLAGS = ('duplicate_of_key', 'needs_title_differentiation')
+
+    def __init__(self, db_path):
+        """
+        Ouvre (ou crée) la base SQLite
+
+        Args:
+            db_path: Chemin du fichier .db
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS listing_content (
+                product_key TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                title TEXT,
+                description TEXT,
+                tags TEXT,
+                category TEXT,
+                category_confidence TEXT,
+                source_version TEXT,
+                flags TEXT,
+                created_at REAL,
+                PRIMARY KEY (product_key, source_hash, prompt_version)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_listing_content_version "
+            "ON listing_content (product_key, source_version, prompt_version)"
+        )
+        self._conn.commit()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def product_key(photo_url):
+        """
+        Identité stable d'un produit dans le CSV Etsy
+
+        Le CSV Etsy ne contient pas le Handle Shopify: on utilise l'URL CDN
+        de la Photo 1 sans paramètres (unique par produit Shopify, voir image_key).
+        """
+        return image_key(photo_url)
+
+    def _row_to_content(self, row):
+        content = dict(zip(self.FIELDS, row[:len(self.FIELDS)]))
+        flags = json.loads(row[len(self.FIELDS)] or '{}')
+        content.update({flag: flags[flag] for flag in self.FLAGS if flag in flags})
+        return content
+
+    def get(self, product_key, source_hash, prompt_version):
+        """
+        Returns:
+            dict: Contenu stocké (avec ses marqueurs de doublon) ou None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.FIELDS)}, flags FROM listing_content "
+                "WHERE product_key = ? AND source_hash = ? AND prompt_version = ?",
+                (product_key, source_hash, prompt_version)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return self._row_to_content(row)
+
+    def get_for_version(self, product_key, source_version, prompt_version):
+        """
+        Contenu généré pour la même version CDN de la photo (sans téléchargement)
+
+        Returns:
+            dict: Contenu stocké le plus récent ou None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.FIELDS)}, flags FROM listing_content "
+                "WHERE product_key = ? AND source_version = ? AND prompt_version = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (product_key, source_version, prompt_version)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return self._row_to_content(row)
+
+    def put(self, product_key, source_hash, prompt_version, content, source_version=None):
+        """
+        Enregistre (ou remplace) le contenu généré pour un produit
+
+        Args:
+            source_version: Version CDN de la photo (?v=), pour get_for_version
+        """
+        values = [content.get(field) or '' for field in self.FIELDS]
+        flags = {flag: content[flag] for flag in self.FLAGS if content.get(flag) is not None}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO listing_content "
+                f"(product_key, source_hash, prompt_version, {', '.join(self.FIELDS)}, "
+                "source_version, flags, created_at) "
+                f"VALUES (?, ?, ?, {', '.join('?' for _ in self.FIELDS)}, ?, ?, ?)",
+                [product_key, source_hash, prompt_version, *values,
+                 source_version, json.dumps(flags) if flags else None, time.time()]
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM listing_content").fetchone()[0]
+            return {'entries': count, 'hits': self._hits, 'misses': self._misses}
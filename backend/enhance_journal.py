@@ -0,0 +1,73 @@
+"""
+Journal de reprise pour l'optimisation Gemini
+Chaque produit terminé est ajouté au journal (JSONL) dès qu'il est prêt,
+pour ne jamais perdre les appels Gemini déjà payés si le traitement s'arrête.
+"""
+import json
+import os
+import threading
+
+
+class EnhanceJournal:
+    def __init__(self, path):
+        """
+        Initialise le journal
+
+        Args:
+            path: Chemin du fichier JSONL (créé au premier ajout)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def product_key(idx, photo_url):
+        """
+        Clé unique d'un produit: index de ligne + URL Photo 1
+        (un autre CSV avec les mêmes index ne sera pas confondu)
+        """
+        return f"{idx}|{photo_url}"
+
+    def load(self):
+        """
+        Relit le journal
+
+        Returns:
+            dict: {clé produit: {'key', 'idx', 'result'}}
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dernière ligne tronquée par un crash: on l'ignore
+                    continue
+                if 'key' in entry and 'result' in entry:
+                    entries[entry['key']] = entry
+        return entries
+
+    def append(self, key, idx, result):
+        """
+        Ajoute un produit terminé et force l'écriture sur disque
+        """
+        # default=str: valeurs numpy (SKU lu par pandas) non sérialisables nativement
+        line = json.dumps({'key': key, 'idx': int(idx), 'result': result}, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def reset(self):
+        """
+        Supprime le journal (nouveau traitement complet)
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,274 @@
+"""
+Pipeline à deux étages pour l'optimisation Gemini
+1. Un pool de téléchargement/prétraitement remplit une file bornée d'images prêtes
+2. Un pool d'inférence (taille indépendante) consomme cette file et appelle Gemini
+Le pool Gemini n'attend ainsi jamais le CDN, et la mémoire reste bornée par la file.
+
+Optionnellement, les images quasi identiques (hash perceptuel) sont regroupées:
+une seule inférence par groupe, dont le résultat est recopié sur les autres membres.
+
+Le pipeline s'arrête proprement via un threading.Event (ex: client SSE déconnecté):
+plus aucun téléchargement ni appel Gemini n'est lancé, les résultats déjà obtenus
+sont transmis à on_result (persistance) même si plus personne ne les lit.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from image_hash import DedupIndex
+
+_STOP = object()
+
+
+class EnhancePipeline:
+    def __init__(self, prepare_fn, infer_fn, download_workers=16, inference_workers=10, queue_size=32,
+                 hash_fn=None, fan_out_fn=None, dedup_max_distance=4, on_result=None, cancel_event=None):
+        """
+        Initialise le pipeline
+
+        Args:
+            prepare_fn: fonction(item) -> payload prêt (ou None pour ignorer l'item)
+            infer_fn: fonction(item, payload) -> résultat
+            download_workers: Nombre de téléchargements simultanés
+            inference_workers: Nombre d'appels Gemini simultanés
+            queue_size: Nombre max d'images prêtes en attente d'inférence
+            hash_fn: fonction(payload) -> hash perceptuel (None = pas de déduplication)
+            fan_out_fn: fonction(résultat du leader, clé du leader, item, payload) -> résultat du doublon
+            dedup_max_distance: Distance de Hamming max entre deux images "identiques"
+            on_result: fonction(clé, résultat) appelée dans le worker dès qu'un résultat est prêt
+            cancel_event: threading.Event qui interrompt le pipeline quand il est activé
+        """
+        self.prepare_fn = prepare_fn
+        self.infer_fn = infer_fn
+        self.download_workers = max(1, int(download_workers))
+        self.inference_workers = max(1, int(inference_workers))
+        self.queue_size = max(1, int(queue_size))
+        self.on_result = on_result
+        self.cancel_event = cancel_event or threading.Event()
+
+        self._ready = queue.Queue(maxsize=self.queue_size)
+        self._results = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._max_queue_depth = 0
+        self._inference_wait = 0.0
+        self._download_time = 0.0
+        self._inference_time = 0.0
+
+        # Déduplication: leaders indexés par hash, doublons en attente du résultat du leader
+        self.hash_fn = hash_fn
+        self.fan_out_fn = fan_out_fn
+        self._dedup = DedupIndex(max_distance=dedup_max_distance) if hash_fn else None
+        self._group_lock = threading.Lock()
+        self._leader_hashes = {}
+        self._leader_results = {}
+        self._followers = {}
+        self._dedup_groups = set()
+        self._dedup_duplicates = 0
+
+    def cancel(self):
+        """
+        Arrêt coopératif: les tâches en attente sont abandonnées,
+        les appels déjà en cours se terminent et leurs résultats sont persistés
+        """
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _emit(self, key, result, error=None):
+        if result and self.on_result is not None:
+            try:
+                self.on_result(key, result)
+            except Exception as e:
+                print(f"⚠️ Persistance du résultat {key} impossible: {e}")
+        self._results.put((key, result, error))
+
+    def _download_task(self, key, item):
+        if self.cancelled:
+            return
+        started = time.time()
+        try:
+            payload = self.prepare_fn(item)
+        except Exception as e:
+            payload = None
+            self._emit(key, None, e)
+            return
+        finally:
+            with self._stats_lock:
+                self._download_time += time.time() - started
+
+        if payload is None:
+            # Rien à envoyer à Gemini (pas d'image exploitable)
+            self._emit(key, None)
+            return
+
+        if self._dedup is not None and self._attach_to_group(key, item, payload):
+            return
+
+        # put() bloquant: si la file est pleine, les téléchargements attendent (backpressure)
+        self._ready.put((key, item, payload))
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._ready.qsize())
+
+    def _inference_worker(self):
+        while True:
+            wait_started = time.time()
+            entry = self._ready.get()
+            with self._stats_lock:
+                self._inference_wait += time.time() - wait_started
+            if entry is _STOP:
+                return
+            if self.cancelled:
+                # Vider la file sans appeler Gemini (débloque les téléchargements en attente)
+                continue
+
+            self._infer(*entry)
+
+    def _infer(self, key, item, payload):
+        started = time.time()
+        result, error = None, None
+        try:
+            result = self.infer_fn(item, payload)
+        except Exception as e:
+            error = e
+        finally:
+            with self._stats_lock:
+                self._inference_time += time.time() - started
+
+        self._emit(key, result, error)
+        if self._dedup is not None:
+            self._resolve_group(key, result)
+
+    def _attach_to_group(self, key, item, payload):
+        """
+        Rattache l'image à un groupe de quasi-doublons existant
+
+        Returns:
+            bool: True si l'image n'a pas besoin de sa propre inférence
+        """
+        try:
+            value = self.hash_fn(payload)
+        except Exception as e:
+            print(f"⚠️ Hash perceptuel impossible pour {key}: {e}")
+            return False
+
+        with self._group_lock:
+            leader = self._dedup.find(value)
+            if leader is None:
+                # Nouveau groupe: cette image en est le leader
+                self._dedup.add(value, key)
+                self._leader_hashes[key] = value
+                self._followers[key] = []
+                return False
+
+            self._dedup_groups.add(leader)
+            self._dedup_duplicates += 1
+            if leader not in self._leader_results:
+                # Leader encore en cours: attendre son résultat
+                self._followers[leader].append((key, item, payload))
+                return True
+            leader_result = self._leader_results[leader]
+
+        self._emit(key, self.fan_out_fn(leader_result, leader, item, payload))
+        return True
+
+    def _resolve_group(self, leader, result):
+        """
+        Recopie le résultat du leader sur ses doublons (ou promeut un doublon si échec)
+        """
+        with self._group_lock:
+            followers = self._followers.pop(leader, [])
+            if result:
+                self._leader_results[leader] = result
+            else:
+                # Échec du leader: le premier doublon prend sa place avec sa propre image
+                self._dedup.remove(leader)
+                self._dedup_groups.discard(leader)
+                if followers:
+                    promoted_key, _, _ = followers[0]
+                    self._dedup.add(self._leader_hashes[leader], promoted_key)
+                    self._leader_hashes[promoted_key] = self._leader_hashes[leader]
+                    self._followers[promoted_key] = followers[1:]
+                    self._dedup_duplicates -= 1
+                    if len(followers) > 1:
+                        self._dedup_groups.add(promoted_key)
+
+        if result:
+            for key, item, payload in followers:
+                self._emit(key, self.fan_out_fn(result, leader, item, payload))
+        elif followers and not self.cancelled:
+            # Inférence directe dans ce worker (pas de put() dans la file bornée → pas d'interblocage)
+            self._infer(*followers[0])
+
+    def run(self, items):
+        """
+        Lance le pipeline
+
+        Args:
+            items: Liste de tuples (clé, item)
+
+        Yields:
+            tuple: (clé, résultat, exception) dans l'ordre de fin de traitement
+        """
+        if not items:
+            return
+
+        workers = [
+            threading.Thread(target=self._inference_worker, daemon=True)
+            for _ in range(self.inference_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        def feed():
+            # Après annulation, les tâches en attente se terminent immédiatement (voir _download_task)
+            with ThreadPoolExecutor(max_workers=self.download_workers) as downloads:
+                for key, item in items:
+                    if self.cancelled:
+                        break
+                    downloads.submit(self._download_task, key, item)
+            # Tous les téléchargements sont terminés: arrêter les workers d'inférence
+            for _ in workers:
+                self._ready.put(_STOP)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        received = 0
+        try:
+            while received < len(items):
+                try:
+                    entry = self._results.get(timeout=0.5)
+                except queue.Empty:
+                    if self.cancelled:
+                        # Annulé de l'extérieur: les tâches abandonnées ne produiront rien
+                        break
+                    continue
+                received += 1
+                yield entry
+        finally:
+            if received < len(items):
+                # Générateur fermé avant la fin (client déconnecté): arrêt coopératif
+                self.cancel()
+
+        feeder.join()
+        for worker in workers:
+            worker.join()
+
+    def stats(self):
+        """
+        Statistiques des deux étages (pour le rapport final)
+        """
+        with self._stats_lock:
+            return {
+                'download_workers': self.download_workers,
+                'inference_workers': self.inference_workers,
+                'prefetch_queue_size': self.queue_size,
+                'max_queue_depth': self._max_queue_depth,
+                'download_seconds': round(self._download_time, 2),
+                'inference_seconds': round(self._inference_time, 2),
+                'inference_idle_seconds': round(self._inference_wait, 2),
+                'dedup_groups': len(self._dedup_groups),
+                'dedup_duplicates': self._dedup_duplicates,
+            }
@@ -1,58 +1,28 @@
 import pandas as pd
 import google.generativeai as genai
-import requests
 import time
-import re
-from io import BytesIO
-from PIL import Image
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import threading
+from functools import partial
 from category_matcher import CategoryMatcher
+from config import ENHANCE_CONFIG
+from enhance_journal import EnhanceJournal
+from enhance_pipeline import EnhancePipeline
+from image_hash import dhash
+from image_workers import image_workers
+from single_flight import gemini_flight, call_key, content_hash
+from content_store import ListingContentStore
+from image_ingest import image_ingest, image_version
+from listing_schema import (
+    LISTING_SCHEMA, TAGS_SCHEMA, TAGS_COUNT, listing_parse_stats, parse_listing_json, normalize_tags,
+    shorten_title, clean_description, fix_glued_tag, invalid_fields
+)
 
-class GeminiEnhancer:
-    def __init__(self, api_key):
-        genai.configure(api_key=api_key)
-        # Utilisation de Gemini 2.5 Flash (meilleur pour images + long output)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-        print("✅ Gemini 2.5 Flash activé (1M tokens input, 65K output)")
-        
-        # Initialiser le système de catégorisation
-        try:
-            self.category_matcher = CategoryMatcher(api_key)
-            print("✅ Système de catégorisation automatique activé")
-        except Exception as e:
-            print(f"⚠️ Catégorisation automatique désactivée: {e}")
-            self.category_matcher = None
-    
-    def download_image_as_base64(self, url):
-        """
-        Télécharge une image depuis une URL CDN et la convertit en bytes
-        """
-        try:
-            # Nettoyer l'URL (parfois des paramètres bizarres)
-            clean_url = url.split('?')[0] + '?width=800' # Optimisation Shopify
-            response = requests.get(clean_url, timeout=5)
-            response.raise_for_status()
-            
-            img = Image.open(BytesIO(response.content))
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Redimensionner pour optimiser l'envoi (max 600px pour vitesse)
-            img.thumbnail((600, 600))
-            
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=75)
-            return buffered.getvalue()
-        except Exception as e:
-            print(f"Erreur image {url}: {e}")
-            return None
-    
-    def generate_product_content(self, image_bytes):
-        """
-        Utilise Gemini pour générer titre, description et tags
-        """
-        try:
-            prompt = """
+# Version du prompt de génération: la changer invalide les contenus stockés
+PROMPT_VERSION = 'listing-v1'
+
+# Consignes communes de génération (titre, description, tags)
+LISTING_INSTRUCTIONS = """
 CRITICAL INSTRUCTIONS: You MUST follow these formatting rules EXACTLY. No exceptions.
 
 Analyze this product image VISUALLY to create optimized Etsy listing content.
@@ -165,7 +135,10 @@ Generate:
      5. ALWAYS put spaces between words in tags: "bathroom faucet" NOT "bathroomfaucet".
      6. Multi-word tags are REQUIRED for better search visibility.
 
-Format your response EXACTLY like this:
+"""
+
+# Sortie texte libre (parsing par préfixes TITLE:/DESCRIPTION:/TAGS:)
+TEXT_OUTPUT_FORMAT = """Format your response EXACTLY like this:
 TITLE: [phrase 1] | [phrase 2]
 
 DESCRIPTION:
@@ -173,10 +146,77 @@ DESCRIPTION:
 
 TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
 """
-            image_part = {'mime_type': 'image/jpeg', 'data': image_bytes}
-            response = self.model.generate_content([prompt, image_part])
-            
-            content = response.text
+
+# Sortie JSON contrainte par LISTING_SCHEMA (limites Etsy revérifiées localement)
+JSON_OUTPUT_FORMAT = """Return ONLY a JSON object with these fields:
+- "title": the SEO title (max 140 characters, phrases separated by " | ")
+- "description": the structured description with emojis and real line breaks, NO bold text
+- "tags": an array of exactly 13 tags (lowercase, max 20 characters and max 3 words each)
+"""
+
+# Réparation ciblée d'un seul champ invalide
+REPAIR_PROMPTS = {
+    'title': """Write a new Etsy SEO title for the product in this image.
+Rules: max 140 characters, 2 or 3 keyword-rich phrases separated by " | ", start with the most distinctive feature.
+Current description (for context): {description}
+Return ONLY a JSON object: {{"title": "..."}}""",
+    'description': """Write the Etsy description for the product in this image, titled "{title}".
+Structure: hook paragraph, two detailed paragraphs starting with emoji + creative title,
+"✨ Features" with 5-6 lines starting with "✅ ", "❓ FAQ" with 5-6 Q&A ("➡️ " questions, "🔹 " answers).
+NEVER use asterisks or bold text. Simple, sales-oriented tone.
+Return ONLY a JSON object: {{"description": "..."}}""",
+    'tags': """Etsy listing title: "{title}"
+Existing tags: {tags}
+Give {count} NEW search tags for the product in this image, different from the existing ones.
+Rules: English, lowercase, max 20 characters and max 3 words per tag, words separated by spaces,
+no generic terms, no isolated adjectives, no quantities.
+Return ONLY a JSON object: {{"tags": ["...", "..."]}}""",
+}
+
+class GeminiEnhancer:
+    def __init__(self, api_key, content_store=None, output_mode=None):
+        # Stockage persistant des contenus générés (optionnel, voir ListingContentStore)
+        self.content_store = content_store
+        # 'json' (schéma + validation locale) ou 'text' (parsing par préfixes)
+        self.output_mode = output_mode or ENHANCE_CONFIG['output_mode']
+        
+        genai.configure(api_key=api_key)
+        # Utilisation de Gemini 2.5 Flash (meilleur pour images + long output)
+        self.model_name = 'gemini-2.5-flash'
+        self.model = genai.GenerativeModel(self.model_name)
+        print("✅ Gemini 2.5 Flash activé (1M tokens input, 65K output)")
+        
+        # Initialiser le système de catégorisation
+        try:
+            self.category_matcher = CategoryMatcher(api_key)
+            print("✅ Système de catégorisation automatique activé")
+        except Exception as e:
+            print(f"⚠️ Catégorisation automatique désactivée: {e}")
+            self.category_matcher = None
+    
+    def download_image_as_base64(self, url):
+        """
+        Télécharge une image depuis une URL CDN et la convertit en bytes
+        (JPEG 600px via la session HTTP partagée, voir image_ingest)
+        """
+        return image_ingest.load(url, 'enhance')
+    
+    def generate_product_content(self, image_bytes):
+        """
+        Utilise Gemini pour générer titre, description et tags
+        En mode 'json', la réponse est contrainte par un schéma puis validée localement.
+        """
+        if self.output_mode == 'json':
+            return self.generate_product_content_json(image_bytes)
+        
+        try:
+            prompt = LISTING_INSTRUCTIONS + TEXT_OUTPUT_FORMAT
+            image_part = {'mime_type': image_ingest.mime_type('enhance'), 'data': image_bytes}
+            # Appels identiques simultanés (même image, même prompt) → une seule requête Gemini
+            content = gemini_flight.do(
+                call_key(self.model_name, prompt, image_bytes),
+                lambda: self.model.generate_content([prompt, image_part]).text
+            )
             
             # Parsing robuste qui préserve les sauts de ligne
             title = ""
@@ -207,11 +247,11 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
                         description += "\n"
             
             # POST-TRAITEMENT FORCÉ pour garantir le formatage correct
-            # Supprimer tout le texte en gras de la description
-            description = description.replace('**', '').replace('* ', ' ').replace(' *', ' ')
+            # Supprimer tout le texte en gras et les sauts de ligne multiples
+            description = clean_description(description)
             
-            # Nettoyer les sauts de ligne multiples mais en garder un entre les sections
-            description = description.replace('\n\n\n', '\n\n').strip()
+            # 📊 Réponse texte mal formée (préfixe TITLE:/DESCRIPTION:/TAGS: introuvable)
+            listing_parse_stats.record('text', parse_failed=not (title and description and tags))
             
             # Nettoyer les tags: supprimer les espaces après les virgules et forcer minuscules
             if tags:
@@ -224,18 +264,7 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
                 
                 # 🔧 CORRECTION: Ajouter des espaces dans les mots composés collés
                 # Détecter les mots collés (ex: bathroomfaucet) et les séparer
-                tag_list = tags.split(',')
-                fixed_tags = []
-                for tag in tag_list:
-                    tag = tag.strip()
-                    # Si le tag a plus de 12 caractères sans espace, c'est probablement collé
-                    if len(tag) > 12 and ' ' not in tag:
-                        # Insérer un espace avant chaque majuscule (camelCase) ou avant des mots communs
-                        # Patterns courants: bathroom, kitchen, chrome, modern, etc.
-                        tag = re.sub(r'(bathroom|kitchen|chrome|modern|vintage|rustic|wooden|metal|glass|ceramic|plastic|waterfall|single|double|pull|down|handle|lever|mixer|basin|sink|lavatory|vanity|counter|wall|mounted|floor|standing|tall|short|wide|narrow|round|square|oval|rectangular)', r'\1 ', tag)
-                        tag = tag.strip()
-                    fixed_tags.append(tag)
-                tags = ','.join(fixed_tags)
+                tags = ','.join(fix_glued_tag(tag) for tag in tags.split(','))
             
             return {
                 'title': title[:139] if title else "Titre à vérifier",
@@ -247,23 +276,163 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
             print(f"Erreur Gemini: {e}")
             return None
 
+    def generate_product_content_json(self, image_bytes):
+        """
+        Mode JSON: Gemini répond selon LISTING_SCHEMA, les limites Etsy
+        (titre 140 car., 13 tags de 20 car. max) sont vérifiées localement
+        et seul le champ invalide est réparé (sans tout régénérer)
+        """
+        try:
+            prompt = LISTING_INSTRUCTIONS + JSON_OUTPUT_FORMAT
+            image_part = {'mime_type': image_ingest.mime_type('enhance'), 'data': image_bytes}
+            content = gemini_flight.do(
+                call_key(self.model_name, prompt, image_bytes),
+                lambda: self.model.generate_content(
+                    [prompt, image_part],
+                    generation_config={'response_mime_type': 'application/json', 'response_schema': LISTING_SCHEMA}
+                ).text
+            )
+            
+            listing = parse_listing_json(content)
+            if listing is None:
+                listing_parse_stats.record('json', parse_failed=True)
+                print("⚠️ Réponse JSON Gemini inexploitable")
+                return None
+            
+            # Corrections locales (aucun appel): titre raccourci, gras retiré, tags filtrés
+            listing['title'] = shorten_title(listing['title'])
+            listing['description'] = clean_description(listing['description'])
+            listing['tags'] = normalize_tags(listing['tags'])
+            
+            # Réparation ciblée: uniquement les champs encore invalides
+            repaired = invalid_fields(listing)
+            for field in repaired:
+                try:
+                    self._repair_field(listing, field, image_part)
+                except Exception as e:
+                    print(f"⚠️ Réparation du champ {field} impossible: {e}")
+            listing_parse_stats.record('json', repaired_fields=repaired)
+            
+            return {
+                'title': listing['title'] or "Titre à vérifier",
+                'description': listing['description'] or "Description à générer",
+                'tags': ','.join(listing['tags'])
+            }
+        
+        except Exception as e:
+            print(f"Erreur Gemini: {e}")
+            return None
+
+    def _repair_field(self, listing, field, image_part):
+        """
+        Redemande à Gemini un seul champ (titre, description ou tags manquants)
+        """
+        prompt = REPAIR_PROMPTS[field].format(
+            title=listing['title'],
+            description=listing['description'][:500],
+            tags=', '.join(listing['tags']),
+            count=TAGS_COUNT - len(listing['tags']) + 3  # Marge: certains tags seront filtrés
+        )
+        # Les tags réparés complètent la liste existante: pas de min/max_items
+        field_schema = TAGS_SCHEMA['properties']['tags'] if field == 'tags' else LISTING_SCHEMA['properties'][field]
+        schema = {'type': 'object', 'properties': {field: field_schema}, 'required': [field]}
+        response = self.model.generate_content(
+            [prompt, image_part],
+            generation_config={'response_mime_type': 'application/json', 'response_schema': schema}
+        )
+        repaired = parse_listing_json(response.text) or {}
+        
+        if field == 'title':
+            listing['title'] = shorten_title(repaired.get('title', ''))
+        elif field == 'description':
+            listing['description'] = clean_description(repaired.get('description', ''))
+        else:
+            listing['tags'] = normalize_tags(listing['tags'] + repaired.get('tags', []))
+
     def process_single_product(self, row, max_retries=3):
         """
         Traite un seul produit avec retry automatique en cas d'échec
         max_retries: nombre de tentatives (défaut 3)
         """
+        image_bytes = self.prepare_product(row)
+        if not image_bytes:
+            return None
+        
+        return self.generate_for_product(row, image_bytes, max_retries)
+
+    def prepare_product(self, row):
+        """
+        Étage 1 du pipeline: télécharge et prépare l'image Photo 1 d'un produit
+        
+        Returns:
+            bytes: Image prête pour Gemini ou None
+        """
         first_image = row.get('Photo 1')
-        sku = row.get('SKU', '')
         
         if not first_image or pd.isna(first_image):
             return None
         
-        image_bytes = self.download_image_as_base64(first_image)
-        if not image_bytes:
+        return self.download_image_as_base64(first_image)
+
+    @property
+    def prompt_version(self):
+        return f"{PROMPT_VERSION}-{self.output_mode}"
+
+    def _store_key(self, row, image_bytes):
+        """
+        Clé du stockage persistant: (identité produit, hash image source, version du prompt)
+        """
+        return (
+            ListingContentStore.product_key(row.get('Photo 1')),
+            content_hash(image_bytes),
+            self.prompt_version
+        )
+
+    def stored_content(self, row):
+        """
+        Contenu déjà généré pour une Photo 1 inchangée, sans télécharger l'image
+        La version CDN (?v=) change quand Shopify remplace l'image: même version = même photo.
+        
+        Returns:
+            dict: Contenu stocké ou None (pas de store, URL sans version ou rien de stocké)
+        """
+        if self.content_store is None:
+            return None
+        photo = row.get('Photo 1')
+        version = image_version(photo)
+        if not version:
+            return None
+        stored = self.content_store.get_for_version(ListingContentStore.product_key(photo), version, self.prompt_version)
+        if not stored:
             return None
+        return {'sku': row.get('SKU', ''), **stored, 'from_store': True}
+
+    def generate_for_product(self, row, image_bytes, max_retries=3, regenerate=False, cancel_event=None):
+        """
+        Étage 2 du pipeline: génère le contenu Gemini pour une image déjà préparée
+        max_retries: nombre de tentatives (défaut 3)
+        regenerate: ignorer le contenu déjà stocké et rappeler Gemini
+        cancel_event: threading.Event qui interrompt les retries (client déconnecté)
+        """
+        sku = row.get('SKU', '')
+        
+        # 💾 Contenu déjà généré pour ce produit et cette image: aucun appel Gemini
+        store_key = None
+        source_version = image_version(row.get('Photo 1'))
+        if self.content_store is not None:
+            store_key = self._store_key(row, image_bytes)
+            if not regenerate:
+                stored = self.content_store.get(*store_key)
+                if stored:
+                    if source_version:
+                        # Même image sous une nouvelle version CDN: retrouvée sans téléchargement la prochaine fois
+                        self.content_store.put(*store_key, stored, source_version=source_version)
+                    return {'sku': sku, **stored, 'from_store': True}
         
         # 🔄 RETRY LOGIC avec backoff exponentiel
         for attempt in range(max_retries):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
             try:
                 content = self.generate_product_content(image_bytes)
                 if content:
@@ -287,13 +456,16 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
                         except Exception as e:
                             print(f"⚠️ Erreur catégorisation pour {sku}: {e}")
                     
+                    if store_key is not None:
+                        self.content_store.put(*store_key, result, source_version=source_version)
+                    
                     return result
                 else:
                     # Pas de contenu généré, réessayer
                     if attempt < max_retries - 1:
                         wait_time = (attempt + 1) * 2  # 2s, 4s, 6s
                         print(f"⚠️ Retry {attempt + 1}/{max_retries} pour {sku} dans {wait_time}s...")
-                        time.sleep(wait_time)
+                        self._wait(wait_time, cancel_event)
                         continue
                     return None
                     
@@ -302,14 +474,48 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
                     wait_time = (attempt + 1) * 2
                     print(f"❌ Erreur {sku} (tentative {attempt + 1}/{max_retries}): {e}")
                     print(f"   Retry dans {wait_time}s...")
-                    time.sleep(wait_time)
+                    self._wait(wait_time, cancel_event)
                 else:
                     print(f"❌ Échec définitif pour {sku} après {max_retries} tentatives: {e}")
                     return None
         
         return None
 
-    def enhance_generator(self, input_path, output_path):
+    @staticmethod
+    def _wait(seconds, cancel_event=None):
+        """
+        Pause interrompue immédiatement si le traitement est annulé
+        """
+        if cancel_event is not None:
+            cancel_event.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def fan_out_duplicate(self, leader_result, leader_idx, row, image_bytes, leader_photos=None):
+        """
+        Recopie le contenu généré pour une photo quasi identique (clone couleur/taille)
+        Le titre est signalé pour une éventuelle différenciation manuelle.
+        
+        leader_photos: {index de ligne: Photo 1}; le leader est aussi enregistré par son
+        identité produit, pour retrouver le groupe quand le contenu est relu du store
+        """
+        result = dict(leader_result)
+        # Contenu issu de l'inférence du leader, pas du store: ne pas compter de store hit
+        result.pop('from_store', None)
+        result['sku'] = row.get('SKU', '')
+        result['duplicate_of'] = int(leader_idx)
+        result['needs_title_differentiation'] = True
+        if leader_photos is not None and leader_idx in leader_photos:
+            result['duplicate_of_key'] = ListingContentStore.product_key(leader_photos[leader_idx])
+        
+        if self.content_store is not None:
+            self.content_store.put(*self._store_key(row, image_bytes), result,
+                                   source_version=image_version(row.get('Photo 1')))
+        return result
+
+    def enhance_generator(self, input_path, output_path, resume=False, journal_path=None,
+                          download_workers=None, inference_workers=None, prefetch_queue_size=None,
+                          dedup=None, regenerate=False, cancel_event=None):
         """
         Générateur qui yield la progression pour le streaming
         Utilise le parallélisme (Batch Processing)
@@ -317,6 +523,23 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
         IMPORTANT: Avec les variantes Etsy, seules les lignes avec Photo 1 sont des 
         produits principaux. Les lignes sans Photo 1 sont des variantes et ne doivent
         pas avoir de Title/Description/Tags.
+        
+        Chaque produit terminé est écrit dans un journal JSONL. Avec resume=True,
+        les produits déjà présents dans le journal ne sont pas renvoyés à Gemini
+        et le CSV final est reconstruit depuis le journal.
+        
+        Les tailles des pools (téléchargement / Gemini) et de la file de préchargement
+        sont lues dans ENHANCE_CONFIG si elles ne sont pas fournies.
+        
+        Avec dedup=True, les Photo 1 quasi identiques (dHash) partagent une seule
+        génération Gemini, recopiée sur chaque membre du groupe.
+        
+        Si un content_store est configuré, les contenus déjà générés pour la même
+        image source sont réutilisés sans appel Gemini (sauf regenerate=True).
+        Une Photo 1 dont la version CDN (?v=) n'a pas changé n'est même pas téléchargée.
+        
+        cancel_event (ou la fermeture du générateur) arrête le pipeline: plus aucun
+        appel n'est lancé et les résultats déjà obtenus restent dans le journal.
         """
         df = pd.read_csv(input_path)
         
@@ -334,9 +557,6 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
         main_indices = main_products.index.tolist()
         unique_rows = [df.loc[idx] for idx in main_indices]
         
-        # Dictionnaire pour stocker les résultats par index de ligne
-        results_map = {}
-        
         if not unique_rows:
             yield {
                 'status': 'complete',
@@ -346,50 +566,128 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
             }
             return
         
-        # Utiliser un ThreadPoolExecutor pour paralléliser (10 workers pour vitesse optimale)
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # Lancer les tâches avec l'index comme clé
-            future_to_idx = {
-                executor.submit(self.process_single_product, row): idx 
-                for idx, row in zip(main_indices, unique_rows)
+        # 📓 Journal de reprise (un produit par ligne, écrit dès qu'il est terminé)
+        if journal_path is None:
+            journal_path = os.path.splitext(output_path)[0] + '.journal.jsonl'
+        journal = EnhanceJournal(journal_path)
+        
+        product_keys = {
+            idx: EnhanceJournal.product_key(idx, row['Photo 1'])
+            for idx, row in zip(main_indices, unique_rows)
+        }
+        
+        if resume:
+            journaled = journal.load()
+        else:
+            journal.reset()
+            journaled = {}
+        
+        pending = [
+            (idx, row) for idx, row in zip(main_indices, unique_rows)
+            if product_keys[idx] not in journaled
+        ]
+        
+        processed = len(unique_rows) - len(pending)
+        if processed:
+            print(f"♻️ Reprise: {processed} produits déjà présents dans le journal")
+            yield {
+                'status': 'processing',
+                'message': f"♻️ Reprise: {processed} produits déjà optimisés",
+                'progress': int((processed / len(unique_rows)) * 100)
             }
-            
-            processed = 0
-            for future in as_completed(future_to_idx):
-                idx = future_to_idx[future]
-                # sku = df.loc[idx, 'SKU'] if pd.notna(df.loc[idx, 'SKU']) else f"Produit-{idx}"
+        
+        # 💾 Photo inchangée (même version CDN): contenu stocké servi sans téléchargement
+        if self.content_store is not None and not regenerate:
+            to_generate = []
+            for idx, row in pending:
+                stored = self.stored_content(row)
+                if stored is None:
+                    to_generate.append((idx, row))
+                    continue
+                journal.append(product_keys[idx], idx, stored)
                 processed += 1
-                product_label = f"Produit #{processed}"
+                yield {
+                    'status': 'processing',
+                    'message': f"💾 Déjà optimisé: Produit #{processed}",
+                    'progress': int((processed / len(unique_rows)) * 100)
+                }
+            pending = to_generate
+        
+        # Partagé avec les workers: la fermeture du générateur interrompt aussi les retries
+        if cancel_event is None:
+            cancel_event = threading.Event()
+        
+        # Pipeline 2 étages: téléchargements et appels Gemini dimensionnés séparément
+        pipeline = EnhancePipeline(
+            prepare_fn=self.prepare_product,
+            infer_fn=lambda row, image_bytes: self.generate_for_product(
+                row, image_bytes, regenerate=regenerate, cancel_event=cancel_event
+            ),
+            download_workers=download_workers or ENHANCE_CONFIG['download_workers'],
+            inference_workers=inference_workers or ENHANCE_CONFIG['inference_workers'],
+            queue_size=prefetch_queue_size or ENHANCE_CONFIG['prefetch_queue_size'],
+            hash_fn=partial(image_workers.run, dhash) if (ENHANCE_CONFIG['dedup'] if dedup is None else dedup) else None,
+            fan_out_fn=partial(self.fan_out_duplicate, leader_photos={
+                idx: row['Photo 1'] for idx, row in zip(main_indices, unique_rows)
+            }),
+            dedup_max_distance=ENHANCE_CONFIG['dedup_max_distance'],
+            # Journalisé dans le worker: persisté même si le client SSE est parti
+            on_result=lambda idx, result: journal.append(product_keys[idx], idx, result),
+            cancel_event=cancel_event
+        )
+        print(f"⚙️ Pipeline: {pipeline.download_workers} téléchargements, "
+              f"{pipeline.inference_workers} workers Gemini, file de {pipeline.queue_size}")
+        
+        for idx, result, error in pipeline.run(pending):
+            processed += 1
+            product_label = f"Produit #{processed}"
+            
+            if error is not None:
+                print(f"Erreur thread {product_label}: {error}")
+                yield {
+                    'status': 'processing',
+                    'message': f"❌ Erreur: {product_label}",
+                    'progress': int((processed / len(unique_rows)) * 100)
+                }
+            elif result:
+                # Afficher la catégorie si disponible
+                category_info = ""
+                if 'category' in result and result['category']:
+                    # Afficher seulement la dernière partie de la catégorie pour ne pas surcharger
+                    cat_parts = result['category'].split(' > ')
+                    category_info = f" → {cat_parts[-1]}"
                 
-                try:
-                    result = future.result()
-                    if result:
-                        results_map[idx] = result
-                        # Afficher la catégorie si disponible
-                        category_info = ""
-                        if 'category' in result and result['category']:
-                            # Afficher seulement la dernière partie de la catégorie pour ne pas surcharger
-                            cat_parts = result['category'].split(' > ')
-                            category_info = f" → {cat_parts[-1]}"
-                        
-                        yield {
-                            'status': 'processing',
-                            'message': f"✅ Optimisé: {product_label}{category_info}",
-                            'progress': int((processed / len(unique_rows)) * 100)
-                        }
-                    else:
-                        yield {
-                            'status': 'processing',
-                            'message': f"⚠️ Ignoré: {product_label}",
-                            'progress': int((processed / len(unique_rows)) * 100)
-                        }
-                except Exception as e:
-                    print(f"Erreur thread {product_label}: {e}")
-                    yield {
-                        'status': 'processing',
-                        'message': f"❌ Erreur: {product_label}",
-                        'progress': int((processed / len(unique_rows)) * 100)
-                    }
+                yield {
+                    'status': 'processing',
+                    'message': f"✅ Optimisé: {product_label}{category_info}",
+                    'progress': int((processed / len(unique_rows)) * 100)
+                }
+            else:
+                yield {
+                    'status': 'processing',
+                    'message': f"⚠️ Ignoré: {product_label}",
+                    'progress': int((processed / len(unique_rows)) * 100)
+                }
+        
+        pipeline_stats = pipeline.stats()
+        print(f"📈 Pipeline: {pipeline_stats}")
+        
+        if pipeline.cancelled:
+            print(f"🛑 Traitement annulé: {processed}/{len(unique_rows)} produits, reprise possible depuis le journal")
+            yield {
+                'status': 'cancelled',
+                'message': f"🛑 Traitement annulé ({processed}/{len(unique_rows)}). Cochez « Reprendre le traitement interrompu » et relancez pour continuer.",
+                'progress': int((processed / len(unique_rows)) * 100)
+            }
+            return
+        
+        # Reconstruire les résultats depuis le journal (source de vérité)
+        journaled = journal.load()
+        results_map = {
+            idx: journaled[key]['result']
+            for idx, key in product_keys.items()
+            if key in journaled
+        }
         
         # Appliquer les résultats UNIQUEMENT aux lignes principales (pas aux variantes)
         print("Application des résultats aux produits principaux...")
@@ -400,36 +698,61 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
             'missing_description': [],
             'missing_tags': [],
             'missing_category': [],
+            'duplicate_titles': [],
+            'dedup_groups': 0,
+            'dedup_duplicates': 0,
+            'store_hits': 0,
             'total_processed': len(results_map),
             'total_products': len(unique_rows)
         }
         
-        for idx, data in results_map.items():
-            product_num = list(results_map.keys()).index(idx) + 1
-            
-            # Appliquer et vérifier le titre
-            if data.get('title'):
-                df.loc[idx, 'Title'] = data['title']
-            else:
-                errors_report['missing_title'].append(f"Produit #{product_num} (ligne {idx})")
-            
-            # Appliquer et vérifier la description
-            if data.get('description'):
-                df.loc[idx, 'Description'] = data['description']
-            else:
-                errors_report['missing_description'].append(f"Produit #{product_num} (ligne {idx})")
-            
-            # Appliquer et vérifier les tags
-            if data.get('tags'):
-                df.loc[idx, 'Tags'] = data['tags']
-            else:
-                errors_report['missing_tags'].append(f"Produit #{product_num} (ligne {idx})")
-            
-            # 🎯 Appliquer et vérifier la catégorie automatique
-            if 'category' in data and data['category']:
-                df.loc[idx, 'Category'] = data['category']
-            else:
-                errors_report['missing_category'].append(f"Produit #{product_num} (ligne {idx})")
+        # Une seule passe sur les résultats: on collecte les valeurs par colonne
+        # puis on les applique en une affectation vectorisée par colonne
+        columns_map = {
+            'title': ('Title', 'missing_title'),
+            'description': ('Description', 'missing_description'),
+            'tags': ('Tags', 'missing_tags'),
+            'category': ('Category', 'missing_category'),  # 🎯 Catégorie automatique
+        }
+        column_updates = {field: ([], []) for field in columns_map}
+        dedup_leaders = set()
+        # Doublons relus du store: leader retrouvé par son identité produit
+        rows_by_product = {
+            ListingContentStore.product_key(row['Photo 1']): idx
+            for idx, row in zip(main_indices, unique_rows)
+        }
+        
+        for product_num, (idx, data) in enumerate(results_map.items(), start=1):
+            if data.get('from_store'):
+                errors_report['store_hits'] += 1
+            # 🧬 Doublon visuel: contenu recopié, titre à différencier éventuellement
+            duplicate_of = data.get('duplicate_of')
+            if duplicate_of is None and data.get('duplicate_of_key'):
+                duplicate_of = rows_by_product.get(data['duplicate_of_key'])
+            if duplicate_of is not None:
+                dedup_leaders.add(duplicate_of)
+                errors_report['duplicate_titles'].append(
+                    f"Produit #{product_num} (ligne {idx}, même photo que ligne {duplicate_of})"
+                )
+
+            for field, (_, error_key) in columns_map.items():
+                value = data.get(field)
+                if value:
+                    column_updates[field][0].append(idx)
+                    column_updates[field][1].append(value)
+                else:
+                    errors_report[error_key].append(f"Produit #{product_num} (ligne {idx})")
+        
+        errors_report['dedup_groups'] = len(dedup_leaders)
+        errors_report['dedup_duplicates'] = len(errors_report['duplicate_titles'])
+        
+        for field, (column, _) in columns_map.items():
+            indices, values = column_updates[field]
+            if not indices:
+                continue
+            # Colonnes vides lues comme float par pandas: passer en object avant d'y écrire du texte
+            df[column] = df[column].astype(object)
+            df.loc[indices, column] = pd.Series(values, index=indices, dtype=object)
         
         # Les lignes de variantes (sans Photo 1) gardent Title/Description/Tags vides
         # C'est le comportement attendu par Etsy
@@ -452,10 +775,18 @@ TAGS: tag1,tag2,tag3,tag4,tag5,tag6,tag7,tag8,tag9,tag10,tag11,tag12,tag13
         else:
             status_message = f"⚠️ {success_count} produits traités avec {total_errors} erreurs"
         
+        if errors_report['store_hits']:
+            status_message += f" (💾 {errors_report['store_hits']} contenus réutilisés sans appel Gemini)"
+        
+        if errors_report['dedup_duplicates']:
+            status_message += (f" (🧬 {errors_report['dedup_duplicates']} doublons visuels servis par "
+                               f"{errors_report['dedup_groups']} générations)")
+        
         yield {
             'status': 'complete',
             'message': status_message,
             'errors_report': errors_report,
+            'pipeline': pipeline_stats,
             'output_file': 'etsy_final.csv',
             'products_count': len(results_map)
         }
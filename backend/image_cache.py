@@ -0,0 +1,167 @@
+"""
+Cache disque des images sources téléchargées (adressé par contenu)
+Clé: URL normalisée (version ?v= comprise) + largeur CDN. Les octets bruts sont stockés
+à une largeur commune: /api/enhance, la génération d'images et les relances en dérivent
+chacun leur propre encodage au lieu de retélécharger l'image.
+
+- écritures atomiques (fichier temporaire + os.replace): jamais de fichier à moitié écrit
+- éviction LRU (date de dernier accès = mtime) au-delà d'un budget en octets
+- plusieurs threads / process Flask peuvent partager le même dossier: un fichier
+  supprimé par un autre process pendant une lecture est simplement un miss
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+
+class ImageCache:
+    SUFFIX = '.img'
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        """
+        Initialise le cache (le dossier est créé à la première écriture)
+
+        Args:
+            cache_dir: Dossier du cache
+            max_bytes: Budget disque max en octets
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # Taille estimée (ce process); recalculée sur disque à chaque éviction
+        self._approx_bytes = None
+
+    @staticmethod
+    def make_key(url, width=None):
+        """
+        Clé de cache d'une image
+
+        Args:
+            url: URL de l'image (seul le paramètre de version ?v= est gardé: une image
+                 remplacée au même chemin change de version, donc de clé)
+            width: Largeur demandée au CDN
+        """
+        url = str(url).strip()
+        version = parse_qs(urlsplit(url).query).get('v')
+        normalized = url.split('?')[0] + (f'?v={version[0]}' if version else '')
+        return hashlib.sha256(f"{normalized}|{width or ''}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.SUFFIX)
+
+    def get(self, key):
+        """
+        Returns:
+            bytes: Image en cache ou None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Marquer comme récemment utilisée (ordre LRU)
+            os.utime(path, None)
+        except OSError:
+            # Absente, ou évincée entre-temps par un autre process
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Enregistre une image (remplacement atomique)
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        except OSError as e:
+            print(f"⚠️ Cache image: écriture impossible ({e})")
+            return
+
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._disk_usage()[0]
+            else:
+                self._approx_bytes += len(data)
+            over_budget = self._approx_bytes > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def _scan(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _disk_usage(self):
+        entries = self._scan()
+        return sum(size for _, size, _ in entries), len(entries)
+
+    def evict(self):
+        """
+        Supprime les images les moins récemment utilisées jusqu'à 90% du budget
+        """
+        with self._lock:
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self._evictions += 1
+                except FileNotFoundError:
+                    # Déjà évincée par un autre process
+                    pass
+                except OSError:
+                    continue
+                total -= size
+            self._approx_bytes = total
+
+    def stats(self):
+        """
+        Compteurs du cache (exposés par /api/stats)
+        """
+        total_bytes, entries = self._disk_usage()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'entries': entries,
+                'bytes': total_bytes,
+                'max_bytes': self.max_bytes,
+            }
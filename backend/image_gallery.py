@@ -0,0 +1,167 @@
+"""
+Galerie locale des images générées (adressée par contenu) + manifeste par produit
+Chaque image est écrite sur disque dès sa génération: si l'upload Shopify échoue
+(ou si le client se déconnecte), l'upload peut être relancé depuis le manifeste
+sans rappeler Gemini. Même chose pour un ré-upload dans un autre ordre.
+
+    gallery/blobs/ab/<sha256>.<ext>     image (écrite une seule fois)
+    gallery/manifests/<product_id>.json  variations générées et état de l'upload
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from image_ingest import sniff_image_type
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ImageGallery:
+    def __init__(self, root):
+        """
+        Args:
+            root: Dossier de la galerie
+        """
+        self.root = root
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _product_key(product_id):
+        # ID numérique ou GID Shopify → nom de fichier sûr
+        return str(product_id).rsplit('/', 1)[-1].replace('..', '_')
+
+    def _blob_path(self, digest, extension):
+        return os.path.join(self.root, 'blobs', digest[:2], f"{digest}.{extension}")
+
+    def _manifest_path(self, product_id):
+        return os.path.join(self.root, 'manifests', f"{self._product_key(product_id)}.json")
+
+    def store(self, image_bytes):
+        """
+        Enregistre une image (une seule copie par contenu)
+
+        Returns:
+            str: Référence de l'image ('<sha256>.<ext>')
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        extension = sniff_image_type(image_bytes)[1]
+        path = self._blob_path(digest, extension)
+        if not os.path.exists(path):
+            _atomic_write(path, image_bytes)
+        return f"{digest}.{extension}"
+
+    def load(self, ref):
+        """
+        Returns:
+            bytes: Image ou None si absente
+        """
+        digest, extension = ref.split('.', 1)
+        try:
+            with open(self._blob_path(digest, extension), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def manifest(self, product_id):
+        """
+        Returns:
+            dict: Manifeste du produit ou None
+        """
+        try:
+            with open(self._manifest_path(product_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _save_manifest(self, manifest):
+        manifest['updated_at'] = time.time()
+        _atomic_write(
+            self._manifest_path(manifest['product_id']),
+            json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        )
+
+    def start_run(self, product_id, source_image_url=None, replace=True):
+        """
+        Nouveau manifeste pour une génération (les images déjà stockées restent sur disque)
+
+        Args:
+            product_id: ID du produit Shopify
+            source_image_url: Image source de la génération
+            replace: True = les images remplacent celles du produit, False = ajout
+        """
+        with self._lock:
+            self._save_manifest({
+                'product_id': str(product_id),
+                'source_image_url': source_image_url,
+                'replace': replace,
+                'status': 'generating',
+                'images': [],
+                'new_urls': [],
+                'error': None,
+                'created_at': time.time(),
+            })
+
+    def add_image(self, product_id, variation, image_bytes):
+        """
+        Enregistre une variation générée dans la galerie et le manifeste
+        """
+        ref = self.store(image_bytes)
+        with self._lock:
+            manifest = self.manifest(product_id)
+            if manifest is None:
+                return ref
+            manifest['images'] = [img for img in manifest['images'] if img['variation'] != variation]
+            manifest['images'].append({'variation': variation, 'ref': ref, 'bytes': len(image_bytes)})
+            manifest['images'].sort(key=lambda img: img['variation'])
+            self._save_manifest(manifest)
+        return ref
+
+    def images(self, product_id, order=None):
+        """
+        Images du manifeste prêtes à uploader
+
+        Args:
+            product_id: ID du produit Shopify
+            order: Liste de numéros de variation (None = ordre des variations)
+
+        Returns:
+            list: [(variation, bytes), ...] (les images absentes du disque sont ignorées)
+        """
+        manifest = self.manifest(product_id) or {'images': []}
+        by_variation = {img['variation']: img['ref'] for img in manifest['images']}
+        variations = [v for v in order if v in by_variation] if order else sorted(by_variation)
+        images = []
+        for variation in variations:
+            image_bytes = self.load(by_variation[variation])
+            if image_bytes is not None:
+                images.append((variation, image_bytes))
+        return images
+
+    def set_status(self, product_id, status, new_urls=None, error=None):
+        """
+        Met à jour l'état de l'upload ('generating', 'uploaded', 'upload_failed', 'cancelled')
+        """
+        with self._lock:
+            manifest = self.manifest(product_id)
+            if manifest is None:
+                return
+            manifest['status'] = status
+            manifest['error'] = error
+            if new_urls is not None:
+                manifest['new_urls'] = new_urls
+            self._save_manifest(manifest)
@@ -4,30 +4,69 @@ Génère des variations réalistes de produits à partir d'une image source
 """
 from google import genai
 from google.genai import types
-import requests
 import base64
-import time
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from PIL import Image
+from single_flight import gemini_flight, call_key, content_hash
+from image_ingest import image_ingest
+from image_ops import encode_output_image
+from image_workers import image_workers
+from config import IMAGE_GENERATION_CONFIG, IMAGE_OUTPUT_CONFIG, SHOPIFY_UPLOAD_CONFIG
+from reference_uploader import GeminiFilesUploader, InlineReferenceUploader, is_invalid_reference_error, reference_cache
+from rate_limiter import gemini_image_limiter
+from upload_pipeline import ProductImageUploader
+
+# Version du prompt d'analyse (étape 1): la changer invalide les prompts stockés
+SCENE_PROMPT_VERSION = 'scenes-v1'
 
 class ImageGenerator:
-    def __init__(self, api_key):
+    def __init__(self, api_key, reference_mode=None, reference_uploader=None, prompt_store=None):
         """
         Initialise le générateur d'images avec Gemini 2.5 Flash Image
         
         Args:
             api_key: Clé API Google Gemini
+            reference_mode: 'inline' ou 'files' (image source uploadée une fois, voir reference_uploader)
+            reference_uploader: ReferenceUploader à utiliser à la place (ex: stand-in local)
+            prompt_store: Stockage des prompts déjà générés (optionnel, voir ScenePromptStore)
         """
         self.api_key = api_key
+        self.prompt_store = prompt_store
         
         # Utiliser la nouvelle API genai pour la génération d'images
         # Modèle officiel: gemini-2.5-flash-image (Nano Banana)
         self.client = genai.Client(api_key=api_key)
         self.model_name = "gemini-2.5-flash-image"
         
+        # Image source: envoyée inline à chaque appel, ou uploadée une fois puis référencée
+        self.reference_mode = reference_mode or IMAGE_GENERATION_CONFIG['reference_mode']
+        if reference_uploader is not None:
+            self.reference_uploader = reference_uploader
+        elif self.reference_mode == 'files':
+            self.reference_uploader = GeminiFilesUploader(self.client, api_key)
+        else:
+            self.reference_uploader = InlineReferenceUploader()
+        
         print("✅ Gemini 2.5 Flash Image (Nano Banana) initialisé")
     
+    def source_reference(self, image_bytes):
+        """
+        Référence de l'image source à placer dans contents (uploadée une seule fois par produit)
+        
+        Args:
+            image_bytes: Bytes de l'image source
+        """
+        mime_type = image_ingest.mime_type('generate')
+        try:
+            return reference_cache.get(self.reference_uploader, image_bytes, mime_type)
+        except Exception as e:
+            # Upload impossible: envoi inline pour ne pas bloquer la génération
+            print(f"⚠️ Upload de l'image source impossible, envoi inline: {e}")
+            return types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+    
     def download_image_from_url(self, url):
         """
         Télécharge une image depuis une URL CDN
@@ -36,35 +75,9 @@ class ImageGenerator:
             url: URL de l'image (CDN Shopify)
             
         Returns:
-            bytes: Données de l'image ou None
+            bytes: Image JPEG 1024px (profil 'generate') ou None
         """
-        try:
-            # Nettoyer l'URL et optimiser la taille
-            clean_url = url.split('?')[0]
-            if 'cdn.shopify.com' in clean_url:
-                clean_url += '?width=1024'
-            
-            response = requests.get(clean_url, timeout=15)
-            response.raise_for_status()
-            
-            # Convertir en PIL Image pour validation
-            img = Image.open(BytesIO(response.content))
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Redimensionner si trop grande
-            max_size = 1024
-            if max(img.size) > max_size:
-                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # Convertir en bytes
-            buffered = BytesIO()
-            img.save(buffered, format="PNG", quality=95)
-            return buffered.getvalue()
-            
-        except Exception as e:
-            print(f"❌ Erreur téléchargement image {url}: {e}")
-            return None
+        return image_ingest.load(url, 'generate')
     
     def generate_product_variation(self, image_bytes, variation_prompt, variation_number=1):
         """
@@ -76,14 +89,13 @@ class ImageGenerator:
             variation_number: Numéro de la variation (pour le nom)
             
         Returns:
-            bytes: Image générée ou None
+            bytes: Image générée telle que renvoyée par Gemini (PNG) ou None
         """
         try:
-            # Créer l'image PIL depuis les bytes
-            source_image = Image.open(BytesIO(image_bytes))
+            # Image source déjà sérialisée (ou uploadée) une fois pour toutes les variations
+            source_image = self.source_reference(image_bytes)
             
             # Appel à Gemini 2.5 Flash Image (Nano Banana) pour générer une variation
-            # On passe l'image PIL directement + le prompt texte
             response = self.client.models.generate_content(
                 model=self.model_name,
                 contents=[variation_prompt, source_image],
@@ -92,41 +104,168 @@ class ImageGenerator:
             # Extraire l'image générée depuis la réponse
             for part in response.parts:
                 if part.inline_data is not None:
-                    # L'image est déjà en bytes, utiliser as_image() ou récupérer les données
-                    try:
-                        # Méthode 1: Utiliser as_image() si disponible
-                        generated_img = part.as_image()
-                        buffered = BytesIO()
-                        generated_img.save(buffered, format="PNG")
-                        return buffered.getvalue()
-                    except:
-                        # Méthode 2: Décoder manuellement le base64
-                        if hasattr(part.inline_data, 'data'):
-                            image_data = part.inline_data.data
-                            if isinstance(image_data, str):
-                                image_data = base64.b64decode(image_data)
-                            return image_data
+                    # Bytes renvoyés par Gemini (pas de ré-encodage PNG: l'encodage final est fait une seule fois)
+                    if getattr(part.inline_data, 'data', None):
+                        image_data = part.inline_data.data
+                        if isinstance(image_data, str):
+                            image_data = base64.b64decode(image_data)
+                        return image_data
+                    generated_img = part.as_image()
+                    buffered = BytesIO()
+                    generated_img.save(buffered, format="PNG")
+                    return buffered.getvalue()
             
             print(f"⚠️ Pas d'image générée pour variation {variation_number}")
             return None
             
         except Exception as e:
             print(f"❌ Erreur génération variation {variation_number}: {e}")
+            if is_invalid_reference_error(e):
+                # Fichier expiré ou supprimé côté Google: ré-upload au prochain essai
+                reference_cache.invalidate(self.reference_uploader, image_bytes)
             return None
     
-    def analyze_and_generate_prompts(self, image_bytes, num_prompts=10):
+    def encode_output(self, image_data):
+        """
+        Encode une image générée pour le stockage et l'upload (voir IMAGE_OUTPUT_CONFIG)
+        
+        Args:
+            image_data: Image renvoyée par Gemini
+            
+        Returns:
+            bytes: Image encodée (l'image d'origine si l'encodage est désactivé ou échoue)
+        """
+        settings = IMAGE_OUTPUT_CONFIG
+        if not settings['format']:
+            return image_data
+        try:
+            return image_workers.run(
+                encode_output_image, image_data, settings['max_size'], settings['format'],
+                settings['quality'], settings['max_bytes'], settings['min_quality']
+            )
+        except Exception as e:
+            print(f"⚠️ Encodage de l'image générée impossible, image d'origine conservée: {e}")
+            return image_data
+    
+    def generate_variation(self, image_bytes, prompt, variation_num, emit, max_retries=0, stop_event=None):
+        """
+        Génère une variation: jeton du limiteur partagé, nouvelles tentatives, encodage final
+        
+        Args:
+            image_bytes: Bytes de l'image source
+            prompt: Prompt de la variation
+            variation_num: Numéro de la variation
+            emit: Fonction appelée avec chaque événement ('generating', 'retry', puis 'generated' ou 'failed')
+            max_retries: Nouvelles tentatives en cas d'échec
+            stop_event: threading.Event qui interrompt l'attente du limiteur et les tentatives
+            
+        Returns:
+            bytes: Image encodée ou None
+        """
+        stop_event = stop_event or threading.Event()
+        image_data = None
+        encoded = None
+        try:
+            for attempt in range(max_retries + 1):
+                # Jeton du limiteur (remplace la pause fixe entre deux appels)
+                if stop_event.is_set() or not gemini_image_limiter.acquire(stop_event):
+                    return None
+                emit({'status': 'generating' if attempt == 0 else 'retry',
+                      'variation': variation_num, 'attempt': attempt})
+                image_data = self.generate_product_variation(image_bytes, prompt, variation_num)
+                if image_data:
+                    break
+        finally:
+            if image_data:
+                # Encodage unique ici: galerie, upload et logs reçoivent tous l'image compacte
+                encoded = self.encode_output(image_data)
+                emit({'status': 'generated', 'variation': variation_num,
+                      'image_data': encoded, 'original_bytes': len(image_data)})
+            else:
+                emit({'status': 'failed', 'variation': variation_num})
+        return encoded
+    
+    def generate_variations(self, image_bytes, prompts, max_retries=0, cancel_event=None, max_workers=None):
+        """
+        Génère les variations en parallèle (concurrence bornée + limiteur de débit partagé)
+        
+        Args:
+            image_bytes: Bytes de l'image source
+            prompts: Liste de prompts (variation N = prompts[N-1])
+            max_retries: Nouvelles tentatives par variation en cas d'échec
+            cancel_event: threading.Event activé si le client se déconnecte
+            max_workers: Variations simultanées (défaut: IMAGE_GENERATION_CONFIG)
+            
+        Yields:
+            dict: Événements dans l'ordre de fin de traitement:
+                {'status': 'generating' | 'retry' | 'generated' | 'failed', 'variation': int,
+                 'attempt': int, 'image_data': bytes encodés et 'original_bytes': int (si 'generated')}
+            L'ordre final des images se reconstruit avec 'variation'.
+        """
+        if not prompts:
+            return
+        max_workers = max_workers or IMAGE_GENERATION_CONFIG['max_concurrent_variations']
+        stop = threading.Event()
+        events = queue.Queue()
+        
+        def task(variation_num, prompt):
+            if cancel_event is not None and cancel_event.is_set():
+                stop.set()
+            self.generate_variation(image_bytes, prompt, variation_num, events.put, max_retries, stop)
+        
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(prompts)))
+        try:
+            for idx, prompt in enumerate(prompts):
+                executor.submit(task, idx + 1, prompt)
+            
+            finished = 0
+            while finished < len(prompts):
+                try:
+                    event = events.get(timeout=0.5)
+                except queue.Empty:
+                    if cancel_event is not None and cancel_event.is_set():
+                        stop.set()
+                    continue
+                if event['status'] in ('generated', 'failed'):
+                    finished += 1
+                yield event
+        finally:
+            # Générateur fermé ou annulé: plus aucun nouvel appel, les appels en cours se terminent
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def cached_prompts(self, image_bytes, num_prompts=10):
+        """
+        Prompts déjà générés pour cette image source (sans appel Gemini)
+        
+        Returns:
+            list: Prompts stockés ou None
+        """
+        if self.prompt_store is None:
+            return None
+        return self.prompt_store.get(content_hash(image_bytes), num_prompts, SCENE_PROMPT_VERSION)
+    
+    def analyze_and_generate_prompts(self, image_bytes, num_prompts=10, regenerate=False):
         """
         ÉTAPE 1: Gemini 2.0 Flash (pas cher) analyse l'image et génère des prompts personnalisés
         
         Args:
             image_bytes: Bytes de l'image source
             num_prompts: Nombre de prompts à générer
+            regenerate: ignorer les prompts déjà stockés et relancer l'analyse
             
         Returns:
             list: Liste de prompts générés par Gemini
         """
+        if not regenerate:
+            # 💾 Image source inchangée: prompts réutilisés, aucun appel d'analyse
+            cached = self.cached_prompts(image_bytes, num_prompts)
+            if cached:
+                print(f"♻️ {len(cached)} prompts réutilisés (image source inchangée)")
+                return cached
+        
         try:
-            source_image = Image.open(BytesIO(image_bytes))
+            source_image = self.source_reference(image_bytes)
             
             analysis_prompt = f"""You are an expert e-commerce and Pinterest photographer.
 
@@ -159,13 +298,17 @@ Format:
 """
             
             # Utiliser gemini-2.5-flash pour l'analyse (meilleur pour lire les images)
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=[analysis_prompt, source_image],
+            # Analyses identiques simultanées (même image source) → une seule requête
+            analysis_model = "gemini-2.5-flash"
+            response_text = gemini_flight.do(
+                call_key(analysis_model, analysis_prompt, image_bytes),
+                lambda: self.client.models.generate_content(
+                    model=analysis_model,
+                    contents=[analysis_prompt, source_image],
+                ).text
             )
             
             # Parser la réponse pour extraire les prompts
-            response_text = response.text
             prompts = []
             
             for line in response_text.strip().split('\n'):
@@ -188,13 +331,19 @@ Format:
             for i, p in enumerate(prompts[:num_prompts], 1):
                 print(f"   📝 Prompt {i}: {p[:100]}...")
             
+            if prompts and self.prompt_store is not None:
+                self.prompt_store.put(content_hash(image_bytes), num_prompts, SCENE_PROMPT_VERSION, prompts[:num_prompts])
+            
             return prompts[:num_prompts]
             
         except Exception as e:
             print(f"❌ Erreur analyse image: {e}")
+            if is_invalid_reference_error(e):
+                reference_cache.invalidate(self.reference_uploader, image_bytes)
             return []
     
-    def generate_product_variations(self, source_image_url, num_variations=10):
+    def generate_product_variations(self, source_image_url, num_variations=10, cancel_event=None, keep_images=True,
+                                    regenerate_prompts=False):
         """
         Génère plusieurs variations d'un produit en 2 étapes:
         1. Gemini 2.0 Flash analyse l'image et génère des prompts personnalisés
@@ -203,6 +352,10 @@ Format:
         Args:
             source_image_url: URL de l'image source (CDN Shopify)
             num_variations: Nombre de variations à générer (max 10 pour Etsy)
+            cancel_event: threading.Event activé si le client se déconnecte
+            keep_images: False = les images ne sont pas gardées pour l'événement 'complete'
+                         (l'appelant les traite au fil de l'eau, ex: upload pipeliné)
+            regenerate_prompts: relancer l'analyse même si des prompts sont stockés pour cette image
             
         Yields:
             dict: {'status': str, 'progress': int, 'image_data': bytes, 'variation': int}
@@ -223,14 +376,21 @@ Format:
             }
             return
         
-        # ÉTAPE 1: Gemini 2.0 Flash analyse l'image et génère les prompts
-        yield {
-            'status': 'analyzing',
-            'message': '🔍 Étape 1/2: Gemini analyse le produit et crée les prompts...',
-            'progress': 5
-        }
-        
-        custom_prompts = self.analyze_and_generate_prompts(source_bytes, num_variations)
+        # ÉTAPE 1: Gemini 2.0 Flash analyse l'image et génère les prompts (sauf s'ils sont déjà stockés)
+        custom_prompts = None if regenerate_prompts else self.cached_prompts(source_bytes, num_variations)
+        if custom_prompts:
+            yield {
+                'status': 'analyzing',
+                'message': '♻️ Étape 1/2: prompts déjà générés pour cette image, analyse ignorée',
+                'progress': 5
+            }
+        else:
+            yield {
+                'status': 'analyzing',
+                'message': '🔍 Étape 1/2: Gemini analyse le produit et crée les prompts...',
+                'progress': 5
+            }
+            custom_prompts = self.analyze_and_generate_prompts(source_bytes, num_variations, regenerate=True)
         
         if not custom_prompts:
             yield {
@@ -262,48 +422,53 @@ Format:
             'progress': 15
         }
         
-        generated_images = []
+        # Variations en parallèle: les événements arrivent dans l'ordre de fin de génération
+        images_by_variation = {}
+        done = 0
         
-        for idx, prompt in enumerate(custom_prompts):
-            variation_num = idx + 1
-            progress = 15 + int((idx / len(custom_prompts)) * 85)
-            
-            yield {
-                'status': 'generating',
-                'message': f'🎨 Génération image {variation_num}/{len(custom_prompts)}...',
-                'progress': progress,
-                'variation': variation_num
-            }
-            
-            # Générer avec le prompt personnalisé
-            image_data = self.generate_product_variation(source_bytes, prompt, variation_num)
+        for event in self.generate_variations(source_bytes, custom_prompts, cancel_event=cancel_event):
+            variation_num = event['variation']
+            if event['status'] == 'generating':
+                yield {
+                    'status': 'generating',
+                    'message': f'🎨 Génération image {variation_num}/{len(custom_prompts)}...',
+                    'progress': 15 + int((done / len(custom_prompts)) * 85),
+                    'variation': variation_num
+                }
+                continue
             
-            if image_data:
-                generated_images.append(image_data)
+            done += 1
+            progress = 15 + int((done / len(custom_prompts)) * 85)
+            if event['status'] == 'generated':
+                images_by_variation[variation_num] = event['image_data'] if keep_images else None
                 yield {
                     'status': 'generated',
                     'message': f'✅ Image {variation_num} générée',
-                    'progress': 15 + int(((idx + 1) / len(custom_prompts)) * 85),
+                    'progress': progress,
                     'variation': variation_num,
-                    'image_data': image_data
+                    'image_data': event['image_data'],
+                    'original_bytes': event['original_bytes']
                 }
             else:
                 yield {
                     'status': 'warning',
                     'message': f'⚠️ Image {variation_num} échouée, passage à la suivante',
-                    'progress': 15 + int(((idx + 1) / len(custom_prompts)) * 85),
+                    'progress': progress,
                     'variation': variation_num
                 }
-            
-            # Pause entre les requêtes
-            if idx < len(custom_prompts) - 1:
-                time.sleep(2)
+        
+        if cancel_event is not None and cancel_event.is_set():
+            print(f"🛑 Génération annulée après {len(images_by_variation)} images")
+            return
+        
+        # Ordre final stable: celui des prompts, quel que soit l'ordre de fin
+        generated_images = [images_by_variation[n] for n in sorted(images_by_variation)] if keep_images else []
         
         yield {
             'status': 'complete',
-            'message': f'✅ {len(generated_images)} images générées avec succès',
+            'message': f'✅ {len(images_by_variation)} images générées avec succès',
             'progress': 100,
-            'total_generated': len(generated_images),
+            'total_generated': len(images_by_variation),
             'images': generated_images
         }
     
@@ -320,33 +485,56 @@ Format:
         Yields:
             dict: Progression et résultats
         """
-        generated_images = []
+        images_by_variation = {}
+        # Upload pipeliné: chaque image part vers Shopify dès qu'elle est générée
+        uploader = ProductImageUploader(
+            shopify_client, product_id, expected_images=num_images
+        ) if SHOPIFY_UPLOAD_CONFIG['pipelined'] else None
         
-        # Générer les variations
-        for progress in self.generate_product_variations(source_image_url, num_images):
-            if progress['status'] == 'generated' and 'image_data' in progress:
-                generated_images.append(progress['image_data'])
-            yield progress
+        # Générer les variations (reçues dans l'ordre de fin de génération)
+        try:
+            for progress in self.generate_product_variations(source_image_url, num_images, keep_images=uploader is None):
+                if progress['status'] == 'generated' and 'image_data' in progress:
+                    if uploader is not None:
+                        uploader.submit(progress['variation'], progress['image_data'])
+                        images_by_variation[progress['variation']] = None
+                    else:
+                        images_by_variation[progress['variation']] = progress['image_data']
+                yield progress
+                
+                if progress['status'] == 'error':
+                    return
             
-            if progress['status'] == 'error':
+            if not images_by_variation:
+                yield {
+                    'status': 'error',
+                    'message': '❌ Aucune image générée',
+                    'progress': 0
+                }
                 return
-        
-        if not generated_images:
-            yield {
-                'status': 'error',
-                'message': '❌ Aucune image générée',
-                'progress': 0
-            }
-            return
-        
-        # Upload vers Shopify et remplacer les anciennes images
-        yield {
-            'status': 'uploading',
-            'message': f'📤 Upload de {len(generated_images)} images vers Shopify...',
-            'progress': 0
-        }
-        
-        result = shopify_client.replace_product_images(product_id, generated_images)
+            
+            if uploader is not None:
+                yield {
+                    'status': 'uploading',
+                    'message': '📤 Finalisation des uploads Shopify...',
+                    'progress': 0
+                }
+                result = uploader.finish()
+            else:
+                generated_images = [images_by_variation[n] for n in sorted(images_by_variation)]
+                
+                # Upload vers Shopify et remplacer les anciennes images
+                yield {
+                    'status': 'uploading',
+                    'message': f'📤 Upload de {len(generated_images)} images vers Shopify...',
+                    'progress': 0
+                }
+                
+                result = shopify_client.replace_product_images(product_id, generated_images)
+        finally:
+            # Déconnexion ou erreur avant finish(): uploads déjà faits retirés du produit
+            if uploader is not None:
+                uploader.abort()
         
         if result['success']:
             yield {
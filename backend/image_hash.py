@@ -0,0 +1,98 @@
+"""
+Hash perceptuel (dHash) pour repérer les images produits quasi identiques
+Les clones couleur/taille d'un catalogue Shopify partagent souvent la même photo:
+une seule génération Gemini suffit pour tout le groupe.
+"""
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+def dhash(image_bytes, hash_size=8):
+    """
+    Calcule le dHash (gradient horizontal) d'une image
+
+    Args:
+        image_bytes: Bytes de l'image
+        hash_size: Côté de la grille (8 → hash de 64 bits)
+
+    Returns:
+        int: Hash perceptuel
+    """
+    img = Image.open(BytesIO(image_bytes))
+    # Décodage JPEG réduit: inutile de décoder toute l'image pour une grille 9x8
+    img.draft('L', (hash_size * 4, hash_size * 4))
+    img = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+
+    pixels = np.asarray(img, dtype=np.int16)
+    diff = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(diff.flatten()).tobytes(), 'big')
+
+
+def hamming_distance(hash_a, hash_b):
+    """
+    Nombre de bits différents entre deux hashes
+    """
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class DedupIndex:
+    def __init__(self, max_distance=4, hash_bits=64):
+        """
+        Index des images "leader" pour la recherche de quasi-doublons
+
+        Le hash est découpé en (max_distance + 1) bandes: deux hashes à distance
+        <= max_distance ont forcément au moins une bande identique (principe des
+        tiroirs), ce qui évite de comparer chaque image à toutes les autres.
+
+        Args:
+            max_distance: Distance de Hamming max pour considérer deux images identiques
+            hash_bits: Taille du hash en bits
+        """
+        self.max_distance = max_distance
+        self.hash_bits = hash_bits
+        num_bands = max_distance + 1
+        band_size = -(-hash_bits // num_bands)
+        self._bands = [
+            (start, min(band_size, hash_bits - start))
+            for start in range(0, hash_bits, band_size)
+        ]
+        self._buckets = [{} for _ in self._bands]
+        self._hashes = {}
+
+    def _band_values(self, value):
+        for start, size in self._bands:
+            yield (value >> start) & ((1 << size) - 1)
+
+    def find(self, value):
+        """
+        Retourne la clé du leader le plus proche (ou None si aucun quasi-doublon)
+        """
+        best_key, best_distance = None, None
+        for bucket, band in zip(self._buckets, self._band_values(value)):
+            for key in bucket.get(band, ()):
+                distance = hamming_distance(value, self._hashes[key])
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+        return best_key
+
+    def add(self, value, key):
+        """
+        Enregistre une image leader
+        """
+        self._hashes[key] = value
+        for bucket, band in zip(self._buckets, self._band_values(value)):
+            bucket.setdefault(band, []).append(key)
+
+    def remove(self, key):
+        """
+        Retire un leader (ex: sa génération a échoué)
+        """
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for bucket, band in zip(self._buckets, self._band_values(value)):
+            keys = bucket.get(band, [])
+            if key in keys:
+                keys.remove(key)
@@ -0,0 +1,217 @@
+"""
+Téléchargement et préparation des images produits (CDN Shopify)
+Point d'entrée unique pour l'enhancer, le générateur d'images et le client Shopify:
+- une session HTTP partagée (connexions réutilisées, keep-alive)
+- la largeur exacte demandée au CDN Shopify (?width=)
+- décodage JPEG réduit avec Image.draft puis encodage compact par profil
+- prétraitement CPU dans un pool de process (voir image_workers)
+- cache disque des images sources brutes (voir image_cache), partagé entre les modules
+"""
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import IMAGE_INGEST_CONFIG, IMAGE_CACHE_CONFIG
+from image_cache import ImageCache
+from image_ops import preprocess_image
+from image_workers import image_workers
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+def sniff_image_type(image_bytes):
+    """
+    Type d'une image d'après sa signature
+
+    Returns:
+        tuple: (type MIME, extension de fichier)
+    """
+    if image_bytes[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg', 'jpg'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    return 'image/png', 'png'
+
+
+def image_version(url):
+    """
+    Version CDN d'une image Shopify (paramètre ?v=, change quand l'image est remplacée)
+
+    Returns:
+        str: Version ou None si l'URL n'en porte pas
+    """
+    values = parse_qs(urlsplit(str(url)).query).get('v')
+    return values[0] if values else None
+
+
+def image_key(url):
+    """
+    Identité stable d'une image d'un export à l'autre: URL sans paramètres (?v=, ?width=)
+    Sert à retrouver le produit Shopify d'une ligne CSV (Photo 1) et ses contenus stockés.
+    """
+    return str(url).strip().split('?')[0].split('#')[0]
+
+
+def cdn_url(url, width=None):
+    """
+    Nettoie l'URL et demande la largeur voulue au CDN Shopify (version ?v= conservée)
+
+    Args:
+        url: URL de l'image
+        width: Largeur en pixels (None = taille d'origine)
+    """
+    clean_url = str(url).split('?')[0]
+    if 'cdn.shopify.com' in clean_url:
+        params = []
+        version = image_version(url)
+        if version:
+            params.append(f'v={version}')
+        if width:
+            params.append(f'width={int(width)}')
+        if params:
+            clean_url += '?' + '&'.join(params)
+    return clean_url
+
+
+class ImageIngest:
+    def __init__(self, pool_size=None, profiles=None, cache=None):
+        """
+        Initialise la session HTTP partagée
+
+        Args:
+            pool_size: Connexions simultanées max par hôte
+            profiles: Profils de préparation par consommateur (voir IMAGE_INGEST_CONFIG)
+            cache: ImageCache des images sources brutes (None = pas de cache)
+        """
+        self.profiles = profiles or IMAGE_INGEST_CONFIG['profiles']
+        self.cache = cache
+        pool_size = pool_size or IMAGE_INGEST_CONFIG['pool_size']
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, stage, seconds, bytes_in=0, bytes_out=0, error=False):
+        with self._lock:
+            stats = self._stats.setdefault(stage, {
+                'count': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0
+            })
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['seconds'] += seconds
+
+    def mime_type(self, profile):
+        """
+        Type MIME des images produites par un profil
+        """
+        return MIME_TYPES[self.profiles[profile]['format']]
+
+    def fetch(self, url, width=None, timeout=None):
+        """
+        Télécharge une image brute via la session partagée
+
+        Returns:
+            bytes: Données de l'image ou None
+        """
+        started = time.time()
+        try:
+            response = self.session.get(cdn_url(url, width), timeout=timeout or IMAGE_INGEST_CONFIG['timeout'])
+            response.raise_for_status()
+            content = response.content
+            self._record('fetch', time.time() - started, bytes_out=len(content))
+            return content
+        except Exception as e:
+            self._record('fetch', time.time() - started, error=True)
+            print(f"❌ Erreur téléchargement image {url}: {e}")
+            return None
+
+    def preprocess(self, raw_bytes, profile):
+        """
+        Prépare une image téléchargée selon le profil du consommateur
+
+        Returns:
+            bytes: Image encodée ou None
+        """
+        settings = self.profiles[profile]
+        started = time.time()
+        try:
+            payload = image_workers.run(
+                preprocess_image, raw_bytes, settings['width'], settings['format'], settings['quality']
+            )
+            self._record(f'preprocess:{profile}', time.time() - started, len(raw_bytes), len(payload))
+            return payload
+        except Exception as e:
+            self._record(f'preprocess:{profile}', time.time() - started, len(raw_bytes), error=True)
+            print(f"❌ Erreur préparation image ({profile}): {e}")
+            return None
+
+    def fetch_source(self, url):
+        """
+        Image source brute à la largeur commune (IMAGE_INGEST_CONFIG['raw_width'])
+        Passe par le cache disque: une seule copie par image, quel que soit le consommateur.
+
+        Returns:
+            bytes: Données de l'image ou None
+        """
+        width = IMAGE_INGEST_CONFIG['raw_width']
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(url, width)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        raw_bytes = self.fetch(url, width=width)
+        if raw_bytes and cache_key is not None:
+            self.cache.put(cache_key, raw_bytes)
+        return raw_bytes
+
+    def load(self, url, profile):
+        """
+        Récupère l'image source (cache ou CDN) puis la prépare pour le profil
+
+        Args:
+            url: URL de l'image (CDN Shopify)
+            profile: 'enhance', 'generate', ... (voir IMAGE_INGEST_CONFIG)
+
+        Returns:
+            bytes: Image prête à envoyer ou None
+        """
+        raw_bytes = self.fetch_source(url)
+        if not raw_bytes:
+            return None
+        return self.preprocess(raw_bytes, profile)
+
+    def stats(self):
+        """
+        Compteurs par étape (octets, latence), exposés par /api/stats
+        """
+        with self._lock:
+            return {
+                stage: {
+                    **stats,
+                    'seconds': round(stats['seconds'], 3),
+                    'avg_ms': round(stats['seconds'] * 1000 / stats['count'], 1) if stats['count'] else 0.0,
+                }
+                for stage, stats in self._stats.items()
+            }
+
+
+# Instance partagée (une seule session HTTP et un seul cache pour tout le backend)
+image_ingest = ImageIngest(
+    cache=ImageCache(IMAGE_CACHE_CONFIG['cache_dir'], IMAGE_CACHE_CONFIG['max_bytes'])
+    if IMAGE_CACHE_CONFIG['enabled'] else None
+)
@@ -0,0 +1,97 @@
+"""
+Travail CPU sur les images, exécuté dans les process du pool (voir image_workers)
+Module sans effet de bord à l'import (ni session HTTP, ni cache, ni base): chaque
+process spawn l'importe pour dépickler la fonction à exécuter.
+"""
+from io import BytesIO
+
+from PIL import Image
+
+
+def preprocess_image(raw_bytes, max_size, image_format='JPEG', quality=85):
+    """
+    Décode, réduit et ré-encode une image
+
+    Args:
+        raw_bytes: Bytes de l'image téléchargée
+        max_size: Côté max en pixels
+        image_format: 'JPEG' ou 'WEBP'
+        quality: Qualité d'encodage
+
+    Returns:
+        bytes: Image encodée
+    """
+    img = Image.open(BytesIO(raw_bytes))
+    # JPEG: décodage directement à l'échelle 1/2, 1/4 ou 1/8 la plus proche (beaucoup plus rapide)
+    img.draft('RGB', (max_size, max_size))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    if max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+    buffered = BytesIO()
+    img.save(buffered, format=image_format, quality=quality)
+    return buffered.getvalue()
+
+
+def _encode(img, image_format, quality):
+    buffered = BytesIO()
+    if image_format == 'JPEG':
+        img.save(buffered, format='JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffered, format=image_format, quality=quality, method=4)
+    return buffered.getvalue()
+
+
+def encode_output_image(raw_bytes, max_size, image_format='JPEG', quality=88, max_bytes=None, min_quality=60):
+    """
+    Encode une image générée pour l'upload (JPEG/WebP compact au lieu du PNG sans perte)
+
+    Args:
+        raw_bytes: Image renvoyée par Gemini (PNG)
+        max_size: Côté max en pixels
+        image_format: 'JPEG' ou 'WEBP'
+        quality: Qualité visée
+        max_bytes: Taille max de l'image encodée (None = pas de limite)
+        min_quality: Qualité en dessous de laquelle l'image est réduite plutôt que dégradée
+
+    Returns:
+        bytes: Image encodée
+    """
+    img = Image.open(BytesIO(raw_bytes))
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Transparence aplatie sur fond blanc (pas de fond noir en JPEG)
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    if max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+    payload = _encode(img, image_format, quality)
+    if not max_bytes:
+        return payload
+
+    # Trop lourde: meilleure qualité qui tient dans le budget, puis réduction de la taille
+    for _ in range(4):
+        if len(payload) <= max_bytes:
+            return payload
+        low, high = min_quality, quality - 1
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = _encode(img, image_format, middle)
+            if len(candidate) <= max_bytes:
+                best, low = candidate, middle + 1
+            else:
+                payload, high = candidate, middle - 1
+        if best is not None:
+            return best
+        scale = (max_bytes / len(payload)) ** 0.5 * 0.95
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.Resampling.LANCZOS)
+        payload = _encode(img, image_format, quality)
+    return payload
@@ -0,0 +1,88 @@
+"""
+Pool de process pour le travail CPU sur les images (décodage, redimensionnement, encodage, hash)
+Pillow garde le GIL pendant une bonne partie de ces étapes: dans les threads de l'enhancer
+et de Flask, le prétraitement plafonne à environ un cœur. Les bytes de l'image sont
+envoyés au process et le résultat (bytes ou int) revient par le même canal.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import IMAGE_INGEST_CONFIG
+
+
+class ImageWorkerPool:
+    def __init__(self, workers=None):
+        """
+        Initialise le pool (les process sont lancés au premier appel)
+
+        Args:
+            workers: Nombre de process (None = nombre de cœurs, 0 = exécution dans le thread appelant)
+        """
+        if workers is None:
+            # Un seul cœur: un process de plus n'apporte que le coût du transfert
+            workers = os.cpu_count() or 1
+            workers = 0 if workers == 1 else workers
+        self.workers = max(0, int(workers))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._offloaded = 0
+        self._inline = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn (comme sous Windows): un fork depuis un process multi-thread peut hériter d'un verrou tenu
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def run(self, fn, *args):
+        """
+        Exécute fn(*args) dans un process du pool et attend le résultat
+
+        Args:
+            fn: Fonction de niveau module (picklable) d'un module sans effet de bord à l'import,
+                ex: image_ops.preprocess_image, image_hash.dhash
+
+        Returns:
+            Résultat de fn (les exceptions de fn sont relancées telles quelles)
+        """
+        if self.workers == 0:
+            with self._lock:
+                self._inline += 1
+            return fn(*args)
+
+        try:
+            result = self._get_executor().submit(fn, *args).result()
+            with self._lock:
+                self._offloaded += 1
+            return result
+        except BrokenProcessPool as e:
+            # Process tué (mémoire, arrêt brutal): recréer le pool au prochain appel
+            print(f"⚠️ Pool de prétraitement interrompu, exécution locale: {e}")
+            with self._lock:
+                self._executor = None
+                self._inline += 1
+            return fn(*args)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'process_workers': self.workers,
+                'offloaded': self._offloaded,
+                'inline': self._inline,
+            }
+
+
+# Pool partagé par l'enhancer et le générateur d'images (via image_ingest)
+image_workers = ImageWorkerPool(IMAGE_INGEST_CONFIG['process_workers'])
@@ -0,0 +1,174 @@
+"""
+Schéma JSON et validation locale des contenus Etsy générés par Gemini
+Le modèle répond en JSON contraint par LISTING_SCHEMA; les limites Etsy
+(longueurs, nombre de tags) sont vérifiées ici et seul le champ invalide est réparé.
+"""
+import json
+import re
+import threading
+
+# Limites Etsy
+TITLE_MAX_LENGTH = 140
+TAGS_COUNT = 13
+TAG_MAX_LENGTH = 20
+TAG_MAX_WORDS = 3
+
+# Schéma de réponse (sous-ensemble OpenAPI accepté par generation_config)
+LISTING_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'title': {'type': 'string'},
+        'description': {'type': 'string'},
+        'tags': {
+            'type': 'array',
+            'items': {'type': 'string'},
+            'min_items': TAGS_COUNT,
+            'max_items': TAGS_COUNT,
+        },
+    },
+    'required': ['title', 'description', 'tags'],
+}
+
+TAGS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'tags': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['tags'],
+}
+
+# Mots courants pour séparer les tags collés (ex: bathroomfaucet → bathroom faucet)
+_GLUED_WORDS = re.compile(r'(bathroom|kitchen|chrome|modern|vintage|rustic|wooden|metal|glass|ceramic|plastic|waterfall|single|double|pull|down|handle|lever|mixer|basin|sink|lavatory|vanity|counter|wall|mounted|floor|standing|tall|short|wide|narrow|round|square|oval|rectangular)')
+
+
+def fix_glued_tag(tag):
+    """
+    Ajoute des espaces dans les mots composés collés
+    Si le tag a plus de 12 caractères sans espace, c'est probablement collé
+    """
+    tag = tag.strip()
+    if len(tag) > 12 and ' ' not in tag:
+        tag = _GLUED_WORDS.sub(r'\1 ', tag).strip()
+    return tag
+
+
+def clean_description(description):
+    """
+    Supprime le gras markdown et les sauts de ligne en trop
+    """
+    description = description.replace('**', '').replace('* ', ' ').replace(' *', ' ')
+    return re.sub(r'\n{3,}', '\n\n', description).strip()
+
+
+def shorten_title(title):
+    """
+    Ramène un titre sous 140 caractères sans couper une expression:
+    on retire d'abord les dernières phrases " | ", puis on coupe au dernier mot entier
+    """
+    title = title.strip()
+    if len(title) <= TITLE_MAX_LENGTH:
+        return title
+
+    phrases = [p.strip() for p in title.split('|') if p.strip()]
+    while len(phrases) > 1 and len(' | '.join(phrases)) > TITLE_MAX_LENGTH:
+        phrases.pop()
+    title = ' | '.join(phrases)
+
+    if len(title) > TITLE_MAX_LENGTH:
+        title = title[:TITLE_MAX_LENGTH].rsplit(' ', 1)[0]
+    return title
+
+
+def normalize_tags(tags):
+    """
+    Nettoie une liste de tags et ne garde que ceux valides pour Etsy
+
+    Returns:
+        list: Tags en minuscules, dédoublonnés, <= 20 caractères, <= 3 mots
+    """
+    valid = []
+    for tag in tags:
+        if not isinstance(tag, str):
+            continue
+        tag = fix_glued_tag(' '.join(tag.lower().replace(',', ' ').split()))
+        if not tag or len(tag) > TAG_MAX_LENGTH or len(tag.split()) > TAG_MAX_WORDS:
+            continue
+        if tag not in valid:
+            valid.append(tag)
+    return valid[:TAGS_COUNT]
+
+
+def parse_listing_json(text):
+    """
+    Parse la réponse JSON du modèle
+
+    Returns:
+        dict: {'title', 'description', 'tags'} ou None si la réponse est inexploitable
+    """
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`')
+        if text.startswith('json'):
+            text = text[4:]
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    tags = data.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return {
+        'title': str(data.get('title') or ''),
+        'description': str(data.get('description') or ''),
+        'tags': tags if isinstance(tags, list) else [],
+    }
+
+
+def invalid_fields(listing):
+    """
+    Liste des champs qui ne respectent pas les limites Etsy (après nettoyage local)
+    """
+    invalid = []
+    if not listing['title'] or len(listing['title']) > TITLE_MAX_LENGTH:
+        invalid.append('title')
+    if not listing['description']:
+        invalid.append('description')
+    if len(listing['tags']) < TAGS_COUNT:
+        invalid.append('tags')
+    return invalid
+
+
+class ParseStats:
+    def __init__(self):
+        """
+        Compteurs de parsing par mode de sortie (text / json)
+        """
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, mode, parse_failed=False, repaired_fields=()):
+        with self._lock:
+            stats = self._stats.setdefault(mode, {'responses': 0, 'parse_failures': 0, 'field_repairs': {}})
+            stats['responses'] += 1
+            if parse_failed:
+                stats['parse_failures'] += 1
+            for field in repaired_fields:
+                stats['field_repairs'][field] = stats['field_repairs'].get(field, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for mode, stats in self._stats.items():
+                snapshot[mode] = {
+                    **stats,
+                    'field_repairs': dict(stats['field_repairs']),
+                    'parse_failure_rate': round(stats['parse_failures'] / stats['responses'], 4) if stats['responses'] else 0.0,
+                }
+            return snapshot
+
+
+# Compteurs partagés (exposés par /api/stats)
+listing_parse_stats = ParseStats()
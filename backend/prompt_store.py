@@ -0,0 +1,93 @@
+"""
+Stockage persistant des prompts de mise en scène (étape 1 de la génération d'images)
+Clé: hash de l'image source + nombre de prompts + version du prompt d'analyse.
+Régénérer les images d'un produit dont la photo n'a pas changé réutilise les prompts
+déjà obtenus au lieu de relancer l'analyse multimodale Gemini.
+"""
+import json
+import threading
+import time
+
+from sqlite_db import open_sqlite
+
+
+class ScenePromptStore:
+    def __init__(self, db_path, max_entries=2000):
+        """
+        Ouvre (ou crée) la base SQLite
+
+        Args:
+            db_path: Chemin du fichier .db
+            max_entries: Nombre max de jeux de prompts gardés (les moins utilisés sont supprimés)
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS scene_prompts (
+                source_hash TEXT NOT NULL,
+                num_prompts INTEGER NOT NULL,
+                prompt_version TEXT NOT NULL,
+                prompts TEXT NOT NULL,
+                created_at REAL,
+                used_at REAL,
+                PRIMARY KEY (source_hash, num_prompts, prompt_version)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_scene_prompts_used ON scene_prompts (used_at)")
+        self._conn.commit()
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    def get(self, source_hash, num_prompts, prompt_version):
+        """
+        Returns:
+            list: Prompts stockés ou None
+        """
+        key = (source_hash, num_prompts, prompt_version)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT prompts FROM scene_prompts "
+                "WHERE source_hash = ? AND num_prompts = ? AND prompt_version = ?",
+                key
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            # Date d'utilisation: les jeux réutilisés échappent à l'éviction
+            self._conn.execute(
+                "UPDATE scene_prompts SET used_at = ? "
+                "WHERE source_hash = ? AND num_prompts = ? AND prompt_version = ?",
+                (time.time(), *key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, source_hash, num_prompts, prompt_version, prompts):
+        """
+        Enregistre (ou remplace) les prompts générés pour une image source
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scene_prompts "
+                "(source_hash, num_prompts, prompt_version, prompts, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (source_hash, num_prompts, prompt_version, json.dumps(prompts, ensure_ascii=False), now, now)
+            )
+            # Au-delà du budget: suppression des jeux les moins récemment utilisés
+            cursor = self._conn.execute(
+                "DELETE FROM scene_prompts WHERE rowid IN ("
+                "SELECT rowid FROM scene_prompts ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._evicted += max(cursor.rowcount, 0)
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM scene_prompts").fetchone()[0]
+            return {'entries': count, 'hits': self._hits, 'misses': self._misses, 'evicted': self._evicted}
@@ -0,0 +1,155 @@
+"""
+Limiteur de débit (token bucket) partagé entre threads
+Remplace les pauses fixes (time.sleep) entre les appels: les appels partent dès qu'un
+jeton est disponible, en rafale jusqu'à `burst`, puis au rythme de `rate` par seconde.
+
+Le seau peut être recalé sur l'état annoncé par le serveur (observe) et mis en pause
+pour tous les appelants après un refus (pause): c'est le "leaky bucket" de Shopify.
+"""
+import threading
+import time
+
+from config import IMAGE_GENERATION_CONFIG, SHOPIFY_API_CONFIG
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        """
+        Args:
+            rate: Jetons ajoutés par seconde (appels/seconde en régime continu)
+            burst: Jetons max accumulés (appels simultanés autorisés d'un coup)
+        """
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._waited = 0.0
+        self._paused = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, cancel_event=None, timeout=None, tokens=1):
+        """
+        Attend un jeton
+
+        Args:
+            cancel_event: threading.Event qui interrompt l'attente
+            timeout: Attente max en secondes (None = illimitée)
+            tokens: Jetons consommés par l'appel (ex: coût estimé d'une requête GraphQL)
+
+        Returns:
+            bool: True si le jeton est obtenu, False si annulé ou délai dépassé
+        """
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                # Un appel plus coûteux que le seau entier passe quand le seau est plein
+                needed = min(float(tokens), self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= needed
+                    self._acquired += 1
+                    self._waited += now - started
+                    return True
+                delay = (needed - self._tokens) / self.rate
+
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            if cancel_event is not None:
+                if cancel_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+    def observe(self, available, capacity=None, rate=None):
+        """
+        Recale le seau sur l'état annoncé par le serveur (partagé avec d'autres clients/apps)
+
+        Args:
+            available: Jetons encore disponibles côté serveur
+            capacity: Taille du seau côté serveur (ex: 40, 80 ou 400 selon le plan)
+            rate: Jetons restitués par seconde côté serveur
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if capacity:
+                self.burst = max(1.0, float(capacity))
+            if rate:
+                self.rate = float(rate)
+            # Jamais plus optimiste que le serveur (les appels en vol ne sont pas encore comptés)
+            self._tokens = min(self._tokens, float(available))
+
+    def pause(self, seconds):
+        """
+        Bloque tous les appelants pendant `seconds` (ex: Retry-After d'une réponse 429)
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            # Dette de jetons: le prochain jeton n'est disponible qu'après la pause
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self._paused += 1
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'available': round(self._tokens, 1),
+                'acquired': self._acquired,
+                'wait_seconds': round(self._waited, 2),
+                'paused': self._paused,
+            }
+
+
+# Appels de génération d'images Gemini (partagé par toutes les requêtes du process)
+gemini_image_limiter = TokenBucket(
+    IMAGE_GENERATION_CONFIG['requests_per_second'],
+    IMAGE_GENERATION_CONFIG['burst']
+)
+
+
+_shopify_limiters = {}
+_shopify_limiters_lock = threading.Lock()
+
+
+def shopify_limiter(store_url, api='rest'):
+    """
+    Limiteur de l'Admin API d'une boutique (partagé par tous les clients de ce store)
+
+    Args:
+        store_url: Domaine de la boutique (ex: boutique.myshopify.com)
+        api: 'rest' (seau de requêtes) ou 'graphql' (seau de points de coût)
+    """
+    with _shopify_limiters_lock:
+        limiter = _shopify_limiters.get((store_url, api))
+        if limiter is None:
+            if api == 'graphql':
+                limiter = TokenBucket(SHOPIFY_API_CONFIG['graphql_restore_rate'], SHOPIFY_API_CONFIG['graphql_bucket'])
+            else:
+                limiter = TokenBucket(SHOPIFY_API_CONFIG['requests_per_second'], SHOPIFY_API_CONFIG['burst'])
+            _shopify_limiters[(store_url, api)] = limiter
+        return limiter
+
+
+def shopify_limiter_stats():
+    """
+    État des seaux Shopify par boutique
+
+    Returns:
+        dict: {store_url: {'rest': stats, 'graphql': stats}}
+    """
+    with _shopify_limiters_lock:
+        limiters = list(_shopify_limiters.items())
+    stats = {}
+    for (store_url, api), limiter in limiters:
+        stats.setdefault(store_url, {})[api] = limiter.stats()
+    return stats
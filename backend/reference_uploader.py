@@ -0,0 +1,153 @@
+"""
+Image source de référence pour la génération d'images (analyse + 10 variations)
+Au lieu d'envoyer la même image inline à chaque appel (et à chaque retry), elle peut être
+uploadée une seule fois via l'API Files de Gemini puis référencée par son URI.
+
+- ReferenceUploader: interface d'upload (remplaçable par un stand-in local dans les tests)
+- InlineReferenceUploader: image envoyée inline (Part construit une seule fois)
+- GeminiFilesUploader: mode par défaut, upload via client.files (fichier conservé 48h côté Google)
+- ReferenceHandleCache: références réutilisées tant qu'elles ne sont pas expirées
+"""
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from io import BytesIO
+
+from google.genai import types
+
+from config import IMAGE_GENERATION_CONFIG
+from single_flight import SingleFlight, content_hash
+
+
+def is_invalid_reference_error(error):
+    """
+    L'erreur signifie-t-elle que la référence n'est plus utilisable (fichier expiré ou supprimé)?
+    Les autres erreurs (quota 429, 5xx, timeout, refus du contenu) gardent la référence.
+    """
+    code = getattr(error, 'code', None)
+    if code in (403, 404):
+        return True
+    # 400 "The File ... is not in an ACTIVE state" / "Unsupported file uri"
+    return code == 400 and 'file' in str(error).lower()
+
+
+class ReferenceUploader(ABC):
+    """
+    Interface: transforme les bytes d'une image en référence utilisable dans `contents`
+    """
+    # Espace de noms du cache (une référence n'est valable que pour l'uploader qui l'a créée)
+    namespace = 'abstract'
+
+    @abstractmethod
+    def upload(self, image_bytes, mime_type):
+        """
+        Returns:
+            tuple: (référence à placer dans contents, timestamp d'expiration ou None)
+        """
+
+
+class InlineReferenceUploader(ReferenceUploader):
+    namespace = 'inline'
+    # Gardé en mémoire le temps de générer les images d'un produit
+    TTL_SECONDS = 15 * 60
+
+    def upload(self, image_bytes, mime_type):
+        # Rien n'est envoyé: Part sérialisé une fois, réutilisé par tous les appels du produit
+        return types.Part.from_bytes(data=image_bytes, mime_type=mime_type), time.time() + self.TTL_SECONDS
+
+
+class GeminiFilesUploader(ReferenceUploader):
+    # Les fichiers expirent après 48h côté Google: marge de sécurité
+    DEFAULT_TTL_SECONDS = 46 * 3600
+
+    def __init__(self, client, api_key):
+        """
+        Args:
+            client: genai.Client
+            api_key: Clé API (les fichiers appartiennent au projet de la clé)
+        """
+        self.client = client
+        self.namespace = 'files:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    def upload(self, image_bytes, mime_type):
+        uploaded = self.client.files.upload(
+            file=BytesIO(image_bytes),
+            config=types.UploadFileConfig(mime_type=mime_type)
+        )
+        expires_at = time.time() + self.DEFAULT_TTL_SECONDS
+        if uploaded.expiration_time is not None:
+            expires_at = min(expires_at, uploaded.expiration_time.timestamp() - 2 * 3600)
+        reference = types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type)
+        return reference, expires_at
+
+
+class ReferenceHandleCache:
+    def __init__(self, ttl_seconds=GeminiFilesUploader.DEFAULT_TTL_SECONDS, max_entries=64):
+        """
+        Args:
+            ttl_seconds: Durée de vie max d'une référence en cache
+            max_entries: Nombre max de références gardées (les plus anciennes sont oubliées)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Plusieurs variations démarrées en même temps → un seul upload
+        self._uploads = SingleFlight()
+        self._reused = 0
+        self._uploaded = 0
+        self._expired = 0
+
+    def _key(self, uploader, image_bytes):
+        return (uploader.namespace, content_hash(image_bytes))
+
+    def get(self, uploader, image_bytes, mime_type):
+        """
+        Référence de l'image (uploadée au premier appel, puis réutilisée)
+        """
+        key = self._key(uploader, image_bytes)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                reference, expires_at = entry
+                if expires_at > now:
+                    self._reused += 1
+                    return reference
+                del self._entries[key]
+                self._expired += 1
+
+        return self._uploads.do(key, self._upload, key, uploader, image_bytes, mime_type)
+
+    def _upload(self, key, uploader, image_bytes, mime_type):
+        reference, expires_at = uploader.upload(image_bytes, mime_type)
+        ttl_expiry = time.time() + self.ttl_seconds
+        expires_at = ttl_expiry if expires_at is None else min(expires_at, ttl_expiry)
+        with self._lock:
+            self._uploaded += 1
+            self._entries[key] = (reference, expires_at)
+            while len(self._entries) > self.max_entries:
+                # dict ordonné par insertion: la plus ancienne référence en premier
+                self._entries.pop(next(iter(self._entries)))
+        return reference
+
+    def invalidate(self, uploader, image_bytes):
+        """
+        Oublie la référence (ex: fichier supprimé côté Google) → ré-upload au prochain appel
+        """
+        with self._lock:
+            self._entries.pop(self._key(uploader, image_bytes), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'uploaded': self._uploaded,
+                'reused': self._reused,
+                'expired': self._expired,
+            }
+
+
+# Cache partagé: ImageGenerator est recréé à chaque requête, les références restent valables
+reference_cache = ReferenceHandleCache(IMAGE_GENERATION_CONFIG['reference_ttl_seconds'])
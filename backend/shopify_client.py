@@ -5,9 +5,169 @@ import requests
 import base64
 import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import SHOPIFY_API_CONFIG
+from image_ingest import image_ingest
+from rate_limiter import shopify_limiter
+from upload_pipeline import ProductImageUploader
+
+STAGED_UPLOADS_MUTATION = """
+mutation stagedUploadsCreate($input: [StagedUploadInput!]!) {
+  stagedUploadsCreate(input: $input) {
+    stagedTargets { url resourceUrl parameters { name value } }
+    userErrors { field message }
+  }
+}
+"""
+
+PRODUCT_CREATE_MEDIA_MUTATION = """
+mutation productCreateMedia($productId: ID!, $media: [CreateMediaInput!]!) {
+  productCreateMedia(productId: $productId, media: $media) {
+    media { id status }
+    mediaUserErrors { field message }
+  }
+}
+"""
+
+PRODUCT_DELETE_MEDIA_MUTATION = """
+mutation productDeleteMedia($productId: ID!, $mediaIds: [ID!]!) {
+  productDeleteMedia(productId: $productId, mediaIds: $mediaIds) {
+    deletedMediaIds
+    mediaUserErrors { field message }
+  }
+}
+"""
+
+MEDIA_STATUS_QUERY = """
+query mediaStatus($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on MediaImage { id status image { url } }
+  }
+}
+"""
+
+# Export du catalogue en une opération bulk (fichier JSONL, connexions à plat avec __parentId)
+# Les images n'ont pas de champ position en GraphQL: leur ordre dans le fichier est celui du produit
+BULK_PRODUCTS_QUERY = """
+{
+  products {
+    edges {
+      node {
+        id title handle status vendor productType tags descriptionHtml createdAt updatedAt
+        images { edges { node { id url altText } } }
+        variants { edges { node { id title sku price inventoryQuantity position } } }
+      }
+    }
+  }
+}
+"""
+
+# Recherche ciblée d'un produit par SKU (au lieu de parcourir tout le catalogue)
+PRODUCTS_BY_SKU_QUERY = """
+query productsBySku($query: String!) {
+  productVariants(first: 10, query: $query) {
+    nodes { product { id images(first: 250) { nodes { url } } } }
+  }
+}
+"""
+
+BULK_RUN_MUTATION = """
+mutation bulkOperationRunQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_CANCEL_MUTATION = """
+mutation bulkOperationCancel($id: ID!) {
+  bulkOperationCancel(id: $id) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_QUERY = """
+query bulkOperationStatus($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url }
+  }
+}
+"""
+
+
+# Dernier coût demandé par requête GraphQL (estimation avant l'appel suivant)
+_graphql_costs = {}
+
+
+def gid_to_id(gid):
+    """
+    ID numérique REST d'un GID GraphQL (gid://shopify/Product/123 → 123)
+    """
+    return int(str(gid).rsplit('/', 1)[-1].split('?')[0])
+
+
+def bulk_product_to_rest(node, children):
+    """
+    Convertit un produit de l'export bulk au format de /products.json
+
+    Args:
+        node: Ligne JSONL du produit
+        children: Lignes JSONL rattachées au produit (images, variantes)
+
+    Returns:
+        dict: Produit au format REST (champs utilisés par l'application)
+    """
+    product_id = gid_to_id(node['id'])
+    images = []
+    variants = []
+    for child in children:
+        if '/ProductImage/' in child['id']:
+            images.append({
+                'id': gid_to_id(child['id']),
+                'product_id': product_id,
+                'position': len(images) + 1,
+                'src': child.get('url'),
+                'alt': child.get('altText'),
+            })
+        elif '/ProductVariant/' in child['id']:
+            variants.append({
+                'id': gid_to_id(child['id']),
+                'product_id': product_id,
+                'title': child.get('title'),
+                'sku': child.get('sku'),
+                'price': child.get('price'),
+                'inventory_quantity': child.get('inventoryQuantity'),
+                'position': child.get('position') or len(variants) + 1,
+            })
+    variants.sort(key=lambda variant: variant['position'])
+    return {
+        'id': product_id,
+        'title': node.get('title'),
+        'handle': node.get('handle'),
+        'status': (node.get('status') or '').lower(),
+        'vendor': node.get('vendor'),
+        'product_type': node.get('productType'),
+        'tags': ', '.join(node.get('tags') or []),
+        'body_html': node.get('descriptionHtml'),
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+        'images': images,
+        'image': images[0] if images else None,
+        'variants': variants,
+    }
+
 
 class ShopifyClient:
-    def __init__(self, store_url, access_token=None, api_key=None, api_secret=None):
+    def __init__(self, store_url, access_token=None, api_key=None, api_secret=None, api_base_url=None):
         """
         Initialise le client Shopify
         
@@ -16,6 +176,7 @@ class ShopifyClient:
             access_token: Token d'accès OAuth (optionnel si api_key/api_secret fournis)
             api_key: API Key (Client ID) pour Basic Auth
             api_secret: API Secret Key pour Basic Auth
+            api_base_url: Remplace l'URL de l'Admin API (ex: serveur local de test)
         """
         # Nettoyer l'URL du store
         clean_url = store_url.replace('https://', '').replace('http://', '').rstrip('/')
@@ -30,7 +191,27 @@ class ShopifyClient:
         self.api_key = api_key
         self.api_secret = api_secret
         self.api_version = '2025-01'
-        self.base_url = f"https://{self.store_url}/admin/api/{self.api_version}"
+        self.base_url = (
+            api_base_url or SHOPIFY_API_CONFIG['admin_base_url']
+            or f"https://{self.store_url}/admin/api/{self.api_version}"
+        ).rstrip('/')
+        self.graphql_url = f"{self.base_url}/graphql.json"
+        
+        # Seaux de l'Admin API partagés par tous les clients de la boutique
+        self.rest_limiter = shopify_limiter(self.store_url)
+        self.graphql_limiter = shopify_limiter(self.store_url, 'graphql')
+        
+        # Connexions keep-alive réutilisées (une poignée de main TLS par connexion, pas par appel).
+        # L'adaptateur ne retente que les échecs de connexion (rien n'a été envoyé):
+        # 429 et 5xx sont gérés par _request avec le seau de la boutique.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=SHOPIFY_API_CONFIG['pool_size'],
+            max_retries=Retry(total=3, connect=3, read=0, status=0, other=0, backoff_factor=0.5)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         # Choisir le mode d'authentification
         if api_key and api_secret:
@@ -47,6 +228,93 @@ class ShopifyClient:
                 'Content-Type': 'application/json'
             }
     
+    def rate_limit_state(self):
+        """
+        État des seaux de la boutique (partagés entre tous les appelants)
+        
+        Returns:
+            dict: {'rest': stats, 'graphql': stats}
+        """
+        return {'rest': self.rest_limiter.stats(), 'graphql': self.graphql_limiter.stats()}
+    
+    @staticmethod
+    def _retry_delay(response, attempt):
+        """
+        Délai avant nouvel essai: Retry-After si présent, sinon backoff exponentiel (avec jitter)
+        """
+        try:
+            delay = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            delay = min(2 ** attempt, 30)
+        # Jitter: les appelants mis en attente ne repartent pas tous au même instant
+        return delay * random.uniform(1.0, 1.3)
+    
+    def _observe_rest(self, response):
+        """
+        Recale le seau REST sur X-Shopify-Shop-Api-Call-Limit (ex: '32/40')
+        """
+        call_limit = response.headers.get('X-Shopify-Shop-Api-Call-Limit')
+        if not call_limit:
+            return
+        try:
+            used, capacity = (int(value) for value in call_limit.split('/'))
+        except ValueError:
+            return
+        # Seau vidé à capacité/20 par seconde (40 → 2/s, 80 → 4/s, 400 → 20/s)
+        self.rest_limiter.observe(capacity - used - SHOPIFY_API_CONFIG['safety_margin'], capacity, capacity / 20)
+    
+    def _request(self, method, url, limiter=None, tokens=1, cancel_event=None, retry_server_errors=None, **kwargs):
+        """
+        Appel à l'Admin API au rythme du seau de la boutique
+        Les réponses 429 (requête refusée, rien n'est appliqué) mettent tout le seau en pause
+        (Retry-After) puis sont retentées. Les 5xx ne sont retentées avec backoff que pour les
+        appels idempotents: un POST a pu être appliqué avant l'erreur (image en double).
+        
+        Args:
+            method: 'GET', 'POST', 'PUT' ou 'DELETE'
+            url: URL complète
+            limiter: Seau à utiliser (défaut: seau REST de la boutique)
+            tokens: Jetons consommés (coût estimé pour GraphQL)
+            cancel_event: threading.Event de l'appelant qui interrompt l'attente du seau
+            retry_server_errors: Retenter les 5xx (défaut: GET, PUT et DELETE seulement)
+            **kwargs: Paramètres de requests (json, timeout...)
+            
+        Returns:
+            requests.Response: Réponse (la dernière si les nouvelles tentatives sont épuisées)
+            
+        Raises:
+            Exception: Appel annulé par cancel_event avant l'envoi
+        """
+        limiter = limiter or self.rest_limiter
+        if retry_server_errors is None:
+            retry_server_errors = method in ('GET', 'PUT', 'DELETE')
+        # En-têtes d'authentification par appel (jamais sur la session, partagée avec le stockage staged)
+        kwargs.setdefault('headers', self.headers)
+        kwargs.setdefault('auth', self.auth)
+        kwargs.setdefault('timeout', SHOPIFY_API_CONFIG['timeout'])
+        max_retries = SHOPIFY_API_CONFIG['max_retries']
+        for attempt in range(max_retries + 1):
+            if not limiter.acquire(cancel_event, tokens=tokens):
+                raise Exception(f"Appel Shopify annulé ({method} {url.rsplit('/', 1)[-1]})")
+            response = self.session.request(method, url, **kwargs)
+            if limiter is self.rest_limiter:
+                self._observe_rest(response)
+            retryable = response.status_code == 429 or (retry_server_errors and response.status_code >= 500)
+            if attempt == max_retries or not retryable:
+                return response
+            delay = self._retry_delay(response, attempt)
+            if response.status_code == 429:
+                # Seau plein: tous les appelants de la boutique attendent
+                limiter.pause(delay)
+                print(f"⏳ Shopify 429 ({method} {url.rsplit('/', 1)[-1]}), nouvel essai dans {delay:.1f}s")
+            else:
+                print(f"⚠️ Shopify {response.status_code}, nouvel essai dans {delay:.1f}s")
+                if cancel_event is None:
+                    time.sleep(delay)
+                elif cancel_event.wait(delay):
+                    raise Exception(f"Appel Shopify annulé ({method} {url.rsplit('/', 1)[-1]})")
+        return response
+    
     def test_connection(self):
         """
         Teste la connexion à Shopify
@@ -55,7 +323,8 @@ class ShopifyClient:
             dict: {'success': bool, 'shop_name': str, 'error': str}
         """
         try:
-            response = requests.get(
+            response = self._request(
+                'GET',
                 f"{self.base_url}/shop.json",
                 headers=self.headers,
                 auth=self.auth,
@@ -117,30 +386,202 @@ class ShopifyClient:
             list: Liste des produits
         """
         try:
-            products = []
-            url = f"{self.base_url}/products.json?limit={limit}"
-            
-            while url:
-                response = requests.get(url, headers=self.headers, auth=self.auth, timeout=30)
-                response.raise_for_status()
-                
-                data = response.json()
-                products.extend(data.get('products', []))
-                
-                # Pagination via Link header
-                link_header = response.headers.get('Link', '')
-                url = None
-                if 'rel="next"' in link_header:
-                    for link in link_header.split(','):
-                        if 'rel="next"' in link:
-                            url = link.split(';')[0].strip('<> ')
-                            break
-            
-            return products
+            return list(self.iter_products_rest(limit))
         except Exception as e:
             print(f"❌ Erreur récupération produits: {e}")
             return []
     
+    def iter_products_rest(self, limit=250, updated_at_min=None):
+        """
+        Parcourt les produits page par page (/products.json, pagination via Link header)
+        
+        Args:
+            limit: Produits par page (max 250)
+            updated_at_min: Seulement les produits modifiés depuis cette date (ISO 8601)
+        
+        Yields:
+            dict: Produit au format REST
+        """
+        params = {'limit': limit}
+        if updated_at_min:
+            params['updated_at_min'] = updated_at_min
+        url = f"{self.base_url}/products.json?{urlencode(params)}"
+        
+        while url:
+            response = self._request('GET', url, timeout=30)
+            response.raise_for_status()
+            
+            yield from response.json().get('products', [])
+            
+            # Pagination via Link header
+            link_header = response.headers.get('Link', '')
+            url = None
+            if 'rel="next"' in link_header:
+                for link in link_header.split(','):
+                    if 'rel="next"' in link:
+                        url = link.split(';')[0].strip('<> ')
+                        break
+    
+    def iter_products(self, method=None, cancel_event=None):
+        """
+        Parcourt tout le catalogue sans le garder en mémoire
+        
+        Args:
+            method: 'bulk' (export GraphQL bulk) ou 'rest' (défaut: SHOPIFY_API_CONFIG)
+            cancel_event: threading.Event qui interrompt l'attente de l'export bulk
+            
+        Yields:
+            dict: Produit au format REST
+        """
+        method = method or SHOPIFY_API_CONFIG['catalog_fetch']
+        if method == 'bulk':
+            try:
+                operation_id = self.start_bulk_export(BULK_PRODUCTS_QUERY)
+            except Exception as e:
+                # Ex: une autre opération bulk est déjà en cours pour cette app
+                print(f"⚠️ Export bulk impossible, pagination REST: {e}")
+            else:
+                yield from self.iter_bulk_products(operation_id, cancel_event)
+                return
+        yield from self.iter_products_rest()
+    
+    def find_products_by_sku(self, sku, cancel_event=None):
+        """
+        Produits dont une variante porte ce SKU (une requête, sans parcourir le catalogue)
+        
+        Args:
+            sku: SKU recherché (valeur exacte)
+            cancel_event: threading.Event de l'appelant qui interrompt l'attente du seau
+            
+        Returns:
+            list: [{'id': int, 'images': [{'src': str}, ...]}, ...]
+        """
+        value = str(sku).replace('\\', '\\\\').replace('"', '\\"')
+        data = self.graphql(PRODUCTS_BY_SKU_QUERY, {'query': f'sku:"{value}"'}, cancel_event=cancel_event)
+        products = {}
+        for variant in (data.get('productVariants') or {}).get('nodes') or []:
+            product = variant.get('product')
+            if not product:
+                continue
+            products[gid_to_id(product['id'])] = [
+                {'src': image['url']} for image in (product.get('images') or {}).get('nodes') or []
+            ]
+        return [{'id': product_id, 'images': images} for product_id, images in products.items()]
+    
+    def start_bulk_export(self, query):
+        """
+        Lance une opération bulk (exécutée côté Shopify, résultat en fichier JSONL)
+        
+        Returns:
+            str: GID de l'opération
+            
+        Raises:
+            Exception: Erreurs de la mutation (ex: opération déjà en cours)
+        """
+        data = self.graphql(BULK_RUN_MUTATION, {'query': query})
+        result = data['bulkOperationRunQuery']
+        if result['userErrors']:
+            raise Exception(f"Opération bulk refusée: {result['userErrors']}")
+        return result['bulkOperation']['id']
+    
+    def cancel_bulk_operation(self, operation_id):
+        """
+        Annule une opération bulk en cours (une seule opération à la fois par app et par boutique)
+        
+        Returns:
+            bool: True si l'annulation est acceptée
+        """
+        try:
+            data = self.graphql(BULK_CANCEL_MUTATION, {'id': operation_id}, idempotent=True)
+            errors = data['bulkOperationCancel']['userErrors']
+            if errors:
+                print(f"⚠️ Annulation de l'opération bulk refusée: {errors}")
+            else:
+                print(f"🛑 Opération bulk annulée: {operation_id}")
+            return not errors
+        except Exception as e:
+            print(f"⚠️ Annulation de l'opération bulk impossible: {e}")
+            return False
+    
+    def wait_for_bulk_operation(self, operation_id, timeout=None, interval=None, cancel_event=None):
+        """
+        Attend la fin d'une opération bulk
+        
+        Args:
+            operation_id: GID de l'opération
+            timeout: Attente max en secondes (défaut: SHOPIFY_API_CONFIG)
+            interval: Secondes entre deux vérifications (défaut: SHOPIFY_API_CONFIG)
+            cancel_event: threading.Event qui interrompt l'attente
+            
+        Returns:
+            str: URL du fichier JSONL (None si aucun objet exporté)
+            
+        Raises:
+            Exception: Opération échouée, annulée, trop longue ou attente interrompue
+        """
+        cancel_event = cancel_event or threading.Event()
+        timeout = timeout or SHOPIFY_API_CONFIG['bulk_timeout']
+        interval = interval or SHOPIFY_API_CONFIG['bulk_poll_interval']
+        deadline = time.time() + timeout
+        while True:
+            operation = self.graphql(BULK_STATUS_QUERY, {'id': operation_id}, cancel_event=cancel_event).get('node') or {}
+            status = operation.get('status')
+            if status == 'COMPLETED':
+                return operation.get('url')
+            if status in ('FAILED', 'CANCELED', 'EXPIRED'):
+                raise Exception(f"Opération bulk {status}: {operation.get('errorCode')}")
+            if time.time() >= deadline:
+                raise Exception(f"Opération bulk toujours {status} après {timeout}s")
+            if cancel_event.wait(interval):
+                raise Exception("Attente de l'opération bulk interrompue")
+    
+    def iter_bulk_products(self, operation_id, cancel_event=None):
+        """
+        Attend l'export bulk puis lit le fichier JSONL ligne par ligne
+        Les images/variantes sont rattachées à leur produit par __parentId: elles suivent la
+        ligne du produit, pas forcément de façon contiguë. Mémoire bornée: seuls les
+        bulk_group_window derniers produits restent ouverts; une ligne dont le produit est
+        déjà transmis (ou absent) est signalée et ignorée.
+        Si l'attente s'arrête avant la fin de l'export (cancel_event, délai dépassé, erreur),
+        l'opération est annulée pour ne pas bloquer le prochain export de l'app.
+        
+        Yields:
+            dict: Produit au format REST
+        """
+        completed = False
+        try:
+            url = self.wait_for_bulk_operation(operation_id, cancel_event=cancel_event)
+            completed = True
+        finally:
+            if not completed:
+                self.cancel_bulk_operation(operation_id)
+        if not url:
+            return
+        
+        # URL signée de stockage: pas d'en-têtes d'authentification Shopify
+        with self.session.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            window = SHOPIFY_API_CONFIG['bulk_group_window']
+            # {GID produit: (ligne du produit, lignes enfants)} dans l'ordre du fichier
+            open_products = OrderedDict()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                node = json.loads(line)
+                parent_id = node.get('__parentId')
+                if parent_id is not None:
+                    if parent_id in open_products:
+                        open_products[parent_id][1].append(node)
+                    else:
+                        print(f"⚠️ Export bulk: {node.get('id')} arrive après son produit {parent_id}, ignoré")
+                    continue
+                open_products[node['id']] = (node, [])
+                if len(open_products) > window:
+                    _, (product, children) = open_products.popitem(last=False)
+                    yield bulk_product_to_rest(product, children)
+            for product, children in open_products.values():
+                yield bulk_product_to_rest(product, children)
+    
     def get_product_by_handle(self, handle):
         """
         Récupère un produit par son handle
@@ -152,10 +593,9 @@ class ShopifyClient:
             dict: Données du produit ou None
         """
         try:
-            response = requests.get(
+            response = self._request(
+                'GET',
                 f"{self.base_url}/products.json?handle={handle}",
-                headers=self.headers,
-                auth=self.auth,
                 timeout=10
             )
             response.raise_for_status()
@@ -166,21 +606,22 @@ class ShopifyClient:
             print(f"❌ Erreur récupération produit {handle}: {e}")
             return None
     
-    def get_product_images(self, product_id):
+    def get_product_images(self, product_id, raise_errors=False):
         """
         Récupère les images d'un produit
         
         Args:
             product_id: ID du produit Shopify
+            raise_errors: Relancer l'erreur au lieu de renvoyer une liste vide
+                          (l'appelant doit distinguer "aucune image" de "liste illisible")
             
         Returns:
             list: Liste des images avec leurs URLs CDN
         """
         try:
-            response = requests.get(
+            response = self._request(
+                'GET',
                 f"{self.base_url}/products/{product_id}/images.json",
-                headers=self.headers,
-                auth=self.auth,
                 timeout=10
             )
             response.raise_for_status()
@@ -188,9 +629,12 @@ class ShopifyClient:
             return response.json().get('images', [])
         except Exception as e:
             print(f"❌ Erreur récupération images produit {product_id}: {e}")
+            if raise_errors:
+                raise
             return []
     
-    def upload_image_to_product(self, product_id, image_data, filename="generated_image.png", position=None):
+    def upload_image_to_product(self, product_id, image_data, filename="generated_image.png", position=None,
+                                cancel_event=None):
         """
         Upload une image vers un produit Shopify
         
@@ -199,6 +643,7 @@ class ShopifyClient:
             image_data: Bytes de l'image
             filename: Nom du fichier
             position: Position de l'image (1 = première)
+            cancel_event: threading.Event de l'appelant qui interrompt l'attente du seau
             
         Returns:
             dict: {'success': bool, 'image_url': str, 'error': str}
@@ -217,11 +662,11 @@ class ShopifyClient:
             if position is not None:
                 payload['image']['position'] = position
             
-            response = requests.post(
+            response = self._request(
+                'POST',
                 f"{self.base_url}/products/{product_id}/images.json",
-                headers=self.headers,
-                auth=self.auth,
                 json=payload,
+                cancel_event=cancel_event,
                 timeout=60
             )
             response.raise_for_status()
@@ -265,10 +710,9 @@ class ShopifyClient:
             bool: True si succès
         """
         try:
-            response = requests.delete(
+            response = self._request(
+                'DELETE',
                 f"{self.base_url}/products/{product_id}/images/{image_id}.json",
-                headers=self.headers,
-                auth=self.auth,
                 timeout=10
             )
             return response.status_code == 200
@@ -276,45 +720,268 @@ class ShopifyClient:
             print(f"❌ Erreur suppression image {image_id}: {e}")
             return False
     
-    def replace_product_images(self, product_id, new_images_data):
+    def set_image_position(self, product_id, image_id, position):
         """
-        Remplace toutes les images d'un produit par de nouvelles
+        Déplace une image d'un produit
         
         Args:
             product_id: ID du produit
-            new_images_data: Liste de bytes d'images
+            image_id: ID de l'image
+            position: Nouvelle position (1 = première)
             
         Returns:
-            dict: {'success': bool, 'new_urls': list, 'error': str}
+            bool: True si succès
         """
         try:
-            # 1. Récupérer les anciennes images
-            old_images = self.get_product_images(product_id)
+            response = self._request(
+                'PUT',
+                f"{self.base_url}/products/{product_id}/images/{image_id}.json",
+                json={'image': {'id': image_id, 'position': position}},
+                timeout=10
+            )
+            if response.status_code != 200:
+                print(f"❌ Erreur position image {image_id}: {response.status_code} - {response.text}")
+            return response.status_code == 200
+        except Exception as e:
+            print(f"❌ Erreur position image {image_id}: {e}")
+            return False
+    
+    @staticmethod
+    def product_gid(product_id):
+        """
+        ID GraphQL d'un produit (accepte l'ID numérique REST ou le GID)
+        """
+        product_id = str(product_id)
+        return product_id if product_id.startswith('gid://') else f"gid://shopify/Product/{product_id}"
+    
+    def graphql(self, query, variables=None, timeout=30, cancel_event=None, idempotent=None):
+        """
+        Exécute une requête GraphQL Admin
+        Le coût est réservé dans le seau de points de la boutique (estimé d'après le dernier
+        appel de la même requête), puis recalé sur extensions.cost.throttleStatus.
+        Une réponse THROTTLED met le seau en pause le temps de récupérer les points manquants.
+        
+        Args:
+            query: Requête ou mutation
+            variables: Variables de la requête
+            timeout: Secondes max par appel
+            cancel_event: threading.Event de l'appelant qui interrompt l'attente du seau
+            idempotent: Retenter sur 5xx (défaut: requêtes oui, mutations non)
+        
+        Returns:
+            dict: Champ 'data' de la réponse
             
-            # 2. Supprimer les anciennes images
-            for img in old_images:
-                self.delete_product_image(product_id, img['id'])
+        Raises:
+            Exception: Erreur HTTP ou erreurs GraphQL
+        """
+        if idempotent is None:
+            idempotent = not query.lstrip().startswith('mutation')
+        max_retries = SHOPIFY_API_CONFIG['max_retries']
+        for attempt in range(max_retries + 1):
+            cost = _graphql_costs.get(query, SHOPIFY_API_CONFIG['graphql_default_cost'])
+            response = self._request(
+                'POST',
+                self.graphql_url,
+                limiter=self.graphql_limiter,
+                tokens=cost,
+                cancel_event=cancel_event,
+                retry_server_errors=idempotent,
+                json={'query': query, 'variables': variables or {}},
+                timeout=timeout
+            )
+            response.raise_for_status()
+            payload = response.json()
             
-            # 3. Uploader les nouvelles images
-            new_urls = []
-            for idx, img_data in enumerate(new_images_data):
-                result = self.upload_image_to_product(
-                    product_id, 
-                    img_data, 
-                    filename=f"ai_generated_{idx+1}.png",
-                    position=idx + 1
+            cost_info = (payload.get('extensions') or {}).get('cost') or {}
+            throttle = cost_info.get('throttleStatus')
+            if cost_info.get('requestedQueryCost'):
+                _graphql_costs[query] = cost_info['requestedQueryCost']
+            if throttle:
+                self.graphql_limiter.observe(
+                    throttle['currentlyAvailable'], throttle['maximumAvailable'], throttle['restoreRate']
                 )
-                if result['success']:
-                    new_urls.append(result['image_url'])
+            
+            errors = payload.get('errors')
+            throttled = isinstance(errors, list) and any(
+                isinstance(error, dict) and (error.get('extensions') or {}).get('code') == 'THROTTLED'
+                for error in errors
+            )
+            if throttled and attempt < max_retries:
+                if throttle:
+                    # Seau recalé sur currentlyAvailable: le prochain acquire attend les points manquants.
+                    # Jitter en plus pour ne pas repartir en même temps que les autres appelants.
+                    missing = max(cost_info.get('requestedQueryCost', cost) - throttle['currentlyAvailable'], 1)
+                    delay = random.uniform(0, 0.3) * missing / throttle['restoreRate']
+                    print(f"⏳ GraphQL THROTTLED, {missing} points manquants")
+                    time.sleep(delay)
                 else:
-                    print(f"⚠️ Erreur upload image {idx+1}: {result['error']}")
+                    delay = self._retry_delay(response, attempt)
+                    self.graphql_limiter.pause(delay)
+                    print(f"⏳ GraphQL THROTTLED, nouvel essai dans {delay:.1f}s")
+                continue
+            if errors:
+                raise Exception(f"Erreur GraphQL: {errors}")
+            return payload.get('data') or {}
+    
+    def create_staged_targets(self, files, cancel_event=None):
+        """
+        Crée les cibles de staged upload de plusieurs images en une seule mutation
+        Mutation sans effet sur la boutique (cibles de stockage temporaires): retentée sur 5xx.
+        
+        Args:
+            files: [(nom de fichier, type MIME), ...]
+            cancel_event: threading.Event de l'appelant (abandon des uploads)
             
+        Returns:
+            list: Cibles {'url', 'resourceUrl', 'parameters'} dans l'ordre de files
+            
+        Raises:
+            Exception: Erreur GraphQL ou userErrors
+        """
+        data = self.graphql(STAGED_UPLOADS_MUTATION, {'input': [
+            {'resource': 'IMAGE', 'filename': filename, 'mimeType': mime_type, 'httpMethod': 'POST'}
+            for filename, mime_type in files
+        ]}, cancel_event=cancel_event, idempotent=True)
+        staged = data['stagedUploadsCreate']
+        if staged['userErrors']:
+            raise Exception(f"stagedUploadsCreate: {staged['userErrors']}")
+        return staged['stagedTargets']
+    
+    def upload_to_staged_target(self, target, image_data, filename, mime_type):
+        """
+        Envoie les bytes bruts d'une image vers le stockage Shopify (staged upload)
+        Pas de base64 ni de JSON: l'image est envoyée telle quelle en multipart.
+        
+        Args:
+            target: Cible renvoyée par create_staged_targets
+            image_data: Bytes de l'image
+            filename: Nom du fichier
+            mime_type: Type MIME (image/png, image/jpeg, image/webp)
+            
+        Returns:
+            dict: {'success': bool, 'resource_url': str, 'error': str}
+        """
+        try:
+            fields = {param['name']: param['value'] for param in target['parameters']}
+            response = self.session.post(
+                target['url'],
+                data=fields,
+                files={'file': (filename, image_data, mime_type)},
+                timeout=60
+            )
+            response.raise_for_status()
+            return {'success': True, 'resource_url': target['resourceUrl'], 'error': None}
+        except Exception as e:
+            return {'success': False, 'resource_url': None, 'error': str(e)}
+    
+    def create_product_media(self, product_id, resource_urls, alt=''):
+        """
+        Attache plusieurs images uploadées (staged) à un produit en une seule mutation
+        Les médias sont ajoutés après les images existantes, dans l'ordre donné.
+        
+        Args:
+            product_id: ID du produit (numérique ou GID)
+            resource_urls: resourceUrl renvoyées par upload_to_staged_target
+            alt: Texte alternatif
+            
+        Returns:
+            dict: {'success': bool, 'media': [{'id', 'status'}], 'error': str}
+        """
+        try:
+            data = self.graphql(PRODUCT_CREATE_MEDIA_MUTATION, {
+                'productId': self.product_gid(product_id),
+                'media': [
+                    {'originalSource': url, 'mediaContentType': 'IMAGE', 'alt': alt}
+                    for url in resource_urls
+                ],
+            })
+            created = data['productCreateMedia']
+            media = created.get('media') or []
+            errors = created.get('mediaUserErrors') or []
             return {
-                'success': len(new_urls) > 0,
-                'new_urls': new_urls,
-                'uploaded_count': len(new_urls),
-                'error': None if new_urls else 'Aucune image uploadée'
+                'success': bool(media),
+                'media': media,
+                'error': str(errors) if errors else None
             }
+        except Exception as e:
+            return {'success': False, 'media': [], 'error': str(e)}
+    
+    def delete_product_media(self, product_id, media_ids):
+        """
+        Retire plusieurs médias d'un produit en une seule mutation
+        Retentée sur 5xx: supprimer un média déjà supprimé est sans effet.
+        
+        Args:
+            product_id: ID du produit (numérique ou GID)
+            media_ids: GIDs des médias
+            
+        Returns:
+            bool: True si tous les médias ont été supprimés
+        """
+        try:
+            data = self.graphql(PRODUCT_DELETE_MEDIA_MUTATION, {
+                'productId': self.product_gid(product_id),
+                'mediaIds': list(media_ids),
+            }, idempotent=True)
+            deleted = data['productDeleteMedia']
+            errors = deleted.get('mediaUserErrors') or []
+            if errors:
+                print(f"⚠️ productDeleteMedia: {errors}")
+            return len(deleted.get('deletedMediaIds') or []) == len(media_ids)
+        except Exception as e:
+            print(f"❌ Erreur suppression médias produit {product_id}: {e}")
+            return False
+    
+    def wait_for_media(self, media_ids, timeout=60, interval=1.0):
+        """
+        Attend que Shopify ait traité les médias (URL CDN disponible)
+        
+        Args:
+            media_ids: GIDs des médias
+            timeout: Attente max en secondes
+            
+        Returns:
+            dict: {media_id: URL CDN ou None (échec / toujours en traitement)}
+        """
+        urls = {media_id: None for media_id in media_ids}
+        pending = list(media_ids)
+        deadline = time.time() + timeout
+        while pending:
+            try:
+                data = self.graphql(MEDIA_STATUS_QUERY, {'ids': pending})
+            except Exception as e:
+                print(f"⚠️ Statut des médias indisponible: {e}")
+                break
+            for node in data.get('nodes') or []:
+                if not node:
+                    continue
+                if node.get('status') == 'READY' and node.get('image'):
+                    urls[node['id']] = node['image']['url']
+                if node.get('status') in ('READY', 'FAILED'):
+                    pending.remove(node['id'])
+            if not pending or time.time() >= deadline:
+                break
+            time.sleep(interval)
+        return urls
+    
+    def replace_product_images(self, product_id, new_images_data):
+        """
+        Remplace toutes les images d'un produit par de nouvelles
+        Les nouvelles images sont uploadées d'abord (en parallèle), les anciennes ne sont
+        supprimées qu'ensuite: un échec d'upload ne laisse jamais le produit sans images.
+        
+        Args:
+            product_id: ID du produit
+            new_images_data: Liste de bytes d'images
+            
+        Returns:
+            dict: {'success': bool, 'new_urls': list, 'error': str}
+        """
+        try:
+            uploader = ProductImageUploader(self, product_id, replace=True, expected_images=len(new_images_data))
+            for idx, img_data in enumerate(new_images_data):
+                uploader.submit(idx + 1, img_data)
+            return uploader.finish()
         except Exception as e:
             return {
                 'success': False,
@@ -332,18 +999,38 @@ class ShopifyClient:
         Returns:
             bytes: Données de l'image ou None
         """
-        try:
-            # Optimiser l'URL pour une taille raisonnable
-            clean_url = image_url.split('?')[0]
-            if 'cdn.shopify.com' in clean_url:
-                clean_url += '?width=1024'
-            
-            response = requests.get(clean_url, timeout=15)
-            response.raise_for_status()
-            return response.content
-        except Exception as e:
-            print(f"❌ Erreur téléchargement image: {e}")
-            return None
+        # Session HTTP partagée et cache disque des images sources (largeur CDN commune)
+        return image_ingest.fetch_source(image_url)
+
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_shopify_client(store_url, access_token=None, api_key=None, api_secret=None):
+    """
+    Client Shopify réutilisé d'une requête Flask à l'autre (session et connexions conservées)
+    
+    Args:
+        Mêmes paramètres que ShopifyClient
+        
+    Returns:
+        ShopifyClient: Client partagé pour ces identifiants
+    """
+    key = (store_url, access_token, api_key, api_secret)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        client = ShopifyClient(store_url, access_token=access_token, api_key=api_key, api_secret=api_secret)
+        _clients[key] = client
+        # Identifiants remplacés (nouveau token, autre boutique): les anciens clients sortent du
+        # registre sans être fermés, une requête Flask en cours peut encore utiliser leur session
+        # (connexions libérées quand le client n'est plus référencé)
+        while len(_clients) > SHOPIFY_API_CONFIG['max_clients']:
+            _clients.popitem(last=False)
+        return client
 
 
 def load_shopify_settings():
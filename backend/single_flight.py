@@ -0,0 +1,89 @@
+"""
+Coalescence des appels Gemini identiques en cours (single-flight)
+Si deux traitements envoient la même requête (même modèle, même prompt, même image)
+au même moment, un seul appel part et les autres attendent son résultat.
+"""
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+def content_hash(data):
+    """
+    Hash SHA-256 d'un prompt (str) ou d'une image (bytes)
+    """
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def call_key(model, prompt, image_bytes=None):
+    """
+    Clé d'un appel: (modèle, hash du prompt, hash de l'image)
+    """
+    return (model, content_hash(prompt), content_hash(image_bytes))
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._calls = 0
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Exécute fn une seule fois pour tous les appels concurrents de même clé
+
+        Args:
+            key: Clé de l'appel (voir call_key)
+            fn: Fonction à exécuter
+
+        Returns:
+            Résultat de fn (partagé entre les appelants concurrents)
+        """
+        with self._lock:
+            self._calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self._executed += 1
+                leader = True
+
+        if not leader:
+            # Même exception que l'appel d'origine si celui-ci échoue
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self):
+        """
+        Compteurs d'appels (exposés par /api/stats)
+        """
+        with self._lock:
+            return {
+                'calls': self._calls,
+                'executed': self._executed,
+                'coalesced': self._coalesced,
+                'in_flight': len(self._in_flight),
+            }
+
+
+# Instance partagée par tous les modules (enhancer, générateur d'images, catégorisation)
+gemini_flight = SingleFlight()
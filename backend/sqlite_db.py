@@ -0,0 +1,22 @@
+"""
+Ouverture des bases SQLite locales (contenus, prompts, copie du catalogue)
+Un seul réglage pour toutes les bases du backend.
+"""
+import sqlite3
+
+
+def open_sqlite(db_path):
+    """
+    Ouvre (ou crée) une base SQLite partagée entre threads
+
+    Args:
+        db_path: Chemin du fichier .db
+
+    Returns:
+        sqlite3.Connection: Connexion utilisable depuis plusieurs threads
+                            (les appelants sérialisent les accès avec leur propre verrou)
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    # WAL: lectures concurrentes pendant les écritures (plusieurs process Flask)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
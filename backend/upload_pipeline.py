@@ -0,0 +1,272 @@
+"""
+Upload des images générées vers Shopify au fil de la génération
+Chaque image part vers Shopify dès qu'elle est prête (pool d'upload borné) au lieu
+d'attendre la fin des 10 générations: génération et upload se recouvrent, et les bytes
+d'une image sont libérés dès son upload. Les positions définitives sont fixées à la fin.
+
+Remplacement non destructif: les nouvelles images sont uploadées d'abord, les anciennes
+ne sont supprimées (en parallèle) qu'une fois au moins un upload réussi. Uploads et
+suppressions sont cadencés par les seaux de la boutique (voir ShopifyClient._request).
+
+Méthode 'staged' (défaut): les cibles de stockage de toutes les variations attendues sont
+créées en une seule mutation stagedUploadsCreate, chaque image y est envoyée en bytes
+bruts dès qu'elle est prête, puis toutes sont attachées au produit en une seule mutation
+productCreateMedia (dans l'ordre des variations: pas de repositionnement). Les anciennes
+images ne sont supprimées qu'une fois au moins un média traité (READY) par Shopify; les
+médias FAILED ou pas prêts à temps sont retirés du produit (productDeleteMedia).
+Méthode 'rest': POST base64 par image puis repositionnement.
+
+Client déconnecté avant finish(): abort() remet le produit dans son état d'origine
+(uploads déjà faits retirés, anciennes images intactes).
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SHOPIFY_UPLOAD_CONFIG
+from image_ingest import sniff_image_type
+
+
+class ProductImageUploader:
+    def __init__(self, shopify_client, product_id, replace=True, max_workers=None,
+                 filename_prefix='ai_generated', cancel_event=None, method=None, expected_images=None):
+        """
+        Args:
+            shopify_client: Instance de ShopifyClient
+            product_id: ID du produit Shopify
+            replace: True = les anciennes images sont supprimées à la fin (si au moins un upload réussit),
+                     False = les nouvelles images sont ajoutées après les existantes
+            max_workers: Uploads simultanés (défaut: SHOPIFY_UPLOAD_CONFIG)
+            filename_prefix: Préfixe des noms de fichiers
+            cancel_event: threading.Event qui abandonne les uploads pas encore commencés
+                          (y compris ceux en attente du seau Shopify)
+            method: 'staged' ou 'rest' (défaut: SHOPIFY_UPLOAD_CONFIG)
+            expected_images: Nombre de variations attendues (numérotées à partir de 1):
+                             leurs cibles de staged upload sont créées en une seule mutation
+
+        Raises:
+            Exception: Images existantes du produit illisibles en mode remplacement
+        """
+        self.client = shopify_client
+        self.product_id = product_id
+        self.replace = replace
+        self.filename_prefix = filename_prefix
+        self.cancel_event = cancel_event or threading.Event()
+        self.method = method or SHOPIFY_UPLOAD_CONFIG['method']
+        self.expected_images = expected_images or 0
+        self.bytes_uploaded = 0
+
+        # Images existantes avant le premier upload (supprimées à la fin en mode remplacement).
+        # Remplacement: une liste illisible laisserait les anciennes images à côté des nouvelles,
+        # l'erreur est relancée avant tout upload.
+        self.old_images = shopify_client.get_product_images(product_id, raise_errors=replace)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or SHOPIFY_UPLOAD_CONFIG['upload_workers'])
+        self._futures = {}
+        self._completed = queue.Queue()
+        self._lock = threading.Lock()
+        # 'open' → 'finishing' (finish) ou 'aborted' (abort): une seule issue possible
+        self._state = 'open'
+        # Cibles de staged upload créées d'avance: {variation: (cible, type MIME)}
+        self._targets = {}
+        self._targets_lock = threading.Lock()
+        self._targets_batched = False
+
+    def submit(self, variation, image_data):
+        """
+        Lance l'upload d'une image dès qu'elle est générée
+
+        Args:
+            variation: Numéro de variation (détermine la position finale)
+            image_data: Bytes de l'image
+        """
+        with self._lock:
+            if self._state == 'aborted':
+                # Image terminée après l'abandon: rien n'est envoyé
+                return
+            self._futures[variation] = self._executor.submit(self._upload, variation, image_data)
+
+    def _staged_target(self, variation, extension, mime_type):
+        """
+        Cible de staged upload d'une variation
+        Au premier upload, les cibles de toutes les variations attendues sont créées en une
+        seule mutation (avec le type de la première image: toutes sont encodées pareil).
+        Une variation imprévue ou d'un autre type obtient sa propre cible.
+        """
+        with self._targets_lock:
+            target = self._targets.pop(variation, None)
+            if target is not None and target[1] == mime_type:
+                return target[0]
+            variations = [variation]
+            if not self._targets_batched:
+                self._targets_batched = True
+                variations += [number for number in range(1, self.expected_images + 1) if number != variation]
+            targets = self.client.create_staged_targets([
+                (f"{self.filename_prefix}_{number}.{extension}", mime_type) for number in variations
+            ], cancel_event=self.cancel_event)
+            for number, other in zip(variations[1:], targets[1:]):
+                self._targets[number] = (other, mime_type)
+            return targets[0]
+
+    def _upload(self, variation, image_data):
+        mime_type, extension = sniff_image_type(image_data)
+        filename = f"{self.filename_prefix}_{variation}.{extension}"
+        if self.cancel_event.is_set():
+            result = {'success': False, 'image_url': None, 'error': 'Annulé'}
+        elif self.method == 'staged':
+            try:
+                target = self._staged_target(variation, extension, mime_type)
+                result = self.client.upload_to_staged_target(target, image_data, filename, mime_type)
+            except Exception as e:
+                result = {'success': False, 'resource_url': None, 'error': str(e)}
+            sent = len(image_data)
+        else:
+            result = self.client.upload_image_to_product(self.product_id, image_data, filename=filename,
+                                                         cancel_event=self.cancel_event)
+            # JSON base64: 4 octets envoyés pour 3
+            sent = (len(image_data) + 2) // 3 * 4
+        if result['success']:
+            with self._lock:
+                self.bytes_uploaded += sent
+        self._completed.put((variation, result))
+        return result
+
+    def completed(self):
+        """
+        Uploads terminés depuis le dernier appel (pour les logs en temps réel)
+
+        Returns:
+            list: [(variation, résultat de upload_image_to_product), ...]
+        """
+        done = []
+        while True:
+            try:
+                done.append(self._completed.get_nowait())
+            except queue.Empty:
+                return done
+
+    def finish(self):
+        """
+        Attend la fin des uploads, supprime les anciennes images et fixe les positions
+
+        Returns:
+            dict: {'success': bool, 'new_urls': list, 'uploaded_count': int, 'bytes_uploaded': int, 'error': str}
+                  (même format que ShopifyClient.replace_product_images, URLs dans l'ordre des variations)
+        """
+        with self._lock:
+            if self._state == 'aborted':
+                return {'success': False, 'new_urls': [], 'uploaded_count': 0,
+                        'bytes_uploaded': self.bytes_uploaded, 'error': 'Annulé'}
+            self._state = 'finishing'
+
+        uploaded = []
+        for variation in sorted(self._futures):
+            result = self._futures[variation].result()
+            if result['success']:
+                uploaded.append(result)
+            else:
+                print(f"⚠️ Erreur upload image {variation}: {result['error']}")
+
+        if uploaded and self.method == 'staged':
+            # Une seule mutation pour toutes les images, dans l'ordre des variations
+            created = self.client.create_product_media(
+                self.product_id, [result['resource_url'] for result in uploaded]
+            )
+            if created['error']:
+                print(f"⚠️ productCreateMedia: {created['error']}")
+            media = created['media']
+            # Traitement Shopify terminé avant de toucher aux anciennes images:
+            # un média FAILED (ou encore en traitement) ne compte pas comme uploadé
+            urls = self.client.wait_for_media(
+                [item['id'] for item in media], timeout=SHOPIFY_UPLOAD_CONFIG['media_ready_timeout']
+            ) if media else {}
+            uploaded = [{'media_id': item['id'], 'image_url': urls[item['id']]}
+                        for item in media if urls.get(item['id'])]
+            leftovers = [item['id'] for item in media if not urls.get(item['id'])]
+            if leftovers:
+                # Déjà attachés au produit: un média FAILED resterait visible, un média encore en
+                # traitement deviendrait READY plus tard (doublon au prochain essai). Retirés avant de conclure.
+                print(f"⚠️ {len(leftovers)} média(s) non prêt(s) (FAILED ou traitement trop long), retirés du produit")
+                if not self.client.delete_product_media(self.product_id, leftovers):
+                    print(f"⚠️ Médias non prêts du produit {self.product_id} non retirés: {leftovers}")
+
+        if not uploaded:
+            # Rien d'exploitable sur le produit: on garde les anciennes images
+            self._executor.shutdown(wait=False)
+            return {'success': False, 'new_urls': [], 'uploaded_count': 0,
+                    'bytes_uploaded': self.bytes_uploaded, 'error': 'Aucune image uploadée'}
+
+        if self.replace and self.old_images:
+            # Suppressions en parallèle sur le même pool
+            deleted = list(self._executor.map(
+                lambda image_id: self.client.delete_product_image(self.product_id, image_id),
+                [img['id'] for img in self.old_images]
+            ))
+            if not all(deleted):
+                print(f"⚠️ {deleted.count(False)} ancienne(s) image(s) non supprimée(s)")
+        self._executor.shutdown(wait=False)
+
+        if self.method == 'staged':
+            # Médias créés dans l'ordre, après les images conservées: positions déjà correctes
+            return {
+                'success': True,
+                'new_urls': [result['image_url'] for result in uploaded],
+                'uploaded_count': len(uploaded),
+                'bytes_uploaded': self.bytes_uploaded,
+                'error': None
+            }
+
+        # Positions: ordre des variations (les uploads finissent dans le désordre),
+        # après les images conservées. Seules les images mal placées sont déplacées.
+        first_position = 1 if self.replace else len(self.old_images) + 1
+        order = [img['id'] for img in sorted(self.client.get_product_images(self.product_id),
+                                             key=lambda img: img.get('position') or 0)]
+        for position, result in enumerate(uploaded, start=first_position):
+            image_id = result['image_id']
+            if image_id in order and order.index(image_id) == position - 1:
+                continue
+            if self.client.set_image_position(self.product_id, image_id, position):
+                # Shopify décale les images suivantes: même mise à jour en local
+                if image_id in order:
+                    order.remove(image_id)
+                order.insert(position - 1, image_id)
+
+        return {
+            'success': True,
+            'new_urls': [result['image_url'] for result in uploaded],
+            'uploaded_count': len(uploaded),
+            'bytes_uploaded': self.bytes_uploaded,
+            'error': None
+        }
+
+    def abort(self):
+        """
+        Abandon avant finish() (client déconnecté, erreur): le produit garde ses images d'origine
+        Les uploads pas encore commencés sont annulés, ceux déjà faits sont retirés en
+        arrière-plan: images supprimées en méthode 'rest'; en méthode 'staged' rien n'est
+        encore attaché au produit (les fichiers en attente expirent côté Shopify).
+        Sans effet si finish() a déjà commencé.
+
+        Returns:
+            threading.Thread: Nettoyage en cours, ou None si rien à faire
+        """
+        with self._lock:
+            if self._state != 'open':
+                return None
+            self._state = 'aborted'
+            futures = dict(self._futures)
+        self.cancel_event.set()
+        cleanup = threading.Thread(target=self._discard_uploads, args=(futures,), daemon=True)
+        cleanup.start()
+        return cleanup
+
+    def _discard_uploads(self, futures):
+        removed = 0
+        for variation in sorted(futures):
+            result = futures[variation].result()
+            if result['success'] and result.get('image_id'):
+                if self.client.delete_product_image(self.product_id, result['image_id']):
+                    removed += 1
+        self._executor.shutdown(wait=False)
+        if removed:
+            print(f"🧹 Upload annulé: {removed} image(s) retirée(s) du produit {self.product_id}")
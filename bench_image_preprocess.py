@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark du prétraitement des images (décodage + redimensionnement + encodage JPEG)
+Compare l'exécution dans des threads (GIL) au pool de process pour 1, 2, 4... cœurs.
+
+Usage:
+    python bench_image_preprocess.py [--count 1000] [--profile enhance] [--threads 16]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+import numpy as np
+from PIL import Image
+
+from config import IMAGE_INGEST_CONFIG
+from image_ops import preprocess_image
+from image_workers import ImageWorkerPool
+
+
+def make_photos(count, distinct=50, size=(1600, 1600)):
+    """
+    Génère des photos produits synthétiques (JPEG ~ taille d'une photo Shopify)
+    """
+    rng = np.random.default_rng(0)
+    photos = []
+    for i in range(distinct):
+        # Dégradé + bruit: se compresse comme une vraie photo (ni uni, ni bruit pur)
+        gradient = np.linspace(0, 255, size[0], dtype=np.float32)
+        base = np.stack([np.add.outer(gradient, gradient[::-1]) / 2] * 3, axis=-1)
+        noise = rng.normal(0, 12, base.shape)
+        pixels = np.clip(base + noise + i, 0, 255).astype('uint8')
+        buffered = BytesIO()
+        Image.fromarray(pixels).save(buffered, format='JPEG', quality=90)
+        photos.append(buffered.getvalue())
+    return [photos[i % distinct] for i in range(count)]
+
+
+def run_batch(photos, settings, threads, pool=None):
+    def task(raw_bytes):
+        args = (raw_bytes, settings['width'], settings['format'], settings['quality'])
+        return pool.run(preprocess_image, *args) if pool else preprocess_image(*args)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total_bytes = sum(len(payload) for payload in executor.map(task, photos))
+    return time.time() - started, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000, help='Nombre de photos')
+    parser.add_argument('--profile', default='enhance', choices=sorted(IMAGE_INGEST_CONFIG['profiles']))
+    parser.add_argument('--threads', type=int, default=16, help='Threads appelants (comme le pipeline)')
+    args = parser.parse_args()
+
+    settings = IMAGE_INGEST_CONFIG['profiles'][args.profile]
+    cores = os.cpu_count() or 1
+    print(f"📸 Génération de {args.count} photos synthétiques...")
+    photos = make_photos(args.count)
+    print(f"   {sum(map(len, photos)) / 1024 / 1024:.1f} MB en entrée, profil '{args.profile}' {settings}")
+    print(f"   {cores} cœurs disponibles\n")
+
+    elapsed, _ = run_batch(photos, settings, args.threads)
+    baseline = args.count / elapsed
+    print(f"🧵 Threads seuls ({args.threads}):   {elapsed:6.2f}s  {baseline:7.1f} img/s  (référence)")
+
+    workers = 1
+    while True:
+        pool = ImageWorkerPool(workers)
+        # Démarrage des process hors mesure
+        run_batch(photos[:workers * 2], settings, args.threads, pool)
+        elapsed, total_bytes = run_batch(photos, settings, args.threads, pool)
+        pool.shutdown()
+        rate = args.count / elapsed
+        print(f"⚙️  Process x{workers:<3}          {elapsed:6.2f}s  {rate:7.1f} img/s  "
+              f"x{rate / baseline:.2f}  ({total_bytes / args.count / 1024:.0f} KB/img)")
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+
+if __name__ == '__main__':
+    main()
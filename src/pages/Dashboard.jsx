@@ -6,6 +6,7 @@ const Dashboard = () => {
   const [file, setFile] = useState(null)
   const [priceMultiplier, setPriceMultiplier] = useState(4.0)
   const [productType, setProductType] = useState('physical')
+  const [resume, setResume] = useState(false)
   const [loading, setLoading] = useState(false)
   const [progress, setProgress] = useState(null)
   const [result, setResult] = useState(null)
@@ -161,7 +162,7 @@ const Dashboard = () => {
       const streamResponse = await fetch('/api/enhance', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ temp_file: response.data.temp_file })
+        body: JSON.stringify({ temp_file: response.data.temp_file, resume })
       })
 
       // Vérifier si erreur (ex: clé API manquante)
@@ -689,6 +690,22 @@ const Dashboard = () => {
               </p>
             </div>
 
+            <div className="bg-white rounded-lg p-4 border-2 border-gray-200 shadow-sm">
+              <label className="flex items-center gap-2 text-sm font-bold text-gray-700 cursor-pointer">
+                <input
+                  type="checkbox"
+                  checked={resume}
+                  onChange={(e) => setResume(e.target.checked)}
+                  className="w-4 h-4 accent-purple-600"
+                />
+                <span className="text-lg">♻️</span>
+                Reprendre le traitement interrompu
+              </label>
+              <p className="mt-2 text-xs text-gray-600">
+                Les produits déjà optimisés ne sont pas renvoyés à Gemini
+              </p>
+            </div>
+
             {file && (
               <div className="bg-gradient-to-r from-green-50 to-emerald-50 border-2 border-green-300 rounded-lg p-5 space-y-3">
                 <div className="flex items-center gap-2">
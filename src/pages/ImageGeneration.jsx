@@ -73,14 +73,55 @@ const ImageGeneration = () => {
     setLoadingProducts(true)
     setError(null)
     try {
-      const response = await axios.get('/api/shopify/products')
-      if (response.data.success) {
-        setProducts(response.data.products || [])
-        setMessage(`✅ ${response.data.count} produits chargés`)
-        setTimeout(() => setMessage(null), 3000)
+      // Un produit JSON par ligne (champs utiles seulement): la grille se remplit pendant la lecture
+      const params = new URLSearchParams({ format: 'ndjson', fields: 'id,title,handle,images,variants' })
+      const response = await fetch(`/api/shopify/products?${params}`)
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}))
+        setError(data.error || 'Erreur chargement produits')
+        return
       }
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      const loaded = []
+      let buffer = ''
+      let lastRender = 0
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop() || ''
+        for (const line of lines) {
+          if (line.trim()) {
+            loaded.push(JSON.parse(line))
+          }
+        }
+        // Grille rafraîchie au plus 4 fois par seconde (pas une copie du tableau par ligne reçue)
+        if (Date.now() - lastRender > 250) {
+          setProducts(loaded.slice())
+          lastRender = Date.now()
+        }
+      }
+      if (buffer.trim()) {
+        loaded.push(JSON.parse(buffer))
+      }
+      setProducts(loaded)
+      if (loaded.length === 0) {
+        // Catalogue vide ou synchro en échec: la réponse JSON donne le message d'erreur
+        const check = await axios.get('/api/shopify/products', { params: { limit: 1, fields: 'id' } })
+        if (!check.data.success || check.data.sync_error) {
+          setError(check.data.error || check.data.sync_error)
+          return
+        }
+      }
+      setMessage(`✅ ${loaded.length} produits chargés`)
+      setTimeout(() => setMessage(null), 3000)
     } catch (err) {
-      setError(err.response?.data?.error || 'Erreur chargement produits')
+      setError(err.response?.data?.error || err.message || 'Erreur chargement produits')
     } finally {
       setLoadingProducts(false)
     }
@@ -0,0 +1,108 @@
+"""
+Tests de la copie locale du catalogue Shopify (SQLite dans un dossier temporaire)
+Le client Shopify est remplacé par un catalogue en mémoire: aucun appel réseau.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from catalog_mirror import CatalogMirror
+from catalog_scheduler import CatalogImageScheduler
+
+STORE = 'boutique.myshopify.com'
+
+
+def make_product(product_id, title, updated_at, sku=None, tags=''):
+    return {
+        'id': product_id, 'title': title, 'handle': title.lower().replace(' ', '-'), 'tags': tags,
+        'updated_at': updated_at,
+        'images': [{'id': product_id * 10, 'position': 1, 'src': f'https://cdn.shopify.com/p/{product_id}.jpg?v=1'}],
+        'variants': [{'id': product_id * 100, 'position': 1, 'title': 'Default', 'sku': sku or f'SKU-{product_id}'}],
+    }
+
+
+class FakeCatalog:
+    """Catalogue en mémoire: export complet et produits modifiés depuis une date"""
+
+    def __init__(self, products):
+        self.store_url = STORE
+        self.products = {product['id']: product for product in products}
+        self.calls = []
+
+    def iter_products(self):
+        self.calls.append(('full', None))
+        return iter(list(self.products.values()))
+
+    def iter_products_rest(self, updated_at_min=None):
+        self.calls.append(('incremental', updated_at_min))
+        return iter([product for product in self.products.values() if product['updated_at'] > updated_at_min])
+
+    def find_products_by_sku(self, sku, cancel_event=None):
+        raise AssertionError('Produit présent dans la copie locale: aucune requête Shopify attendue')
+
+
+def test_incremental_sync_keeps_deleted_products_until_full_sync(tmp_path):
+    mirror = CatalogMirror(str(tmp_path / 'catalog.db'))
+    catalog = FakeCatalog([make_product(1, 'Mug Chat', '2026-01-01T10:00:00Z'),
+                           make_product(2, 'Poster Lune', '2026-01-02T10:00:00Z')])
+
+    assert mirror.sync_due(STORE) == 'full'
+    assert mirror.sync(catalog)['mode'] == 'full'
+    assert mirror.sync_state(STORE)['updated_at_cursor'] == '2026-01-02T10:00:00Z'
+
+    # Produit 1 supprimé côté Shopify, produit 2 modifié: l'incrémental ne voit que la modification
+    del catalog.products[1]
+    catalog.products[2] = make_product(2, 'Poster Soleil', '2026-01-03T10:00:00Z')
+    result = mirror.sync(catalog)
+    assert result['mode'] == 'incremental' and result['synced'] == 1 and result['deleted'] == 0
+    assert catalog.calls[1] == ('incremental', '2026-01-02T10:00:00Z')
+    titles = [product['title'] for product in mirror.query_products(STORE)['products']]
+    assert titles == ['Mug Chat', 'Poster Soleil']
+
+    # Synchro complète: les produits absents de l'export sont retirés, images et variantes comprises
+    result = mirror.sync(catalog, full=True)
+    assert result['mode'] == 'full' and result['deleted'] == 1
+    assert [product['id'] for product in mirror.query_products(STORE)['products']] == [2]
+    assert mirror.product_id_for_image(STORE, 'https://cdn.shopify.com/p/1.jpg') is None
+    assert mirror.sync_due(STORE) is None
+
+
+def test_scheduler_resolves_products_from_mirror(tmp_path):
+    mirror = CatalogMirror(str(tmp_path / 'catalog.db'))
+    catalog = FakeCatalog([make_product(7, 'Mug Chat', '2026-01-01T10:00:00Z')])
+    mirror.sync(catalog)
+
+    # URL comparée sans paramètres; une URL qui ne fait que commencer pareil ne correspond pas
+    assert mirror.product_id_for_image(STORE, 'https://cdn.shopify.com/p/7.jpg?v=99') == 7
+    assert mirror.product_id_for_image(STORE, 'https://cdn.shopify.com/p/7.jpgx') is None
+    scheduler = CatalogImageScheduler(None, catalog, catalog_mirror=mirror)
+    assert scheduler.resolve_product({'source_url': 'https://cdn.shopify.com/p/7.jpg', 'sku': 'SKU-7'}) == 7
+
+
+def test_search_and_keyset_pagination(tmp_path):
+    mirror = CatalogMirror(str(tmp_path / 'catalog.db'))
+    products = [make_product(number, f'Mug Chat {number}', '2026-01-01T10:00:00Z') for number in range(1, 6)]
+    products.append(make_product(6, 'Poster "Lune" bleue', '2026-01-01T10:00:00Z', sku='AB-POSTER', tags='déco, ciel'))
+    mirror.sync(FakeCatalog(products))
+
+    # Sous-chaînes du titre, des tags et des SKU; guillemets pris tels quels
+    assert [product['id'] for product in mirror.query_products(STORE, search='oster')['products']] == [6]
+    assert [product['id'] for product in mirror.query_products(STORE, search='ab-post')['products']] == [6]
+    assert [product['id'] for product in mirror.query_products(STORE, search='ciel')['products']] == [6]
+    assert [product['id'] for product in mirror.query_products(STORE, search='"Lune"')['products']] == [6]
+    assert mirror.query_products(STORE, search='Lune" OR "Mug')['products'] == []
+    # Moins de 3 caractères: recherche LIKE
+    assert [product['id'] for product in mirror.query_products(STORE, search='AB')['products']] == [6]
+    assert mirror.count_products(STORE, search='chat') == 5
+
+    # Pages de 2 par curseur: aucun produit perdu ni répété, dernière page sans curseur
+    pages, cursor = [], None
+    while True:
+        page = mirror.query_products(STORE, search='chat', after_id=cursor, limit=2, fields=['id', 'title'])
+        pages.append([product['id'] for product in page['products']])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [[1, 2], [3, 4], [5]]
+    assert set(page['products'][0]) == {'id', 'title'}
@@ -0,0 +1,43 @@
+"""
+Tests du stockage persistant des contenus Etsy générés (SQLite dans un dossier temporaire)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from content_store import ListingContentStore
+
+PHOTO = 'https://cdn.shopify.com/s/files/1/products/mug.jpg?v=111&width=600'
+
+
+def test_content_reused_for_same_image_and_prompt_only(tmp_path):
+    db_path = str(tmp_path / 'listing_content.db')
+    store = ListingContentStore(db_path)
+    key = ListingContentStore.product_key(PHOTO)
+    # Même produit quelle que soit la version CDN ou la largeur demandée
+    assert key == ListingContentStore.product_key('https://cdn.shopify.com/s/files/1/products/mug.jpg?v=222')
+
+    store.put(key, 'hash-1', 'listing-v1-json', {
+        'sku': 'MUG-1', 'title': 'Mug', 'description': 'Grès', 'tags': 'mug, tasse', 'category': 'Maison',
+        'duplicate_of_key': 'https://cdn.shopify.com/s/files/1/products/bowl.jpg',
+        'needs_title_differentiation': True,
+    }, source_version='111')
+
+    content = store.get(key, 'hash-1', 'listing-v1-json')
+    assert content['title'] == 'Mug' and content['tags'] == 'mug, tasse'
+    # Marqueurs de doublon gardés, champs hors contenu (SKU) non stockés
+    assert content['duplicate_of_key'].endswith('bowl.jpg')
+    assert content['needs_title_differentiation'] is True
+    assert 'sku' not in content
+    # Nouvelle image ou nouveau prompt: régénération
+    assert store.get(key, 'hash-2', 'listing-v1-json') is None
+    assert store.get(key, 'hash-1', 'listing-v2-json') is None
+    # Même version CDN: retrouvé sans télécharger l'image
+    assert store.get_for_version(key, '111', 'listing-v1-json')['title'] == 'Mug'
+    assert store.get_for_version(key, '222', 'listing-v1-json') is None
+    assert store.stats() == {'entries': 1, 'hits': 2, 'misses': 3}
+
+    # Persisté sur disque: retrouvé après redémarrage
+    assert ListingContentStore(db_path).get(key, 'hash-1', 'listing-v1-json')['title'] == 'Mug'
+
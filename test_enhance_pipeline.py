@@ -0,0 +1,163 @@
+"""
+Tests de l'optimisation Gemini (journal de reprise, pipeline, doublons, annulation)
+Gemini et le CDN sont remplacés par des fonctions locales: aucun appel réseau.
+"""
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import pandas as pd
+
+from config import ENHANCE_CONFIG
+from enhance_pipeline import EnhancePipeline
+from gemini_enhancer import GeminiEnhancer
+
+
+def write_csv(path, count):
+    rows = []
+    for number in range(1, count + 1):
+        rows.append({'SKU': f'SKU-{number}', 'Title': '', 'Description': '', 'Tags': '', 'Category': '',
+                     'Photo 1': f'https://cdn.shopify.com/products/photo_{number}.jpg'})
+        # Ligne variante: pas de Photo 1, jamais envoyée à Gemini
+        rows.append({'SKU': f'SKU-{number}-L', 'Title': '', 'Description': '', 'Tags': '', 'Category': '',
+                     'Photo 1': ''})
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def make_enhancer(on_generate=None, download=None):
+    """
+    Enhancer sans client Gemini: l'image "téléchargée" est l'URL, le contenu est généré localement
+
+    Returns:
+        tuple: (enhancer, liste des URLs envoyées à la génération)
+    """
+    enhancer = GeminiEnhancer.__new__(GeminiEnhancer)
+    enhancer.content_store = None
+    enhancer.output_mode = 'text'
+    enhancer.category_matcher = None
+    generated = []
+    lock = threading.Lock()
+
+    def generate_product_content(image_bytes):
+        with lock:
+            generated.append(image_bytes.decode())
+        if on_generate is not None:
+            on_generate()
+        return {'title': f'Titre {image_bytes.decode()}', 'description': 'Description', 'tags': 'mug, tasse'}
+
+    enhancer.download_image_as_base64 = download or (lambda url: url.encode())
+    enhancer.generate_product_content = generate_product_content
+    return enhancer, generated
+
+
+def test_resumed_run_skips_journaled_products(tmp_path, monkeypatch):
+    monkeypatch.setitem(ENHANCE_CONFIG, 'dedup', False)
+    input_path, output_path = tmp_path / 'temp_etsy.csv', tmp_path / 'etsy_final.csv'
+    write_csv(input_path, 4)
+    photos = {f'https://cdn.shopify.com/products/photo_{number}.jpg' for number in range(1, 5)}
+
+    # Traitement interrompu (client parti) après le premier produit: les autres téléchargements
+    # ne se terminent qu'après la fermeture du flux
+    first_photo = 'https://cdn.shopify.com/products/photo_1.jpg'
+    gate = threading.Event()
+
+    def download(url):
+        if url != first_photo:
+            gate.wait(5)
+        return url.encode()
+
+    enhancer, generated = make_enhancer(download=download)
+    run = enhancer.enhance_generator(str(input_path), str(output_path))
+    for progress in run:
+        if progress['message'].startswith('✅'):
+            break
+    closer = threading.Thread(target=run.close)
+    closer.start()
+    closer.join(0.5)
+    gate.set()
+    closer.join()
+    with open(tmp_path / 'etsy_final.journal.jsonl', encoding='utf-8') as f:
+        journaled = {json.loads(line)['key'].split('|', 1)[1] for line in f}
+    assert journaled == {first_photo}
+
+    # Reprise: seuls les produits absents du journal repartent vers Gemini
+    enhancer, generated = make_enhancer()
+    events = list(enhancer.enhance_generator(str(input_path), str(output_path), resume=True))
+
+    assert set(generated) == photos - journaled
+    assert events[-1]['status'] == 'complete'
+    assert events[-1]['products_count'] == 4
+    df = pd.read_csv(output_path)
+    main_rows = df[df['Photo 1'].notna()]
+    assert list(main_rows['Title']) == [f'Titre {photo}' for photo in main_rows['Photo 1']]
+    assert df[df['Photo 1'].isna()]['Title'].isna().all()
+
+
+def test_failed_leader_promotes_a_follower():
+    # Trois images "identiques": la première est leader, les autres attendent son résultat
+    attached = threading.Event()
+    inferred = []
+
+    def hash_fn(payload):
+        if payload == 'c':
+            attached.set()
+        return 0
+
+    def infer_fn(item, payload):
+        inferred.append(item)
+        if item == 'a':
+            attached.wait(5)
+            raise RuntimeError('Gemini indisponible')
+        return {'title': item}
+
+    pipeline = EnhancePipeline(
+        prepare_fn=lambda item: item, infer_fn=infer_fn, download_workers=1, inference_workers=1,
+        hash_fn=hash_fn, fan_out_fn=lambda result, leader, item, payload: {**result, 'duplicate_of': leader}
+    )
+    results = {}
+    consumer = threading.Thread(target=lambda: results.update(
+        (key, (result, error)) for key, result, error in pipeline.run([('a', 'a'), ('b', 'b'), ('c', 'c')])
+    ))
+    consumer.start()
+    consumer.join(10)
+
+    # Sans promotion, run() attendrait indéfiniment les résultats des doublons
+    assert not consumer.is_alive()
+    assert inferred == ['a', 'b']
+    assert results['a'][0] is None and isinstance(results['a'][1], RuntimeError)
+    assert results['b'] == ({'title': 'b'}, None)
+    assert results['c'] == ({'title': 'b', 'duplicate_of': 'b'}, None)
+
+
+def test_follower_copy_is_not_counted_as_store_hit():
+    enhancer, _ = make_enhancer()
+    leader = {'sku': 'SKU-1', 'title': 'Mug', 'description': 'Description', 'tags': 'mug', 'from_store': True}
+
+    copy = enhancer.fan_out_duplicate(leader, 0, {'SKU': 'SKU-2', 'Photo 1': 'https://cdn.shopify.com/b.jpg'}, b'b')
+
+    # Contenu recopié du leader: ni relu du store, ni compté dans store_hits
+    assert 'from_store' not in copy
+    assert copy['sku'] == 'SKU-2' and copy['title'] == 'Mug'
+    assert copy['duplicate_of'] == 0 and copy['needs_title_differentiation']
+
+
+def test_cancel_stops_gemini_calls_and_reports_cancelled(tmp_path, monkeypatch):
+    monkeypatch.setitem(ENHANCE_CONFIG, 'dedup', False)
+    input_path, output_path = tmp_path / 'temp_etsy.csv', tmp_path / 'etsy_final.csv'
+    write_csv(input_path, 5)
+    # Client déconnecté pendant le premier appel Gemini
+    cancel_event = threading.Event()
+    enhancer, generated = make_enhancer(on_generate=cancel_event.set)
+
+    events = list(enhancer.enhance_generator(str(input_path), str(output_path), download_workers=1,
+                                             inference_workers=1, cancel_event=cancel_event))
+
+    assert len(generated) == 1
+    assert events[-1]['status'] == 'cancelled'
+    # Le résultat de l'appel en cours est gardé pour la reprise, aucun CSV final écrit
+    with open(tmp_path / 'etsy_final.journal.jsonl', encoding='utf-8') as f:
+        assert len(f.readlines()) == 1
+    assert not output_path.exists()
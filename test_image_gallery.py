@@ -0,0 +1,44 @@
+"""
+Tests de la galerie locale des images générées (dossier temporaire)
+"""
+import os
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from PIL import Image
+
+from image_gallery import ImageGallery
+
+
+def make_image(color, image_format='JPEG'):
+    buffered = BytesIO()
+    Image.new('RGB', (16, 16), color).save(buffered, format=image_format)
+    return buffered.getvalue()
+
+
+def test_generated_images_kept_for_reupload(tmp_path):
+    gallery = ImageGallery(str(tmp_path / 'gallery'))
+    red, blue = make_image('red'), make_image('blue', 'PNG')
+
+    gallery.start_run('gid://shopify/Product/42', 'https://cdn.shopify.com/mug.jpg', replace=True)
+    gallery.add_image(42, 2, blue)
+    gallery.add_image(42, 1, red)
+    # Variation régénérée: remplace l'entrée précédente
+    gallery.add_image(42, 2, red)
+    gallery.set_status(42, 'upload_failed', error='Shopify indisponible')
+
+    manifest = gallery.manifest(42)
+    assert manifest['status'] == 'upload_failed' and manifest['replace'] is True
+    assert [image['variation'] for image in manifest['images']] == [1, 2]
+    assert gallery.images(42) == [(1, red), (2, red)]
+    assert gallery.images(42, order=[2, 1, 7]) == [(2, red), (1, red)]
+    # Adressage par contenu: une seule copie d'une image identique, type d'après la signature
+    blobs = [name for _, _, files in os.walk(tmp_path / 'gallery' / 'blobs') for name in files]
+    assert sorted(name.rsplit('.', 1)[1] for name in blobs) == ['jpg', 'png']
+
+    # Nouvelle génération: manifeste remis à zéro, images déjà stockées gardées sur disque
+    gallery.start_run(42, replace=False)
+    assert gallery.images(42) == []
+    assert gallery.manifest(43) is None
@@ -0,0 +1,39 @@
+"""
+Tests du parsing JSON des contenus Etsy et de la validation locale des limites Etsy
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from listing_schema import TAGS_COUNT, invalid_fields, normalize_tags, parse_listing_json, shorten_title
+
+
+def test_parse_listing_json_accepts_fenced_json_and_rejects_garbage():
+    listing = parse_listing_json('```json\n{"title": "Mug", "description": "Grès", "tags": "mug, tasse"}\n```')
+
+    assert listing == {'title': 'Mug', 'description': 'Grès', 'tags': ['mug', ' tasse']}
+    assert parse_listing_json('Title: Mug') is None
+    assert parse_listing_json('["mug"]') is None
+    # Champs absents ou de mauvais type: chaînes vides et liste vide (réparés ensuite)
+    assert parse_listing_json('{"title": null, "tags": 3}') == {'title': '', 'description': '', 'tags': []}
+
+
+def test_normalize_tags_keeps_only_valid_etsy_tags():
+    tags = normalize_tags([
+        'Ceramic Mug', 'ceramic   mug', 'tasse, café', 'bathroomfaucet',
+        'way too long tag for etsy', 'one two three four', 42, '',
+    ])
+
+    # Minuscules, espaces normalisés, dédoublonnés, mots collés séparés, limites Etsy respectées
+    assert tags == ['ceramic mug', 'tasse café', 'bathroom faucet']
+    assert len(normalize_tags([f'tag {number}' for number in range(20)])) == TAGS_COUNT
+
+
+def test_invalid_fields_after_local_cleanup():
+    long_title = ' | '.join(['Handmade ceramic coffee mug'] * 8)
+    title = shorten_title(long_title)
+
+    assert len(title) <= 140 and title.endswith('mug')
+    listing = {'title': title, 'description': '', 'tags': normalize_tags(['mug'] * 13)}
+    assert invalid_fields(listing) == ['description', 'tags']
@@ -0,0 +1,32 @@
+"""
+Tests du stockage persistant des prompts de mise en scène (SQLite dans un dossier temporaire)
+"""
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import prompt_store
+from prompt_store import ScenePromptStore
+
+
+def test_least_recently_used_prompts_evicted_over_budget(tmp_path, monkeypatch):
+    # Horloge strictement croissante: l'ordre d'utilisation ne dépend pas de la résolution du système
+    clock = itertools.count(1)
+    monkeypatch.setattr(prompt_store.time, 'time', lambda: next(clock))
+    store = ScenePromptStore(str(tmp_path / 'scene_prompts.db'), max_entries=2)
+
+    store.put('hash-a', 10, 'v1', ['scène a'])
+    store.put('hash-b', 10, 'v1', ['scène b'])
+    # Relu: hash-a devient le plus récemment utilisé
+    assert store.get('hash-a', 10, 'v1') == ['scène a']
+    store.put('hash-c', 10, 'v1', ['scène c'])
+
+    assert store.get('hash-b', 10, 'v1') is None
+    assert store.get('hash-a', 10, 'v1') == ['scène a']
+    assert store.get('hash-c', 10, 'v1') == ['scène c']
+    # Autre nombre de prompts ou autre version d'analyse: pas de réutilisation
+    assert store.get('hash-a', 5, 'v1') is None
+    assert store.get('hash-a', 10, 'v2') is None
+    assert store.stats() == {'entries': 2, 'hits': 3, 'misses': 3, 'evicted': 1}
@@ -0,0 +1,118 @@
+"""
+Tests de l'image source de référence (upload unique, réutilisée par toutes les variations)
+Gemini et l'API Files sont remplacés par des stand-ins locaux: aucun appel réseau
+"""
+import os
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import pytest
+from google.genai import errors, types
+from PIL import Image
+
+from image_generator import ImageGenerator
+from reference_uploader import ReferenceUploader
+
+
+def make_png(color='red'):
+    buffered = BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+class LocalFilesUploader(ReferenceUploader):
+    """Stand-in local de l'API Files: compte les uploads et renvoie une URI factice"""
+
+    def __init__(self):
+        # Espace de noms propre à l'instance: le cache de références est partagé par le process
+        self.namespace = f'local:{id(self)}'
+        self.uploads = 0
+
+    def upload(self, image_bytes, mime_type):
+        self.uploads += 1
+        reference = types.Part.from_uri(file_uri=f'local://files/{self.uploads}', mime_type=mime_type)
+        return reference, None
+
+
+class _Part:
+    def __init__(self, data):
+        self.inline_data = types.Blob(data=data, mime_type='image/png')
+
+
+class _Response:
+    def __init__(self, text=None, image=None):
+        self.text = text
+        self.parts = [_Part(image)] if image else []
+
+
+class LocalModels:
+    """Stand-in de client.models: garde les contents reçus, échoue sur demande"""
+
+    def __init__(self, num_prompts):
+        self.calls = []
+        self.failures = []
+        self.analysis_text = '\n'.join(
+            f"{i}. A realistic scene number {i} with natural light on a wooden table." for i in range(1, num_prompts + 1)
+        )
+
+    def generate_content(self, model, contents):
+        self.calls.append(contents)
+        if self.failures:
+            raise self.failures.pop(0)
+        if model == 'gemini-2.5-flash':
+            return _Response(text=self.analysis_text)
+        return _Response(image=make_png('blue'))
+
+
+class LocalClient:
+    def __init__(self, num_prompts):
+        self.models = LocalModels(num_prompts)
+
+
+def make_generator(num_prompts):
+    uploader = LocalFilesUploader()
+    generator = ImageGenerator('test-key', reference_mode='files', reference_uploader=uploader)
+    generator.client = LocalClient(num_prompts)
+    return generator, uploader
+
+
+def references(calls):
+    return [contents[1].file_data.file_uri for contents in calls]
+
+
+def test_reference_uploader_is_abstract():
+    with pytest.raises(TypeError):
+        ReferenceUploader()
+
+
+def test_files_handle_reused_across_variations():
+    generator, uploader = make_generator(4)
+    source = make_png()
+
+    prompts = generator.analyze_and_generate_prompts(source, 4)
+    assert len(prompts) == 4
+    for variation_num, prompt in enumerate(prompts, start=1):
+        assert generator.generate_variation(source, prompt, variation_num, lambda event: None)
+
+    # Une analyse + 4 variations, une seule image uploadée
+    assert uploader.uploads == 1
+    assert references(generator.client.models.calls) == ['local://files/1'] * 5
+
+
+def test_handle_kept_on_transient_error_and_dropped_when_invalid():
+    generator, uploader = make_generator(2)
+    source = make_png('green')
+    models = generator.client.models
+
+    # Quota dépassé: la référence reste valable, pas de ré-upload
+    models.failures.append(errors.ClientError(429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}}))
+    assert generator.generate_variation(source, 'prompt', 1, lambda event: None, max_retries=1)
+    assert uploader.uploads == 1
+
+    # Fichier expiré côté Google: référence oubliée, ré-upload au prochain essai
+    models.failures.append(errors.ClientError(403, {'error': {'code': 403, 'status': 'PERMISSION_DENIED'}}))
+    assert generator.generate_variation(source, 'prompt', 2, lambda event: None, max_retries=1)
+    assert uploader.uploads == 2
+    assert references(models.calls) == ['local://files/1'] * 3 + ['local://files/2']
@@ -0,0 +1,540 @@
+"""
+Tests du client Shopify contre un stand-in local de l'Admin API (aucun appel réseau)
+Le stand-in couvre les appels utilisés par l'application: images REST, staged uploads,
+productCreateMedia et statut des médias, export bulk (JSONL) et pagination REST du catalogue.
+"""
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import pytest
+from PIL import Image
+
+from config import SHOPIFY_API_CONFIG, SHOPIFY_UPLOAD_CONFIG
+from catalog_scheduler import CatalogImageScheduler
+from shopify_client import ShopifyClient, get_shopify_client
+from upload_pipeline import ProductImageUploader
+
+
+def make_jpeg(color='red'):
+    buffered = BytesIO()
+    Image.new('RGB', (32, 32), color).save(buffered, format='JPEG')
+    return buffered.getvalue()
+
+
+class LocalAdminAPI(ThreadingHTTPServer):
+    """
+    Stand-in de l'Admin API d'une boutique
+    Les médias passent par UPLOADED → PROCESSING → READY (ou FAILED pour les fichiers de
+    failed_files) à chaque lecture de statut, comme le traitement asynchrone de Shopify.
+    Ceux de stuck_files restent en PROCESSING.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), AdminAPIHandler)
+        self.host = f'http://127.0.0.1:{self.server_port}'
+        self.base_url = f'{self.host}/admin/api/2025-01'
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+        self.images = {}
+        self.staged = {}
+        self.media = {}
+        self.failed_files = set()
+        self.stuck_files = set()
+        self.operations = []
+        # Catalogue: lignes JSONL de l'export bulk et produits de /products.json
+        self.bulk_lines = []
+        self.bulk_busy = False
+        self.bulk_running = False
+        self.rest_products = []
+        # SKU des variantes: {product_id: [sku, ...]}
+        self.skus = {}
+        self.page_size = 2
+        # Réponses 503 à renvoyer: {méthode HTTP: nombre}
+        self.server_errors = {}
+        self.requests = []
+        # Connexions TCP ouvertes par les clients et jetons reçus par le stockage staged
+        self.connections = 0
+        self.staged_tokens = []
+
+    def fail(self, method):
+        with self.lock:
+            self.requests.append(method)
+            if self.server_errors.get(method):
+                self.server_errors[method] -= 1
+                return True
+            return False
+
+    def add_product(self, product_id, image_count):
+        self.images[product_id] = [
+            {'id': next(self.ids), 'src': f'{self.host}/cdn/old_{index}.jpg'} for index in range(image_count)
+        ]
+        return [image['id'] for image in self.images[product_id]]
+
+    def product_images(self, product_id):
+        with self.lock:
+            return [dict(image, position=position)
+                    for position, image in enumerate(self.images.get(product_id, []), start=1)]
+
+    def graphql(self, query, variables):
+        operation = re.search(r'(?:query|mutation)\s+(\w+)', query).group(1)
+        self.operations.append(operation)
+        if operation == 'stagedUploadsCreate':
+            targets = []
+            for item in variables['input']:
+                key = f"tmp/{next(self.ids)}/{item['filename']}"
+                targets.append({
+                    'url': f'{self.host}/staged',
+                    'resourceUrl': f'{self.host}/{key}',
+                    'parameters': [{'name': 'key', 'value': key}],
+                })
+            return {'stagedUploadsCreate': {'stagedTargets': targets, 'userErrors': []}}
+        if operation == 'productCreateMedia':
+            product_id = int(variables['productId'].rsplit('/', 1)[-1])
+            media = []
+            with self.lock:
+                for item in variables['media']:
+                    key = item['originalSource'].split(f'{self.host}/', 1)[-1]
+                    media_id = f'gid://shopify/MediaImage/{next(self.ids)}'
+                    self.media[media_id] = {'product_id': product_id, 'key': key, 'status': 'UPLOADED'}
+                    media.append({'id': media_id, 'status': 'UPLOADED'})
+            return {'productCreateMedia': {'media': media, 'mediaUserErrors': []}}
+        if operation == 'mediaStatus':
+            nodes = []
+            with self.lock:
+                for media_id in variables['ids']:
+                    media = self.media[media_id]
+                    if media['status'] == 'UPLOADED':
+                        media['status'] = 'PROCESSING'
+                    elif media['status'] == 'PROCESSING':
+                        filename = media['key'].rsplit('/', 1)[-1]
+                        if filename in self.stuck_files:
+                            pass
+                        elif filename in self.failed_files:
+                            media['status'] = 'FAILED'
+                        else:
+                            media['status'] = 'READY'
+                            media['image_id'] = next(self.ids)
+                            self.images[media['product_id']].append(
+                                {'id': media['image_id'], 'src': f"{self.host}/cdn/{filename}"}
+                            )
+                    image = {'url': f"{self.host}/cdn/{media['key'].rsplit('/', 1)[-1]}"}
+                    nodes.append({'id': media_id, 'status': media['status'],
+                                  'image': image if media['status'] == 'READY' else None})
+            return {'nodes': nodes}
+        if operation == 'productDeleteMedia':
+            product_id = int(variables['productId'].rsplit('/', 1)[-1])
+            deleted = []
+            with self.lock:
+                for media_id in variables['mediaIds']:
+                    media = self.media.pop(media_id, None)
+                    if media is None:
+                        continue
+                    self.images[product_id] = [image for image in self.images[product_id]
+                                               if image['id'] != media.get('image_id')]
+                    deleted.append(media_id)
+            return {'productDeleteMedia': {'deletedMediaIds': deleted, 'mediaUserErrors': []}}
+        if operation == 'productsBySku':
+            sku = re.fullmatch(r'sku:"(.*)"', variables['query']).group(1)
+            nodes = [
+                {'product': {'id': f'gid://shopify/Product/{product_id}', 'images': {'nodes': [
+                    {'url': image['src']} for image in self.product_images(product_id)
+                ]}}}
+                for product_id, skus in self.skus.items() if sku in skus
+            ]
+            return {'productVariants': {'nodes': nodes}}
+        if operation == 'bulkOperationRunQuery':
+            if self.bulk_busy:
+                errors = [{'field': None, 'message': 'A bulk query operation for this app and shop is already in progress'}]
+                return {'bulkOperationRunQuery': {'bulkOperation': None, 'userErrors': errors}}
+            operation = {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'}
+            return {'bulkOperationRunQuery': {'bulkOperation': operation, 'userErrors': []}}
+        if operation == 'bulkOperationStatus':
+            status = 'RUNNING' if self.bulk_running else 'COMPLETED'
+            return {'node': {
+                'id': variables['id'], 'status': status, 'errorCode': None,
+                'objectCount': str(len(self.bulk_lines)),
+                'url': f'{self.host}/bulk/result.jsonl' if status == 'COMPLETED' else None,
+            }}
+        if operation == 'bulkOperationCancel':
+            self.bulk_running = False
+            operation = {'id': variables['id'], 'status': 'CANCELING'}
+            return {'bulkOperationCancel': {'bulkOperation': operation, 'userErrors': []}}
+        raise KeyError(operation)
+
+
+class AdminAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Shopify-Shop-Api-Call-Limit', '1/40')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.fail('GET'):
+            return self._send(503, {'errors': 'Service Unavailable'})
+        match = re.search(r'/products/(\d+)/images\.json$', self.path)
+        if match:
+            return self._send(200, {'images': self.server.product_images(int(match.group(1)))})
+        if self.path == '/bulk/result.jsonl':
+            body = '\n'.join(json.dumps(line) for line in self.server.bulk_lines).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        url = urlsplit(self.path)
+        if url.path.endswith('/products.json'):
+            # Curseur page_info: index du premier produit de la page
+            start = int(parse_qs(url.query).get('page_info', ['0'])[0])
+            end = start + self.server.page_size
+            headers = {}
+            if end < len(self.server.rest_products):
+                headers['Link'] = f'<{self.server.base_url}/products.json?limit=250&page_info={end}>; rel="next"'
+            return self._send(200, {'products': self.server.rest_products[start:end]}, headers)
+        self._send(404, {'errors': 'Not Found'})
+
+    def do_DELETE(self):
+        match = re.search(r'/products/(\d+)/images/(\d+)\.json$', self.path)
+        product_id, image_id = int(match.group(1)), int(match.group(2))
+        self.server.operations.append('deleteImage')
+        with self.server.lock:
+            self.server.images[product_id] = [
+                image for image in self.server.images[product_id] if image['id'] != image_id
+            ]
+        self._send(200, {})
+
+    def do_POST(self):
+        body = self._body()
+        if self.server.fail('POST'):
+            return self._send(503, {'errors': 'Service Unavailable'})
+        if self.path == '/staged':
+            # Multipart: champs de la cible puis le fichier brut
+            message = BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                      for part in message.get_payload()}
+            self.server.staged[fields['key'].decode()] = fields['file']
+            self.server.staged_tokens.append(self.headers.get('X-Shopify-Access-Token'))
+            self.send_response(201)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.endswith('/graphql.json'):
+            request = json.loads(body)
+            return self._send(200, {'data': self.server.graphql(request['query'], request.get('variables') or {})})
+        self._send(404, {'errors': 'Not Found'})
+
+
+@pytest.fixture
+def admin_api():
+    server = LocalAdminAPI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(admin_api, name):
+    # Une boutique par test: les seaux de l'Admin API sont partagés par boutique
+    return ShopifyClient(f'{name}.myshopify.com', access_token='test-token', api_base_url=admin_api.base_url)
+
+
+def test_staged_upload_replaces_images_once_media_ready(admin_api):
+    client = make_client(admin_api, 'staged-ready')
+    old_ids = admin_api.add_product(1, 2)
+    images = [make_jpeg(color) for color in ('red', 'green', 'blue')]
+
+    uploader = ProductImageUploader(client, 1, method='staged', expected_images=3)
+    # Les variations finissent dans le désordre
+    for variation in (2, 3, 1):
+        uploader.submit(variation, images[variation - 1])
+    result = uploader.finish()
+
+    assert result['success']
+    assert result['uploaded_count'] == 3
+    assert result['new_urls'] == [f'{admin_api.host}/cdn/ai_generated_{number}.jpg' for number in (1, 2, 3)]
+    # Une seule mutation pour les cibles et une seule pour les médias
+    assert admin_api.operations.count('stagedUploadsCreate') == 1
+    assert admin_api.operations.count('productCreateMedia') == 1
+    # Anciennes images supprimées seulement après le dernier statut (tous les médias READY)
+    last_status = len(admin_api.operations) - admin_api.operations[::-1].index('mediaStatus') - 1
+    assert admin_api.operations.index('deleteImage') > last_status
+    # Bytes bruts envoyés au stockage (pas de base64)
+    assert sorted(admin_api.staged.values()) == sorted(images)
+
+    remaining = admin_api.product_images(1)
+    assert not set(old_ids) & {image['id'] for image in remaining}
+    assert [image['src'].rsplit('/', 1)[-1] for image in remaining] == [
+        'ai_generated_1.jpg', 'ai_generated_2.jpg', 'ai_generated_3.jpg'
+    ]
+
+
+def test_failed_media_not_counted_and_old_images_kept(admin_api):
+    client = make_client(admin_api, 'staged-failed')
+    admin_api.add_product(2, 2)
+
+    # Une image refusée par Shopify: seules les deux autres comptent
+    admin_api.failed_files.add('ai_generated_2.jpg')
+    uploader = ProductImageUploader(client, 2, method='staged', expected_images=3)
+    for variation in (1, 2, 3):
+        uploader.submit(variation, make_jpeg())
+    result = uploader.finish()
+    assert result['success']
+    assert result['uploaded_count'] == 2
+    assert len(result['new_urls']) == 2
+    # Le média FAILED est retiré du produit (un nouvel essai ne l'empile pas)
+    assert admin_api.operations.count('productDeleteMedia') == 1
+    assert [media['key'].rsplit('/', 1)[-1] for media in admin_api.media.values()] == [
+        'ai_generated_1.jpg', 'ai_generated_3.jpg'
+    ]
+
+    # Tous les médias en échec: le produit garde ses anciennes images
+    old_ids = admin_api.add_product(3, 2)
+    admin_api.failed_files.update({'ai_generated_1.jpg', 'ai_generated_3.jpg'})
+    uploader = ProductImageUploader(client, 3, method='staged', expected_images=3)
+    for variation in (1, 2, 3):
+        uploader.submit(variation, make_jpeg())
+    result = uploader.finish()
+    assert not result['success']
+    assert result['uploaded_count'] == 0
+    assert [image['id'] for image in admin_api.product_images(3)] == old_ids
+    assert not [media for media in admin_api.media.values() if media['product_id'] == 3]
+
+
+def test_media_not_ready_before_timeout_removed_from_product(admin_api, monkeypatch):
+    client = make_client(admin_api, 'staged-timeout')
+    old_ids = admin_api.add_product(7, 2)
+    # Traitement plus long que l'attente: le média deviendrait READY après coup (doublon au prochain essai)
+    monkeypatch.setitem(SHOPIFY_UPLOAD_CONFIG, 'media_ready_timeout', 0.5)
+    admin_api.stuck_files.add('ai_generated_2.jpg')
+
+    uploader = ProductImageUploader(client, 7, method='staged', expected_images=3)
+    for variation in (1, 2, 3):
+        uploader.submit(variation, make_jpeg())
+    result = uploader.finish()
+
+    assert result['success']
+    assert result['new_urls'] == [f'{admin_api.host}/cdn/ai_generated_{number}.jpg' for number in (1, 3)]
+    assert [media['key'].rsplit('/', 1)[-1] for media in admin_api.media.values()] == [
+        'ai_generated_1.jpg', 'ai_generated_3.jpg'
+    ]
+    remaining = admin_api.product_images(7)
+    assert not set(old_ids) & {image['id'] for image in remaining}
+    assert [image['src'].rsplit('/', 1)[-1] for image in remaining] == ['ai_generated_1.jpg', 'ai_generated_3.jpg']
+
+    # Aucun média prêt à temps: échec, médias retirés et anciennes images gardées
+    old_ids = admin_api.add_product(8, 2)
+    monkeypatch.setitem(SHOPIFY_UPLOAD_CONFIG, 'media_ready_timeout', 0)
+    uploader = ProductImageUploader(client, 8, method='staged', expected_images=2)
+    for variation in (1, 2):
+        uploader.submit(variation, make_jpeg())
+    result = uploader.finish()
+
+    assert not result['success']
+    assert not [media for media in admin_api.media.values() if media['product_id'] == 8]
+    assert [image['id'] for image in admin_api.product_images(8)] == old_ids
+
+
+def test_replace_refused_when_existing_images_unreadable(admin_api, monkeypatch):
+    client = make_client(admin_api, 'images-unreadable')
+    admin_api.add_product(9, 2)
+    monkeypatch.setitem(SHOPIFY_API_CONFIG, 'max_retries', 0)
+    admin_api.server_errors['GET'] = 1
+
+    # Liste des anciennes images illisible: rien n'est uploadé (elles resteraient à côté des nouvelles)
+    result = client.replace_product_images(9, [make_jpeg()])
+
+    assert not result['success']
+    assert 'POST' not in admin_api.requests
+    assert len(admin_api.product_images(9)) == 2
+
+
+def test_bulk_export_groups_children_under_their_product(admin_api):
+    client = make_client(admin_api, 'bulk-export')
+    admin_api.bulk_lines = [
+        {'id': 'gid://shopify/Product/1', 'title': 'Mug', 'handle': 'mug', 'status': 'ACTIVE', 'tags': ['cuisine', 'café']},
+        {'id': 'gid://shopify/ProductImage/11', 'url': 'https://cdn.shopify.com/mug_1.jpg', '__parentId': 'gid://shopify/Product/1'},
+        {'id': 'gid://shopify/ProductImage/12', 'url': 'https://cdn.shopify.com/mug_2.jpg', '__parentId': 'gid://shopify/Product/1'},
+        # Variantes exportées dans le désordre: la position renvoyée fait foi
+        {'id': 'gid://shopify/ProductVariant/22', 'sku': 'MUG-L', 'position': 2, '__parentId': 'gid://shopify/Product/1'},
+        {'id': 'gid://shopify/ProductVariant/21', 'sku': 'MUG-S', 'position': 1, '__parentId': 'gid://shopify/Product/1'},
+        {'id': 'gid://shopify/Product/2', 'title': 'Poster', 'handle': 'poster', 'status': 'DRAFT', 'tags': []},
+        {'id': 'gid://shopify/Product/3', 'title': 'Carnet', 'handle': 'carnet', 'status': 'ACTIVE', 'tags': []},
+        {'id': 'gid://shopify/ProductVariant/31', 'sku': 'CARNET', 'position': 1, '__parentId': 'gid://shopify/Product/3'},
+    ]
+
+    products = list(client.iter_products(method='bulk'))
+
+    assert [product['id'] for product in products] == [1, 2, 3]
+    mug, poster, notebook = products
+    assert mug['tags'] == 'cuisine, café'
+    assert mug['status'] == 'active'
+    assert [(image['id'], image['position']) for image in mug['images']] == [(11, 1), (12, 2)]
+    assert mug['image']['src'] == 'https://cdn.shopify.com/mug_1.jpg'
+    assert [(variant['sku'], variant['position']) for variant in mug['variants']] == [('MUG-S', 1), ('MUG-L', 2)]
+    assert poster['images'] == [] and poster['variants'] == [] and poster['image'] is None
+    assert [variant['product_id'] for variant in notebook['variants']] == [3]
+    assert 'bulkOperationCancel' not in admin_api.operations
+
+
+def test_bulk_export_groups_interleaved_children_by_parent_id(admin_api, monkeypatch, capsys):
+    client = make_client(admin_api, 'bulk-interleaved')
+    admin_api.bulk_lines = [
+        {'id': 'gid://shopify/Product/1', 'title': 'Mug', 'tags': []},
+        {'id': 'gid://shopify/Product/2', 'title': 'Poster', 'tags': []},
+        # Enfants des deux produits mélangés, après les deux lignes produit
+        {'id': 'gid://shopify/ProductImage/21', 'url': 'https://cdn.shopify.com/poster.jpg', '__parentId': 'gid://shopify/Product/2'},
+        {'id': 'gid://shopify/ProductImage/11', 'url': 'https://cdn.shopify.com/mug.jpg', '__parentId': 'gid://shopify/Product/1'},
+        {'id': 'gid://shopify/ProductVariant/12', 'sku': 'MUG', 'position': 1, '__parentId': 'gid://shopify/Product/1'},
+        {'id': 'gid://shopify/ProductVariant/22', 'sku': 'POSTER', 'position': 1, '__parentId': 'gid://shopify/Product/2'},
+    ]
+
+    mug, poster = client.iter_products(method='bulk')
+
+    assert [image['id'] for image in mug['images']] == [11]
+    assert [variant['sku'] for variant in mug['variants']] == ['MUG']
+    assert [image['id'] for image in poster['images']] == [21]
+    assert [variant['sku'] for variant in poster['variants']] == ['POSTER']
+
+    # Fenêtre d'un produit: l'enfant arrivé après le produit suivant est signalé, pas attribué au mauvais produit
+    monkeypatch.setitem(SHOPIFY_API_CONFIG, 'bulk_group_window', 1)
+    mug, poster = client.iter_products(method='bulk')
+
+    assert mug['images'] == [] and mug['variants'] == []
+    assert [image['id'] for image in poster['images']] == [21]
+    assert 'ProductImage/11 arrive après son produit gid://shopify/Product/1' in capsys.readouterr().out
+
+
+def test_rest_pagination_when_bulk_refused(admin_api):
+    client = make_client(admin_api, 'bulk-busy')
+    admin_api.bulk_busy = True
+    admin_api.rest_products = [{'id': product_id, 'title': f'Produit {product_id}', 'images': []}
+                               for product_id in range(1, 6)]
+
+    products = list(client.iter_products(method='bulk'))
+
+    # Opération bulk déjà en cours: tout le catalogue par pages REST (Link rel="next")
+    assert [product['id'] for product in products] == [1, 2, 3, 4, 5]
+    assert admin_api.operations == ['bulkOperationRunQuery']
+
+
+def test_bulk_operation_cancelled_when_wait_interrupted(admin_api):
+    client = make_client(admin_api, 'bulk-cancel')
+    admin_api.bulk_running = True
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(Exception, match='interrompue'):
+        list(client.iter_products(method='bulk', cancel_event=cancel_event))
+
+    # L'export abandonné ne bloque pas le suivant: opération annulée côté Shopify
+    assert admin_api.operations[-1] == 'bulkOperationCancel'
+    assert not admin_api.bulk_running
+
+
+def test_server_errors_retried_only_for_idempotent_calls(admin_api):
+    client = make_client(admin_api, 'retry-5xx')
+    admin_api.add_product(4, 1)
+
+    # GET: nouvel essai après le 503
+    admin_api.server_errors['GET'] = 1
+    assert len(client.get_product_images(4)) == 1
+    assert admin_api.requests.count('GET') == 2
+
+    # POST d'image: pas de nouvel essai (l'image a pu être créée avant l'erreur)
+    admin_api.server_errors['POST'] = 1
+    result = client.upload_image_to_product(4, make_jpeg())
+    assert not result['success']
+    assert admin_api.requests.count('POST') == 1
+
+
+def test_cancel_event_interrupts_wait_for_store_bucket(admin_api):
+    client = make_client(admin_api, 'bucket-cancel')
+    admin_api.add_product(5, 1)
+    # Seau en pause: l'appel attend des jetons jusqu'à l'annulation
+    client.rest_limiter.pause(5)
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+
+    result = client.upload_image_to_product(5, make_jpeg(), cancel_event=cancel_event)
+
+    assert not result['success']
+    assert 'annulé' in result['error']
+    assert admin_api.requests == []
+
+
+def test_client_reuses_connections_without_sending_token_to_staged_storage(admin_api, monkeypatch):
+    monkeypatch.setitem(SHOPIFY_API_CONFIG, 'admin_base_url', admin_api.base_url)
+    admin_api.add_product(6, 1)
+    client = get_shopify_client('session-reuse.myshopify.com', access_token='test-token')
+    # Même identifiants d'une requête Flask à l'autre: même client, même session
+    assert get_shopify_client('session-reuse.myshopify.com', access_token='test-token') is client
+
+    for _ in range(3):
+        assert len(client.get_product_images(6)) == 1
+    uploader = ProductImageUploader(client, 6, method='staged', expected_images=1)
+    uploader.submit(1, make_jpeg())
+    result = uploader.finish()
+
+    assert result['success']
+    # Une seule connexion keep-alive pour l'Admin API et le stockage staged (même hôte ici)
+    assert admin_api.connections == 1
+    assert admin_api.staged_tokens == [None]
+
+
+def test_scheduler_finds_products_by_sku_without_catalog_export(admin_api):
+    client = make_client(admin_api, 'scheduler-sku')
+    admin_api.add_product(10, 1)
+    admin_api.skus[10] = ['MUG']
+    source = admin_api.product_images(10)[0]['src']
+    scheduler = CatalogImageScheduler(None, client)
+
+    assert scheduler.resolve_product({'source_url': f'{source}?v=3', 'sku': 'MUG'}) == 10
+    # SKU trouvé mais image d'un autre produit: aucune mise à jour au hasard
+    assert scheduler.resolve_product({'source_url': f'{admin_api.host}/cdn/other.jpg', 'sku': 'MUG'}) is None
+    assert scheduler.resolve_product({'source_url': source, 'sku': None}) is None
+    # Une requête ciblée par image, jamais d'export du catalogue
+    assert admin_api.operations == ['productsBySku', 'productsBySku']
+
+    jobs = [{'key': 1, 'label': 'Inconnu', 'source_url': f'{admin_api.host}/cdn/other.jpg', 'sku': 'AUTRE'}]
+    events = list(scheduler.run(jobs))
+    assert [event['status'] for event in events] == ['indexing', 'skipped']
+
+    # Annulé pendant la recherche: aucune requête de plus
+    cancel_event = threading.Event()
+    cancel_event.set()
+    events = list(CatalogImageScheduler(None, client, cancel_event=cancel_event).run(jobs * 3))
+    assert [event['status'] for event in events] == ['indexing']
+    assert admin_api.operations.count('productsBySku') == 3